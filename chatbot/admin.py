@@ -1,3 +1,50 @@
-from django.contrib import admin
+# chatbot/admin.py
+import html
+import json
 
-# Register your models here.
+from django.contrib import admin, messages
+from django.utils.safestring import mark_safe
+
+from .models import ScoringTable
+
+
+@admin.register(ScoringTable)
+class ScoringTableAdmin(admin.ModelAdmin):
+    list_display = ('version', 'is_active', 'notes', 'created_at')
+    list_filter = ('is_active',)
+    ordering = ('-version',)
+    actions = ['activate_table']
+
+    fields = ('version', 'is_active', 'score_map', 'weights_map', 'notes', 'created_at')
+
+    def get_readonly_fields(self, request, obj=None):
+        # Versões existentes são imutáveis (relatórios apontam para elas); ative via ação
+        if obj:
+            return ('version', 'is_active', 'score_map_formatted', 'weights_map_formatted', 'created_at')
+        return ('version', 'is_active', 'created_at')
+
+    def get_fields(self, request, obj=None):
+        if obj:
+            return ('version', 'is_active', 'score_map_formatted', 'weights_map_formatted', 'notes', 'created_at')
+        return ('score_map', 'weights_map', 'notes')
+
+    def _pretty_json(self, data):
+        json_str = html.escape(json.dumps(data, indent=4, ensure_ascii=False))
+        return mark_safe(f'<pre style="background: #f4f4f4; border: 1px solid #ddd; padding: 10px; border-radius: 5px;">{json_str}</pre>')
+
+    @admin.display(description="Pontuações")
+    def score_map_formatted(self, obj):
+        return self._pretty_json(obj.score_map)
+
+    @admin.display(description="Pesos")
+    def weights_map_formatted(self, obj):
+        return self._pretty_json(obj.weights_map)
+
+    @admin.action(description="Ativar a versão selecionada")
+    def activate_table(self, request, queryset):
+        if queryset.count() != 1:
+            self.message_user(request, "Selecione exatamente uma versão para ativar.", level=messages.ERROR)
+            return
+        table = queryset.get()
+        table.activate()
+        self.message_user(request, f"Tabela v{table.version} ativada. Os workers passam a usá-la em segundos.")
@@ -1,9 +1,14 @@
 # chatbot/agents.py
-import google.generativeai as genai
 from django.conf import settings
 import json
 import logging
 import re # Para limpar o JSON
+import time
+from .analysis_cache import make_cache_key, get_cached_analysis, set_cached_analysis
+from .insights import format_brl
+from .gemini_client import get_gemini_model, record_generation
+from .stream_json import IncrementalJSONObjectParser
+from .rate_limit import acquire_or_raise
 
 logger = logging.getLogger(__name__)
 
@@ -13,37 +18,42 @@ def run_analysis_agent(
     setor_atuacao: str, 
     indicadores: dict, 
     valores_criterios: list, 
-    valuation_base: float
+    valuation_base: float,
+    use_cache: bool = True,
+    on_field=None
 ) -> dict:
     """
-    Chama a API Gemini para analisar os dados JÁ CALCULADOS,
-    estimar cenários, e gerar o prompt final do Gamma.
+    Chama a API Gemini para analisar os dados JÁ CALCULADOS e retorna
+    apenas o campo de julgamento 'recomendacao_investidor' (os cenários são
+    simulados localmente em chatbot/scenarios.py).
+    Respostas são cacheadas pelo conteúdo dos inputs; use_cache=False
+    ignora a leitura do cache (a resposta nova ainda é gravada).
+    Se 'on_field(chave, valor)' for informado, a resposta é lida em streaming
+    e cada campo é entregue assim que o JSON dele estiver completo.
+    Levanta RateLimitExceeded se o orçamento de chamadas ao Gemini acabou.
     """
+    cache_key = make_cache_key(user_razao_social, setor_atuacao, indicadores, valores_criterios, valuation_base)
+    if use_cache:
+        cached_result = get_cached_analysis(cache_key)
+        if cached_result is not None:
+            logger.info(f"Análise Gemini servida do cache (Empresa: {user_razao_social})")
+            return dict(cached_result, metricas={"cache_hit": True, "setup_ms": 0.0, "generation_ms": 0.0})
+
     api_key = settings.GEMINI_API_KEY
     if not api_key:
         logger.error("GEMINI_API_KEY não configurada.")
         return {"error": "Configuração da API de IA ausente."}
 
-    genai.configure(api_key=api_key)
-    
-    # Usando o seu modelo
-    model = genai.GenerativeModel('gemini-2.5-flash') 
+    # Reserva um token do rate limiter compartilhado; sem token, levanta
+    # RateLimitExceeded para a tarefa se re-agendar (fora do try abaixo)
+    acquire_or_raise('gemini')
 
     # --- Construção do Prompt (Com formatação) ---
-    def format_brl(value):
-        try:
-            return f"R$ {value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-        except (ValueError, TypeError):
-            return f"R$ {value}"
-
+    # Pontos fortes/atenção, cenários e o prompt do Gamma são calculados
+    # localmente (chatbot/insights.py, chatbot/scenarios.py); a IA só escreve o texto.
     indicadores_str = "\n".join([f"- {key.replace('_', ' ').title()}: {format_brl(value)}" for key, value in indicadores.items()])
-    criterios_str = "\n".join([
-        f"- {item['criterio_id'].replace('_', ' ').title()}: {format_brl(item['valor_calculado'])}" 
-        for item in valores_criterios
-    ])
     valuation_base_str = format_brl(valuation_base)
 
-    # --- PROMPT ATUALIZADO (com nome e foto) ---
     prompt = f"""
     Você é um assistente de análise de dados para uma apresentação de negócios.
     Os cálculos de valuation da empresa '{user_razao_social}' já foram realizados.
@@ -53,68 +63,44 @@ def run_analysis_agent(
     
     Indicadores Financeiros (Calculados):
     {indicadores_str}
-    
-    Valores Ponderados por Critério (Calculados):
-    {criterios_str}
 
-    Sua tarefa é realizar 4 ações e retornar APENAS um JSON:
+    Sua tarefa é realizar 1 ação e retornar APENAS um JSON:
 
-    1.  **Estimar Cenários:** Com base no setor '{setor_atuacao}', estime uma taxa de crescimento anual (em %) que você acha realista (ex: "8%"). Com base nessa taxa:
-        - Calcule o 'valuation_otimista' = Valuation Base * (1 + taxa_em_decimal)
-        - Calcule o 'valuation_pessimista' = Valuation Base * (1 - taxa_em_decimal)
-        - Retorne a taxa usada em 'setor_crescimento_perc' (ex: 8.0).
-    
-    2.  **Analisar Critérios:** Analise a lista de 'Valores Ponderados por Critério':
-        - Identifique os 3 a 5 critérios com o MAIOR 'valor_calculado' positivo. Liste-os como 'pontos_fortes'.
-        - Identifique TODOS os critérios com 'valor_calculado' NEGATIVO. Liste-os como 'pontos_atencao'.
-
-    3.  **Gerar Texto sobre Investidores:** Com base no faturamento e setor, escreva 1-2 frases para um slide sobre perfis de investidores (ex: Investidor-Anjo, Seed, etc.). Este texto é para fins ilustrativos.
-    
-    4.  **Gerar Prompt para Gamma:** Crie um prompt de texto otimizado para a API do Gamma (gamma.app) gerar uma apresentação de 7 slides. O prompt deve incluir todos os dados: os 3 cenários de valuation, os indicadores financeiros, os pontos fortes e os pontos de atenção.
+    1.  **Gerar Texto sobre Investidores:** Com base no faturamento e setor, escreva 1-2 frases para um slide sobre perfis de investidores (ex: Investidor-Anjo, Seed, etc.). Este texto é para fins ilustrativos.
 
-    **Formato de Resposta JSON OBRIGATÓRIO (Use R$ e formato X.XXX,XX):**
+    **Formato de Resposta JSON OBRIGATÓRIO:**
     {{
-        "cenarios": {{
-            "realista": {valuation_base},
-            "otimista": <valor_numerico_float_otimista>,
-            "pessimista": <valor_numerico_float_pessimista>,
-            "setor_crescimento_perc": <valor_numerico_float_taxa_usada>
-        }},
-        "pontos_fortes": [
-            {{"criterio": "Nome do Criterio 1", "valor": "R$ XX.XXX,XX"}},
-            {{"criterio": "Nome do Criterio 2", "valor": "R$ XX.XXX,XX"}}
-        ],
-        "pontos_atencao": [
-            {{"criterio": "Nome do Criterio 3", "valor": "R$ -XX.XXX,XX"}}
-        ],
-        "recomendacao_investidor": "Para um negócio neste estágio e faturamento, perfis de investidores que tipicamente se interessam são [Perfil], que buscam [Justificativa].",
-        "prompt_gamma": "Crie uma apresentação de 7 slides sobre a análise de valuation da empresa {user_razao_social}. Slide 1: Título 'Análise de Valuation - {user_razao_social}'. Adicione uma foto de capa profissional relacionada ao setor de '{setor_atuacao}'. Slide 2: Indicadores Chave (Faturamento Anual: {format_brl(indicadores.get('faturamento_anual'))}, Margem: {indicadores.get('margem_contribuicao_perc', 0):.1f}%, Ticket Médio: {format_brl(indicadores.get('ticket_medio'))}, Ponto de Equilíbrio: {format_brl(indicadores.get('ponto_equilibrio'))}). Slide 3: Valuation em 3 Cenários (Pessimista: [Valor Pessimista Formatado], Realista: {valuation_base_str}, Otimista: [Valor Otimista Formatado], baseado em {setor_atuacao}). Slide 4: Principais Forças (Liste os 'pontos_fortes'). Slide 5: Pontos de Atenção (Liste os 'pontos_atencao'). Slide 6: Perfil de Investidor (Texto da 'recomendacao_investidor'). Slide 7: Conclusão."
+        "recomendacao_investidor": "Para um negócio neste estágio e faturamento, perfis de investidores que tipicamente se interessam são [Perfil], que buscam [Justificativa]."
     }}
 
     **Instruções Adicionais:**
-    - Formate TODOS os valores monetários no JSON final (pontos_fortes, pontos_atencao, prompt_gamma) como "R$ X.XXX.XXX,XX".
     - **NÃO inclua nenhuma explicação, comentário ou ```json``` fora do formato JSON.** Sua resposta deve ser *apenas* o JSON solicitado.
     """
 
     try:
-        generation_config = genai.types.GenerationConfig(
-            temperature=0.5,
-            max_output_tokens=8192
-        )
-        
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-        ]
+        # Cliente reutilizado pelo processo (config e safety settings já embutidos)
+        model, setup_ms = get_gemini_model()
 
         logger.debug(f"Enviando prompt de ANÁLISE para Gemini (Empresa: {user_razao_social})")
-        response = model.generate_content(
-            prompt,
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
+        generation_start = time.perf_counter()
+        if on_field is not None and settings.GEMINI_STREAMING:
+            response = model.generate_content(prompt, stream=True)
+            parser = IncrementalJSONObjectParser()
+            for chunk in response:
+                try:
+                    chunk_text = chunk.text
+                except ValueError:
+                    continue # Pedaço sem texto (ex: só metadados de segurança)
+                for key, value in parser.feed(chunk_text):
+                    try:
+                        on_field(key, value)
+                    except Exception as e:
+                        logger.warning(f"Falha ao publicar campo parcial '{key}' da IA: {e}")
+        else:
+            response = model.generate_content(prompt)
+        generation_ms = (time.perf_counter() - generation_start) * 1000
+        record_generation(generation_ms)
+        logger.info(f"Gemini: setup {setup_ms:.1f}ms, geração {generation_ms:.1f}ms (Empresa: {user_razao_social})")
 
         if not response.parts:
             block_reason = "Desconhecido"
@@ -138,17 +124,22 @@ def run_analysis_agent(
         logger.debug(f"Resposta limpa da IA (JSON): {json_str}")
         result_json = json.loads(json_str)
 
-        required_keys = ["cenarios", "pontos_fortes", "pontos_atencao", "recomendacao_investidor", "prompt_gamma"]
+        if result_json.get("error"):
+             logger.error(f"IA retornou erro interno: {result_json.get('error')}")
+             return result_json
+
+        required_keys = ["recomendacao_investidor"]
         if not all(key in result_json for key in required_keys):
             logger.error(f"Resposta da IA não contém todas as chaves esperadas. Resposta: {json_str}")
             raise ValueError("Resposta da IA não contém todas as chaves esperadas.")
 
-        if result_json.get("error"):
-             logger.error(f"IA retornou erro interno: {result_json.get('error')}")
-             return result_json
+        result_json = {
+            "recomendacao_investidor": str(result_json["recomendacao_investidor"]).strip(),
+        }
 
         logger.info(f"Análise Gemini concluída com sucesso (Empresa: {user_razao_social})")
-        return result_json
+        set_cached_analysis(cache_key, result_json)
+        return dict(result_json, metricas={"cache_hit": False, "setup_ms": setup_ms, "generation_ms": generation_ms})
 
     except json.JSONDecodeError as e:
         logger.error(f"Erro ao decodificar JSON da resposta da IA: {e}\nResposta recebida: {cleaned_response}")
@@ -0,0 +1,78 @@
+# chatbot/analysis_cache.py
+"""
+Cache endereçado por conteúdo para as respostas do Agente Gemini.
+
+A chave é o SHA-256 de uma serialização canônica dos inputs da análise:
+reenvios do mesmo formulário caem na mesma chave e não gastam cota da IA.
+As entradas ficam com TTL no Redis de GEMINI_CACHE_REDIS_URL: em produção um
+Redis próprio com 'allkeys-lru', que descarta as menos usadas quando a memória
+enche. O Redis compartilhado (broker, cotas, travas, status) roda com
+'noeviction'; se o cache ficar nele, o TTL é o único limite.
+"""
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+
+from valuation.redis_client import get_cache_redis
+
+logger = logging.getLogger(__name__)
+
+# Incrementar quando o prompt ou o formato da resposta mudar
+CACHE_VERSION = 3
+KEY_PREFIX = 'gemini_analysis'
+STATS_KEY = f'{KEY_PREFIX}:stats'
+
+
+def make_cache_key(
+    user_razao_social: str,
+    setor_atuacao: str,
+    indicadores: dict,
+    valores_criterios: list,
+    valuation_base: float
+) -> str:
+    """Gera a chave canônica (independente da ordem das chaves dos dicts)."""
+    payload = {
+        "razao_social": (user_razao_social or "").strip(),
+        "setor_atuacao": (setor_atuacao or "").strip().casefold(),
+        "indicadores": indicadores,
+        "valores_criterios": valores_criterios,
+        "valuation_base": valuation_base,
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    digest = hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    return f'{KEY_PREFIX}:v{CACHE_VERSION}:{digest}'
+
+
+def get_cached_analysis(key: str) -> dict | None:
+    """Retorna a análise em cache (ou None) e contabiliza hit/miss."""
+    try:
+        client = get_cache_redis()
+        cached = client.get(key)
+        client.hincrby(STATS_KEY, 'hits' if cached else 'misses', 1)
+        return json.loads(cached) if cached else None
+    except Exception as e:
+        # Cache indisponível nunca deve impedir a análise
+        logger.warning(f"Cache de análise indisponível (leitura): {e}")
+        return None
+
+
+def set_cached_analysis(key: str, result: dict) -> None:
+    try:
+        get_cache_redis().set(key, json.dumps(result, ensure_ascii=False), ex=settings.GEMINI_CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"Cache de análise indisponível (escrita): {e}")
+
+
+def get_cache_stats() -> dict:
+    """Contadores de hits/misses acumulados no Redis."""
+    try:
+        stats = get_cache_redis().hgetall(STATS_KEY)
+    except Exception as e:
+        logger.warning(f"Cache de análise indisponível (stats): {e}")
+        stats = {}
+    hits = int(stats.get('hits', 0))
+    misses = int(stats.get('misses', 0))
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": (hits / total) if total else 0.0}
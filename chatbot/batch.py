@@ -0,0 +1,144 @@
+# chatbot/batch.py
+"""
+Envio em lote: várias empresas num arquivo CSV ou JSON.
+
+Cada linha tem os mesmos campos que o chatbot envia (ver chatbot.utils):
+no CSV, uma coluna por campo; no JSON, uma lista de objetos (ou
+{"rows": [...]}), cada um com os campos direto ou dentro de "inputs".
+
+O arquivo inteiro é validado de uma vez e, se houver qualquer erro, nada é
+criado e todos os erros voltam, por linha. Se estiver tudo certo, os reports
+são criados num único bulk_create e a tarefa start_valuation_batch calcula a
+planilha de todos numa passada do motor vetorizado e despacha os pipelines
+em ondas (no máximo VALUATION_BATCH_MAX_IN_FLIGHT ao mesmo tempo).
+"""
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from reports.models import ValuationReport
+from .utils import FINANCIAL_KEYS, QUALITATIVE_KEYS, collect_input_errors
+
+BATCH_COLUMNS = (*FINANCIAL_KEYS, *QUALITATIVE_KEYS)
+
+
+class BatchError(Exception):
+    """Problema no arquivo como um todo (formato, tamanho, colunas)."""
+
+
+def _parse_json(text):
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise BatchError(f"JSON inválido: {e}")
+    if isinstance(data, dict):
+        data = data.get('rows')
+    if not isinstance(data, list):
+        raise BatchError("O JSON deve ser uma lista de empresas (ou um objeto com a chave 'rows').")
+    return [row.get('inputs', row) if isinstance(row, dict) else row for row in data]
+
+
+def _parse_csv(text):
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    reader.fieldnames = [name.strip() for name in (reader.fieldnames or [])]
+    missing = [column for column in BATCH_COLUMNS if column not in reader.fieldnames]
+    if missing:
+        raise BatchError(f"Colunas ausentes no CSV: {', '.join(missing)}")
+    return [
+        {key: (value or '').strip() for key, value in row.items() if key in BATCH_COLUMNS}
+        for row in reader
+    ]
+
+
+def parse_batch_file(content: bytes, filename: str = '') -> list:
+    """Lê o arquivo (CSV ou JSON, detectado pela extensão ou pelo conteúdo) e devolve as linhas."""
+    if len(content) > settings.VALUATION_BATCH_MAX_BYTES:
+        raise BatchError(f"Arquivo maior que o limite de {settings.VALUATION_BATCH_MAX_BYTES // 1024} KB.")
+    try:
+        text = content.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise BatchError("O arquivo deve estar em UTF-8.")
+
+    if filename.lower().endswith('.json') or text.lstrip()[:1] in ('[', '{'):
+        rows = _parse_json(text)
+    else:
+        rows = _parse_csv(text)
+
+    if not rows:
+        raise BatchError("O arquivo não tem nenhuma empresa.")
+    if len(rows) > settings.VALUATION_BATCH_MAX_ROWS:
+        raise BatchError(f"Máximo de {settings.VALUATION_BATCH_MAX_ROWS} empresas por lote (recebidas {len(rows)}).")
+    return rows
+
+
+def validate_rows(rows: list) -> tuple[list, list]:
+    """
+    Valida todas as linhas. Retorna (inputs validados, erros), onde cada erro é
+    {"row": número da linha de dados (1 = primeira empresa), "errors": [mensagens]}.
+    """
+    validated, errors = [], []
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append({"row": number, "errors": ["A linha não é um objeto com os campos da empresa."]})
+            continue
+        inputs, row_errors = collect_input_errors(row)
+        if row_errors:
+            errors.append({"row": number, "errors": row_errors})
+        else:
+            validated.append(inputs)
+    return validated, errors
+
+
+def create_batch(batch, validated_rows: list):
+    """
+    Grava o lote ('batch' é um ValuationBatch ainda não salvo, com user e
+    origem preenchidos) e um report PENDING por linha, e agenda o processamento.
+    """
+    from .tasks import start_valuation_batch
+
+    with transaction.atomic():
+        batch.total = len(validated_rows)
+        batch.save()
+        reports = []
+        for inputs in validated_rows:
+            report = ValuationReport(
+                user=batch.user,
+                batch=batch,
+                status=ValuationReport.StatusChoices.PENDING,
+                inputs_data=inputs,
+            )
+            # bulk_create não passa pelo save(): preenche as colunas derivadas aqui
+            report.sync_hot_fields(sources=('inputs_data',))
+            reports.append(report)
+        ValuationReport.objects.bulk_create(reports, batch_size=500)
+        transaction.on_commit(lambda: start_valuation_batch.delay(batch.id))
+    return batch
+
+
+def batch_progress(batch) -> dict:
+    """Contagem por status dos reports do lote, numa única consulta."""
+    statuses = ValuationReport.StatusChoices
+    counts = batch.reports.aggregate(
+        pending=Count('id', filter=Q(status=statuses.PENDING)),
+        processing=Count('id', filter=Q(status=statuses.PROCESSING)),
+        success=Count('id', filter=Q(status=statuses.SUCCESS)),
+        failed=Count('id', filter=Q(status=statuses.FAILED)),
+        calculated=Count('id', filter=Q(calculated_at__isnull=False)),
+    )
+    done = counts['success'] + counts['failed']
+    return {
+        "batch_id": batch.id,
+        "total": batch.total,
+        **counts,
+        "done": done,
+        "percent": round(done * 100 / batch.total) if batch.total else 100,
+        "finished": done >= batch.total,
+    }
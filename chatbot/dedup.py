@@ -0,0 +1,115 @@
+# chatbot/dedup.py
+"""
+Detecção de envios repetidos em calculate_valuation_view.
+
+Duas proteções complementares:
+  - chave de idempotência enviada pelo cliente (cabeçalho 'Idempotency-Key'):
+    única por usuário no banco (constraint report_user_idempotency_key), então
+    um clique duplo ou um reenvio devolve o mesmo report;
+  - inputs idênticos do mesmo usuário dentro de DUPLICATE_SUBMISSION_WINDOW_SECONDS:
+    uma trava 'SET NX' no Redis por (usuário, hash dos inputs) guarda o id do
+    report criado, e o segundo envio recebe esse report em vez de abrir outro
+    pipeline (e gastar de novo Gemini e Gamma). Enquanto o report não existe a
+    trava vale só PENDING_TTL_SECONDS; record_submission a estende à janela.
+
+Com o Redis fora, a busca por inputs idênticos cai para uma consulta indexada
+(report_user_inputs_idx).
+
+Nada aqui espera: um envio idêntico ainda sem report recebe IN_PROGRESS na
+hora e o cliente reenvia em IN_PROGRESS_RETRY_SECONDS (ver a view).
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from reports.models import ValuationReport
+from valuation.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'dedup'
+PENDING = 'pending'
+# Validade da trava antes de existir o report: cobre a view (cota, INSERT e cálculo
+# inline) com folga. Se a requisição morrer no meio, envios idênticos voltam a
+# passar em segundos, não só ao fim da janela inteira
+PENDING_TTL_SECONDS = 15
+# Sugestão ao cliente (Retry-After) quando o envio idêntico ainda está criando o report
+IN_PROGRESS_RETRY_SECONDS = 1
+
+# Resultados de claim_submission
+CLAIMED = 'claimed'
+DUPLICATE = 'duplicate'
+IN_PROGRESS = 'in_progress'
+
+
+def _key(user_id, inputs_hash):
+    return f'{KEY_PREFIX}:{user_id}:{inputs_hash}'
+
+
+def _find_recent_duplicate(user_id, inputs_hash):
+    since = timezone.now() - timedelta(seconds=settings.DUPLICATE_SUBMISSION_WINDOW_SECONDS)
+    return (
+        ValuationReport.objects.filter(user_id=user_id, inputs_hash=inputs_hash, created_at__gte=since)
+        .exclude(status=ValuationReport.StatusChoices.FAILED)
+        .order_by('-created_at')
+        .first()
+    )
+
+
+def _usable_report(user_id, report_id):
+    """O report apontado pela trava, se ainda existir e não tiver falhado (falha pode ser refeita)."""
+    return (
+        ValuationReport.objects.filter(pk=report_id, user_id=user_id)
+        .exclude(status=ValuationReport.StatusChoices.FAILED)
+        .first()
+    )
+
+
+def claim_submission(user_id, inputs_hash):
+    """
+    Tenta registrar um envio novo. Retorna (resultado, report):
+      (CLAIMED, None)        envio novo; chamar record_submission após criar o report
+      (DUPLICATE, report)    envio idêntico recente: devolver 'report'
+      (IN_PROGRESS, None)    envio idêntico ainda sendo criado por outra requisição
+    """
+    key = _key(user_id, inputs_hash)
+    try:
+        client = get_redis()
+        if client.set(key, PENDING, nx=True, ex=PENDING_TTL_SECONDS):
+            return CLAIMED, None
+        value = client.get(key)
+        if value is None:
+            # Expirou entre o SET e o GET: uma segunda tentativa basta
+            return (CLAIMED, None) if client.set(key, PENDING, nx=True, ex=PENDING_TTL_SECONDS) else (IN_PROGRESS, None)
+        if value == PENDING:
+            # O report pode já existir sem que a trava tenha sido apontada para ele
+            report = _find_recent_duplicate(user_id, inputs_hash)
+            return (DUPLICATE, report) if report else (IN_PROGRESS, None)
+        report = _usable_report(user_id, value)
+        if report:
+            return DUPLICATE, report
+        # Report apagado ou com falha: este envio assume a trava
+        client.set(key, PENDING, ex=PENDING_TTL_SECONDS)
+        return CLAIMED, None
+    except Exception as e:
+        logger.warning(f"Trava de envios repetidos indisponível no Redis, consultando o banco: {e}")
+        report = _find_recent_duplicate(user_id, inputs_hash)
+        return (DUPLICATE, report) if report else (CLAIMED, None)
+
+
+def record_submission(user_id, inputs_hash, report_id):
+    """Aponta a trava para o report criado (envios idênticos passam a recebê-lo)."""
+    try:
+        get_redis().set(_key(user_id, inputs_hash), report_id, ex=settings.DUPLICATE_SUBMISSION_WINDOW_SECONDS)
+    except Exception as e:
+        logger.warning(f"Não foi possível registrar o envio do Report {report_id}: {e}")
+
+
+def abandon_submission(user_id, inputs_hash):
+    """O report não chegou a ser criado: libera a trava para um novo envio."""
+    try:
+        get_redis().delete(_key(user_id, inputs_hash))
+    except Exception as e:
+        logger.warning(f"Não foi possível liberar a trava de envio do user {user_id}: {e}")
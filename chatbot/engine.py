@@ -0,0 +1,250 @@
+# chatbot/engine.py
+"""
+Motor vetorizado da planilha de valuation.
+
+Recebe N relatórios de uma vez como matrizes (dados financeiros N x 5 e
+pontuações N x 18, já convertidas por SCORE_MAP) e calcula indicadores,
+valor por critério e valuation_base de todos numa única passada NumPy.
+
+É usado pela etapa 'calculate' das tarefas (N = 1), pelo recálculo em massa
+e pelas simulações "e se"; o benchmark fica em
+'python manage.py benchmark_engine'.
+
+As tabelas de pontuação vigentes ficam no banco (chatbot.models.ScoringTable,
+lidas via chatbot.scoring); SCORE_MAP/WEIGHTS_MAP abaixo são a versão 1,
+usada como padrão e quando o banco ainda não tem nenhuma tabela.
+"""
+from dataclasses import dataclass, field
+
+import numpy as np
+
+# Pontuações vêm de tabelas editáveis no banco: int32 para nunca dar a volta
+SCORE_DTYPE = np.int32
+
+# --- MAPAS DE CÁLCULO (Nova Lógica) ---
+SCORE_MAP = {
+    "BAIXO": -1,
+    "NÃO CONSIGO AVALIAR": 0,
+    "MÉDIO": 1,
+    "ALTO": 2,
+    "ELEVADO": 3
+}
+
+WEIGHTS_MAP = {
+    # Peso 1
+    "visao_pessoas": 1,
+    "nivel_validacao": 1,
+    "nivel_equipe": 1,
+    "potencial_network": 1,
+    # Peso 2
+    "diferencial_modelo": 2,
+    "possibilidade_escala": 2,
+    "pmf": 2,
+    "potencial_alcance": 2,
+    "nivel_parcerias": 2,
+    "estagio_modelo": 2,
+    "estagio_prototipo": 2,
+    "nivel_analise_financeira": 2,
+    "estagio_comercializacao": 2,
+    "nivel_faturamento": 2,
+    "nivel_lucro": 2,
+    # Peso -2
+    "possibilidade_copia": -2,
+    "potencial_mercado_barreiras": -2,
+    "potencial_internacionalizacao": -2,
+}
+
+DEFAULT_ANSWER = "NÃO CONSIGO AVALIAR"
+
+
+@dataclass
+class ScoringTables:
+    """Uma versão das tabelas, com a ordem das colunas e o vetor de pesos já prontos."""
+    version: int
+    score_map: dict
+    weights_map: dict
+    criteria: tuple = field(init=False)
+    weights: np.ndarray = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.criteria = tuple(self.weights_map)
+        self.weights = np.array([self.weights_map[crit_id] for crit_id in self.criteria], dtype=np.float64)
+
+
+DEFAULT_TABLES = ScoringTables(version=1, score_map=SCORE_MAP, weights_map=WEIGHTS_MAP)
+
+# Ordem fixa das colunas das matrizes (tabelas padrão)
+CRITERIA = DEFAULT_TABLES.criteria
+WEIGHTS = DEFAULT_TABLES.weights
+FINANCIAL_FIELDS = ('faturamento_mensal', 'gastos_variaveis', 'gastos_fixos', 'num_vendas', 'num_prospeccoes')
+
+
+@dataclass
+class BatchResult:
+    """Saída do motor: um array por indicador (N,) e a matriz de valores (N x critérios)."""
+    faturamento_anual: np.ndarray
+    faturamento_mensal: np.ndarray
+    margem_contribuicao_valor: np.ndarray
+    margem_contribuicao_perc: np.ndarray
+    ticket_medio: np.ndarray
+    ponto_equilibrio: np.ndarray
+    taxa_conversao: np.ndarray
+    valores_criterios: np.ndarray
+    valuation_base: np.ndarray
+
+    def indicadores(self, i: int) -> dict:
+        return {
+            "faturamento_anual": float(self.faturamento_anual[i]),
+            "faturamento_mensal": float(self.faturamento_mensal[i]),
+            "margem_contribuicao_valor": float(self.margem_contribuicao_valor[i]),
+            "margem_contribuicao_perc": float(self.margem_contribuicao_perc[i]),
+            "ticket_medio": float(self.ticket_medio[i]),
+            "ponto_equilibrio": float(self.ponto_equilibrio[i]),
+            "taxa_conversao": float(self.taxa_conversao[i]),
+        }
+
+
+def encode_inputs(inputs_list: list, tables: ScoringTables = DEFAULT_TABLES) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Converte os inputs_data de N relatórios em (financeiros N x 5, pontuações N x critérios).
+    Respostas desconhecidas valem 0, como na planilha. Número inválido levanta ValueError.
+    """
+    financials = np.empty((len(inputs_list), len(FINANCIAL_FIELDS)), dtype=np.float64)
+    scores = np.empty((len(inputs_list), len(tables.criteria)), dtype=SCORE_DTYPE)
+    for row, inputs in enumerate(inputs_list):
+        financials[row] = [float(inputs.get(name, 0) or 0) for name in FINANCIAL_FIELDS]
+        scores[row] = [tables.score_map.get(inputs.get(crit_id, DEFAULT_ANSWER), 0) for crit_id in tables.criteria]
+    return financials, scores
+
+
+def compute_batch(financials: np.ndarray, scores: np.ndarray, weights: np.ndarray = WEIGHTS) -> BatchResult:
+    """Aplica a lógica da planilha a todas as linhas de uma vez."""
+    faturamento_mensal, gastos_variaveis, gastos_fixos, num_vendas, num_prospeccoes = financials.T
+    # Zero vendas/prospecções conta como 1 (evita divisão por zero, como na versão por relatório)
+    num_vendas = np.where(num_vendas == 0, 1.0, num_vendas)
+    num_prospeccoes = np.where(num_prospeccoes == 0, 1.0, num_prospeccoes)
+
+    # Etapa 1: Indicadores Financeiros
+    faturamento_anual = faturamento_mensal * 12
+    margem_contribuicao_valor = faturamento_mensal - gastos_variaveis
+    margem_contribuicao_perc = np.divide(
+        margem_contribuicao_valor, faturamento_mensal,
+        out=np.zeros_like(faturamento_mensal), where=faturamento_mensal > 0
+    )
+    ticket_medio = faturamento_mensal / num_vendas
+    ponto_equilibrio = np.divide(
+        gastos_fixos, margem_contribuicao_perc,
+        out=np.zeros_like(gastos_fixos), where=margem_contribuicao_perc > 0
+    )
+    taxa_conversao = (num_vendas / num_prospeccoes) * 100
+
+    # Etapas 2 & 3: Valor Ponderado (faturamento anual x pontuação x peso)
+    valores_criterios = faturamento_anual[:, None] * (scores * weights)
+
+    # Etapa 4: Valuation Base
+    valuation_base = valores_criterios.sum(axis=1) / len(weights)
+
+    return BatchResult(
+        faturamento_anual=faturamento_anual,
+        faturamento_mensal=faturamento_mensal,
+        margem_contribuicao_valor=margem_contribuicao_valor,
+        margem_contribuicao_perc=margem_contribuicao_perc,
+        ticket_medio=ticket_medio,
+        ponto_equilibrio=ponto_equilibrio,
+        taxa_conversao=taxa_conversao,
+        valores_criterios=valores_criterios,
+        valuation_base=valuation_base,
+    )
+
+
+def calculate_reports(inputs_list: list, tables: ScoringTables = DEFAULT_TABLES) -> list:
+    """
+    Calcula N relatórios e devolve, para cada um, o mesmo formato que as
+    tarefas gravam no result_data: (indicadores, valores_criterios, valuation_base).
+    """
+    financials, scores = encode_inputs(inputs_list, tables)
+    result = compute_batch(financials, scores, tables.weights)
+
+    reports = []
+    for i, inputs in enumerate(inputs_list):
+        valores_criterios = [
+            {
+                "criterio_id": crit_id,
+                "resposta": inputs.get(crit_id, DEFAULT_ANSWER),
+                "pontuacao": int(scores[i, j]),
+                "peso": tables.weights_map[crit_id],
+                "valor_calculado": float(result.valores_criterios[i, j]),
+            }
+            for j, crit_id in enumerate(tables.criteria)
+        ]
+        reports.append((result.indicadores(i), valores_criterios, float(result.valuation_base[i])))
+    return reports
+
+
+def calculate_report(inputs: dict, tables: ScoringTables = DEFAULT_TABLES) -> tuple[dict, list, float]:
+    """Um relatório só (etapa 'calculate' do pipeline)."""
+    return calculate_reports([inputs], tables)[0]
+
+
+# --- SIMULAÇÃO "E SE" ---
+# Multiplicadores aplicados a cada input financeiro na análise de sensibilidade
+FINANCIAL_MULTIPLIERS = (0.5, 0.75, 0.9, 1.1, 1.25, 1.5, 2.0)
+
+
+def what_if(inputs: dict, tables: ScoringTables = DEFAULT_TABLES, multipliers=FINANCIAL_MULTIPLIERS) -> dict:
+    """
+    Sensibilidade de um relatório numa única chamada a compute_batch:
+    linha 0 = relatório como está; depois uma linha por (critério, resposta)
+    e uma por (input financeiro, multiplicador), cada uma mudando só aquele valor.
+    """
+    financials, scores = encode_inputs([inputs], tables)
+    answers = list(tables.score_map)
+    answer_scores = np.array([tables.score_map[answer] for answer in answers], dtype=SCORE_DTYPE)
+    multipliers = np.asarray(multipliers, dtype=np.float64)
+    n_answers, n_mult = len(answers), len(multipliers)
+
+    # Bloco dos critérios: linha k troca o critério k // n_answers pela resposta k % n_answers
+    crit_rows = np.arange(len(tables.criteria) * n_answers)
+    crit_scores = np.repeat(scores, len(crit_rows), axis=0)
+    crit_scores[crit_rows, crit_rows // n_answers] = np.tile(answer_scores, len(tables.criteria))
+    crit_financials = np.repeat(financials, len(crit_rows), axis=0)
+
+    # Bloco financeiro: linha k multiplica o campo k // n_mult pelo multiplicador k % n_mult
+    fin_rows = np.arange(len(FINANCIAL_FIELDS) * n_mult)
+    fin_financials = np.repeat(financials, len(fin_rows), axis=0)
+    fin_financials[fin_rows, fin_rows // n_mult] *= np.tile(multipliers, len(FINANCIAL_FIELDS))
+    fin_scores = np.repeat(scores, len(fin_rows), axis=0)
+
+    result = compute_batch(
+        np.vstack([financials, crit_financials, fin_financials]),
+        np.vstack([scores, crit_scores, fin_scores]),
+        tables.weights,
+    )
+    base = float(result.valuation_base[0])
+    crit_values = result.valuation_base[1:1 + len(crit_rows)].reshape(len(tables.criteria), n_answers)
+    fin_offset = 1 + len(crit_rows)
+
+    criteria = {
+        crit_id: {
+            "atual": inputs.get(crit_id, DEFAULT_ANSWER),
+            "respostas": {
+                answer: {"valuation_base": float(value), "delta": float(value - base)}
+                for answer, value in zip(answers, crit_values[i])
+            },
+        }
+        for i, crit_id in enumerate(tables.criteria)
+    }
+    financial = {
+        name: [
+            {
+                "multiplicador": float(multipliers[j]),
+                "valor": float(fin_financials[i * n_mult + j, i]),
+                "valuation_base": float(result.valuation_base[fin_offset + i * n_mult + j]),
+                "delta": float(result.valuation_base[fin_offset + i * n_mult + j] - base),
+                "indicadores": result.indicadores(fin_offset + i * n_mult + j),
+            }
+            for j in range(n_mult)
+        ]
+        for i, name in enumerate(FINANCIAL_FIELDS)
+    }
+    return {"valuation_base": base, "indicadores": result.indicadores(0), "criterios": criteria, "financeiro": financial}
@@ -0,0 +1,226 @@
+# chatbot/gamma_poller.py
+"""
+Poller assíncrono único para as gerações Gamma em andamento.
+
+Em vez de uma tarefa Celery por apresentação, um só processo (iniciado com
+'python manage.py run_gamma_poller') acompanha todos os generationIds pendentes,
+consultando-os em paralelo sobre um único cliente HTTP com pool de conexões
+e um limite de requisições simultâneas.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.db import connection, transaction
+
+from reports.models import ValuationReport
+from .rate_limit import acquire
+from .tasks import (
+    GAMMA_MAX_POLL_ATTEMPTS,
+    GAMMA_POLL_INTERVAL_SECONDS,
+    _complete_gamma_generation,
+    _restart_gamma_generation,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TrackedGeneration:
+    report_id: int
+    generation_id: str
+    attempts: int = 0
+    next_check: float = 0.0
+
+
+class GammaPoller:
+    """
+    Mantém o conjunto de gerações pendentes e as consulta em lotes.
+
+    'on_completed' e 'on_failed' recebem (report_id, ...) e são chamados
+    quando a geração termina; por padrão atualizam o report e disparam
+    'send_gamma_report_email' através dos mesmos helpers das tarefas Celery.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        max_in_flight: int = 20,
+        poll_interval: float = GAMMA_POLL_INTERVAL_SECONDS,
+        max_attempts: int = GAMMA_MAX_POLL_ATTEMPTS,
+        refresh_interval: float = 10,
+        load_from_db: bool = True,
+        on_completed=None,
+        on_failed=None,
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.refresh_interval = refresh_interval
+        self.load_from_db = load_from_db
+        self.on_completed = on_completed or self._complete_in_db
+        self.on_failed = on_failed or self._restart_in_db
+
+        self.tracked: dict[str, TrackedGeneration] = {}
+        self.stats = {"requests": 0, "completed": 0, "failed": 0, "errors": 0}
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._last_refresh = 0.0
+
+    # --- Integração com o banco ---
+
+    @staticmethod
+    def _load_pending_generations():
+        return list(
+            ValuationReport.objects.filter(
+                gamma_status=ValuationReport.GammaStatusChoices.PENDING,
+                result_data__gamma_generation_id__isnull=False,
+            ).values_list('id', 'result_data__gamma_generation_id', 'result_data__gamma_poll_attempts')
+        )
+
+    @staticmethod
+    def _save_poll_attempts(report_id, generation_id, attempts):
+        """
+        Grava gamma_poll_attempts no report (como poll_gamma_generation): um restart
+        não zera o limite. Só essa chave muda; o resto do result_data não é regravado.
+        """
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {ValuationReport._meta.db_table} "
+                    f"SET result_data = jsonb_set(result_data, '{{gamma_poll_attempts}}', to_jsonb(%s::integer)) "
+                    f"WHERE id = %s AND result_data->>'gamma_generation_id' = %s",
+                    [attempts, report_id, generation_id],
+                )
+            return
+        with transaction.atomic():
+            report = ValuationReport.objects.select_for_update().filter(id=report_id).only('id', 'result_data').first()
+            if report and (report.result_data or {}).get('gamma_generation_id') == generation_id:
+                report.result_data['gamma_poll_attempts'] = attempts
+                report.save(update_fields=['result_data'])
+
+    @staticmethod
+    def _complete_in_db(report_id, gamma_url):
+        report = ValuationReport.objects.get(id=report_id)
+        if report.gamma_status == ValuationReport.GammaStatusChoices.PENDING:
+            _complete_gamma_generation(report, gamma_url)
+
+    @staticmethod
+    def _restart_in_db(report_id, reason):
+        report = ValuationReport.objects.get(id=report_id)
+        if report.gamma_status == ValuationReport.GammaStatusChoices.PENDING:
+            _restart_gamma_generation(report, reason)
+
+    async def refresh(self):
+        """Sincroniza o conjunto rastreado com os reports pendentes no banco."""
+        rows = await sync_to_async(self._load_pending_generations)()
+        pending_ids = set()
+        for report_id, generation_id, attempts in rows:
+            pending_ids.add(generation_id)
+            if generation_id not in self.tracked:
+                self.track(report_id, generation_id, attempts or 0)
+        # Remove gerações que já foram concluídas/reiniciadas por outro caminho
+        for generation_id in list(self.tracked):
+            if generation_id not in pending_ids:
+                self.tracked.pop(generation_id, None)
+        self._last_refresh = time.monotonic()
+
+    def track(self, report_id, generation_id, attempts=0, delay=None):
+        self.tracked[generation_id] = TrackedGeneration(
+            report_id=report_id,
+            generation_id=generation_id,
+            attempts=attempts,
+            next_check=time.monotonic() + (self.poll_interval if delay is None else delay),
+        )
+
+    # --- Polling ---
+
+    async def _check(self, client: httpx.AsyncClient, gen: TrackedGeneration):
+        # O teste de carga (load_from_db=False) mede o poller, não o rate limiter compartilhado
+        if self.load_from_db:
+            allowed, wait = await sync_to_async(acquire)('gamma')
+            if not allowed:
+                # Sem orçamento no rate limiter compartilhado: adia sem contar tentativa
+                gen.next_check = time.monotonic() + wait
+                return
+
+        gen.attempts += 1
+        if self.load_from_db:
+            await sync_to_async(self._save_poll_attempts)(gen.report_id, gen.generation_id, gen.attempts)
+        async with self._semaphore:
+            self.stats["requests"] += 1
+            try:
+                response = await client.get(f"/generations/{gen.generation_id}")
+                response.raise_for_status()
+                status_data = response.json()
+            except httpx.HTTPStatusError as e:
+                self.stats["errors"] += 1
+                if 400 <= e.response.status_code < 500:
+                    logger.error(f"Erro cliente ({e.response.status_code}) no polling Gamma de {gen.generation_id}.")
+                    await self._finish_failed(gen, f"erro cliente {e.response.status_code}")
+                    return
+                logger.warning(f"Erro de servidor no polling Gamma de {gen.generation_id}: {e}")
+                status_data = {}
+            except httpx.HTTPError as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Erro de rede no polling Gamma de {gen.generation_id}: {e}")
+                status_data = {}
+
+        current_status = status_data.get('status')
+        if current_status == "completed":
+            gamma_url = status_data.get("gammaUrl")
+            if gamma_url:
+                self.tracked.pop(gen.generation_id, None)
+                self.stats["completed"] += 1
+                await sync_to_async(self.on_completed)(gen.report_id, gamma_url)
+            else:
+                await self._finish_failed(gen, "resposta 'completed' sem URL")
+        elif current_status in ["failed", "error"]:
+            await self._finish_failed(gen, f"status {current_status}")
+        elif gen.attempts >= self.max_attempts:
+            await self._finish_failed(gen, "timeout")
+        else:
+            gen.next_check = time.monotonic() + self.poll_interval
+
+    async def _finish_failed(self, gen, reason):
+        self.tracked.pop(gen.generation_id, None)
+        self.stats["failed"] += 1
+        await sync_to_async(self.on_failed)(gen.report_id, reason)
+
+    async def tick(self, client: httpx.AsyncClient):
+        """Consulta, em paralelo, todas as gerações cuja próxima checagem venceu."""
+        now = time.monotonic()
+        due = [gen for gen in self.tracked.values() if gen.next_check <= now]
+        if due:
+            await asyncio.gather(*(self._check(client, gen) for gen in due))
+        return len(due)
+
+    def make_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"X-API-KEY": self.api_key or "", "Content-Type": "application/json"},
+            timeout=15,
+            limits=httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight),
+        )
+
+    async def run(self, stop_when_idle=False):
+        async with self.make_client() as client:
+            while True:
+                if self.load_from_db and time.monotonic() - self._last_refresh >= self.refresh_interval:
+                    try:
+                        await self.refresh()
+                    except Exception as e:
+                        logger.error(f"Erro ao carregar gerações Gamma pendentes: {e}", exc_info=True)
+
+                checked = await self.tick(client)
+                if checked:
+                    logger.info(f"Poller Gamma: {checked} consultadas, {len(self.tracked)} pendentes, stats={self.stats}")
+
+                if stop_when_idle and not self.tracked:
+                    return
+                await asyncio.sleep(min(1.0, self.poll_interval))
@@ -0,0 +1,95 @@
+# chatbot/gemini_client.py
+"""
+Cliente Gemini reutilizado por processo.
+
+O 'genai.configure' e o GenerativeModel (com generation_config e
+safety_settings fixos) são criados uma única vez por processo e reaproveitados
+entre tarefas, mantendo as conexões HTTP/gRPC abertas. Como canais gRPC não
+sobrevivem a um fork, o cliente é descartado em cada processo filho do Celery
+(sinal worker_process_init) e também sempre que o PID muda.
+"""
+import logging
+import os
+import threading
+import time
+
+import google.generativeai as genai
+from celery.signals import worker_process_init
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL_NAME = 'gemini-2.5-flash'
+# No 2.5 Flash os tokens de raciocínio ("thinking") contam neste limite: um teto
+# baixo corta o JSON da resposta (ou a deixa vazia) mesmo com a saída curta
+GEMINI_MAX_OUTPUT_TOKENS = 8192
+
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+
+_lock = threading.Lock()
+_model = None
+_model_pid = None
+
+# Métricas acumuladas do processo (tempo de setup x tempo de geração)
+_stats = {"setups": 0, "setup_ms_total": 0.0, "generations": 0, "generation_ms_total": 0.0}
+
+
+def get_gemini_model():
+    """
+    Retorna (model, setup_ms): o GenerativeModel do processo e quanto tempo
+    esta chamada gastou criando-o (0.0 quando reaproveitado).
+    """
+    global _model, _model_pid
+    pid = os.getpid()
+    if _model is not None and _model_pid == pid:
+        return _model, 0.0
+
+    with _lock:
+        if _model is not None and _model_pid == pid:
+            return _model, 0.0
+
+        start = time.perf_counter()
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+        _model = genai.GenerativeModel(
+            GEMINI_MODEL_NAME,
+            generation_config=genai.types.GenerationConfig(
+                temperature=0.5,
+                max_output_tokens=GEMINI_MAX_OUTPUT_TOKENS
+            ),
+            safety_settings=SAFETY_SETTINGS,
+        )
+        _model_pid = pid
+        setup_ms = (time.perf_counter() - start) * 1000
+
+    _stats["setups"] += 1
+    _stats["setup_ms_total"] += setup_ms
+    logger.info(f"Cliente Gemini criado para o processo {pid} em {setup_ms:.1f}ms")
+    return _model, setup_ms
+
+
+def record_generation(generation_ms: float) -> None:
+    _stats["generations"] += 1
+    _stats["generation_ms_total"] += generation_ms
+
+
+def get_client_stats() -> dict:
+    """Métricas do processo atual: quantos setups e gerações e seus tempos."""
+    return dict(_stats, pid=os.getpid())
+
+
+def reset_gemini_client() -> None:
+    """Descarta o cliente do processo (ex: após um fork)."""
+    global _model, _model_pid
+    with _lock:
+        _model = None
+        _model_pid = None
+
+
+@worker_process_init.connect
+def _reset_after_fork(**kwargs):
+    reset_gemini_client()
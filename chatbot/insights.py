@@ -0,0 +1,81 @@
+# chatbot/insights.py
+"""
+Campos do relatório derivados deterministicamente da planilha.
+
+Pontos fortes, pontos de atenção e o prompt do Gamma são calculados aqui a
+partir dos valores já computados (os cenários vêm de chatbot/scenarios.py);
+a IA só é consultada para o que exige julgamento (texto sobre investidores).
+"""
+
+MAX_PONTOS_FORTES = 5
+
+
+def format_brl(value):
+    """Formata um número como moeda brasileira (ex: R$ 1.234,56)."""
+    try:
+        return f"R$ {value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    except (ValueError, TypeError):
+        return f"R$ {value}"
+
+
+def criterio_label(criterio_id: str) -> str:
+    return criterio_id.replace('_', ' ').title()
+
+
+def build_pontos_fortes(valores_criterios: list) -> list:
+    """Os critérios (até MAX_PONTOS_FORTES) com MAIOR 'valor_calculado' positivo."""
+    positivos = sorted(
+        (item for item in valores_criterios if item['valor_calculado'] > 0),
+        key=lambda item: item['valor_calculado'],
+        reverse=True
+    )
+    return [
+        {"criterio": criterio_label(item['criterio_id']), "valor": format_brl(item['valor_calculado'])}
+        for item in positivos[:MAX_PONTOS_FORTES]
+    ]
+
+
+def build_pontos_atencao(valores_criterios: list) -> list:
+    """TODOS os critérios com 'valor_calculado' negativo, do mais negativo ao menos."""
+    negativos = sorted(
+        (item for item in valores_criterios if item['valor_calculado'] < 0),
+        key=lambda item: item['valor_calculado']
+    )
+    return [
+        {"criterio": criterio_label(item['criterio_id']), "valor": format_brl(item['valor_calculado'])}
+        for item in negativos
+    ]
+
+
+def _format_lista(itens: list) -> str:
+    if not itens:
+        return "Nenhum"
+    return "; ".join(f"{item['criterio']} ({item['valor']})" for item in itens)
+
+
+def build_gamma_prompt(
+    razao_social: str,
+    setor_atuacao: str,
+    indicadores: dict,
+    cenarios: dict,
+    pontos_fortes: list,
+    pontos_atencao: list,
+    recomendacao_investidor: str
+) -> str:
+    """Prompt de 7 slides para a API do Gamma, com os números da planilha."""
+    return (
+        f"Crie uma apresentação de 7 slides sobre a análise de valuation da empresa {razao_social}. "
+        f"Slide 1: Título 'Análise de Valuation - {razao_social}'. "
+        f"Adicione uma foto de capa profissional relacionada ao setor de '{setor_atuacao}'. "
+        f"Slide 2: Indicadores Chave (Faturamento Anual: {format_brl(indicadores.get('faturamento_anual'))}, "
+        f"Margem: {indicadores.get('margem_contribuicao_perc') or 0:.1%}, "
+        f"Ticket Médio: {format_brl(indicadores.get('ticket_medio'))}, "
+        f"Ponto de Equilíbrio: {format_brl(indicadores.get('ponto_equilibrio'))}). "
+        f"Slide 3: Valuation em 3 Cenários (Pessimista: {format_brl(cenarios.get('pessimista'))}, "
+        f"Realista: {format_brl(cenarios.get('realista'))}, Otimista: {format_brl(cenarios.get('otimista'))}, "
+        f"baseado em {setor_atuacao}). "
+        f"Slide 4: Principais Forças ({_format_lista(pontos_fortes)}). "
+        f"Slide 5: Pontos de Atenção ({_format_lista(pontos_atencao)}). "
+        f"Slide 6: Perfil de Investidor ({recomendacao_investidor}). "
+        f"Slide 7: Conclusão."
+    )
@@ -0,0 +1,84 @@
+# chatbot/management/commands/benchmark_engine.py
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from chatbot.engine import (
+    CRITERIA,
+    DEFAULT_ANSWER,
+    FINANCIAL_FIELDS,
+    SCORE_DTYPE,
+    SCORE_MAP,
+    WEIGHTS_MAP,
+    calculate_reports,
+    compute_batch,
+)
+
+
+def _legacy_calculate(inputs):
+    """
+    Versão antiga, por relatório (laço Python sobre WEIGHTS_MAP), só para comparação.
+    Calcula apenas o valuation_base, então a comparação favorece o laço.
+    """
+    faturamento_anual = float(inputs.get('faturamento_mensal', 0)) * 12
+    soma = 0
+    for crit_id, crit_peso in WEIGHTS_MAP.items():
+        soma += faturamento_anual * SCORE_MAP.get(inputs.get(crit_id, DEFAULT_ANSWER), 0) * crit_peso
+    return soma / 18
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede a vazão do motor vetorizado (chatbot.engine) para lotes de 1, 1 mil "
+        "e 1 milhão de relatórios, comparando com o cálculo antigo por relatório."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,1000,1000000', help="Tamanhos de lote separados por vírgula.")
+        parser.add_argument('--repeat', type=int, default=5, help="Repetições por tamanho (vale a melhor).")
+        parser.add_argument('--legacy-max', type=int, default=10000, help="Maior lote medido também no laço antigo.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        scores_values = np.array(list(SCORE_MAP.values()), dtype=SCORE_DTYPE)
+        answers = np.array(list(SCORE_MAP))
+
+        self.stdout.write(f"{'N':>10} {'engine (matriz)':>18} {'engine (dicts)':>18} {'laço antigo':>18}")
+        for size in (int(s) for s in options['sizes'].split(',')):
+            financials = rng.uniform(0, 1_000_000, size=(size, len(FINANCIAL_FIELDS)))
+            answer_idx = rng.integers(0, len(answers), size=(size, len(CRITERIA)))
+            scores = scores_values[answer_idx]
+
+            matrix_rate = self._best_rate(lambda: compute_batch(financials, scores), size, options['repeat'])
+
+            dicts_rate = legacy_rate = None
+            if size <= options['legacy_max']:
+                inputs_list = [
+                    {
+                        **dict(zip(FINANCIAL_FIELDS, financials[i].tolist())),
+                        **dict(zip(CRITERIA, answers[answer_idx[i]].tolist())),
+                    }
+                    for i in range(size)
+                ]
+                dicts_rate = self._best_rate(lambda: calculate_reports(inputs_list), size, options['repeat'])
+                legacy_rate = self._best_rate(lambda: [_legacy_calculate(i) for i in inputs_list], size, options['repeat'])
+
+            self.stdout.write(
+                f"{size:>10} {self._fmt(matrix_rate):>18} {self._fmt(dicts_rate):>18} {self._fmt(legacy_rate):>18}"
+            )
+        self.stdout.write(self.style.SUCCESS("Vazão em relatórios/s (melhor de --repeat execuções)."))
+
+    @staticmethod
+    def _best_rate(func, size, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        return size / best if best > 0 else float('inf')
+
+    @staticmethod
+    def _fmt(rate):
+        return '-' if rate is None else f"{rate:,.0f}/s"
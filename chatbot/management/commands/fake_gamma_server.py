@@ -0,0 +1,96 @@
+# chatbot/management/commands/fake_gamma_server.py
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class FakeGammaState:
+    """Gerações criadas no servidor falso: id -> (instante de conclusão, vai falhar?)."""
+
+    def __init__(self, latency, jitter, failure_rate):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def create(self):
+        generation_id = uuid.uuid4().hex
+        ready_at = time.monotonic() + self.latency + random.uniform(0, self.jitter)
+        with self.lock:
+            self.generations[generation_id] = (ready_at, random.random() < self.failure_rate)
+        return generation_id
+
+    def status(self, generation_id):
+        with self.lock:
+            entry = self.generations.get(generation_id)
+        if entry is None:
+            return None
+        ready_at, will_fail = entry
+        if time.monotonic() < ready_at:
+            return {"generationId": generation_id, "status": "pending"}
+        if will_fail:
+            return {"generationId": generation_id, "status": "failed"}
+        return {"generationId": generation_id, "status": "completed", "gammaUrl": f"https://gamma.app/docs/fake-{generation_id}"}
+
+
+def make_handler(state, prefix):
+    class FakeGammaHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            self.rfile.read(length)
+            if self.path.rstrip('/') != f"{prefix}/generations":
+                return self._send_json(404, {"message": "Not found"})
+            self._send_json(200, {"generationId": state.create()})
+
+        def do_GET(self):
+            base = f"{prefix}/generations/"
+            if not self.path.startswith(base):
+                return self._send_json(404, {"message": "Not found"})
+            status_data = state.status(self.path[len(base):])
+            if status_data is None:
+                return self._send_json(404, {"message": "Generation not found"})
+            self._send_json(200, status_data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeGammaHandler
+
+
+class Command(BaseCommand):
+    help = (
+        "Sobe um servidor HTTP local que imita a API de gerações do Gamma, para "
+        "testes de carga offline. Aponte GAMMA_API_BASE_URL para http://host:porta/v0.2."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=60, help="Segundos até uma geração ficar pronta.")
+        parser.add_argument('--jitter', type=float, default=30, help="Atraso aleatório extra (0..jitter segundos).")
+        parser.add_argument('--failure-rate', type=float, default=0.0, help="Fração das gerações que terminam com status 'failed'.")
+
+    def handle(self, *args, **options):
+        state = FakeGammaState(options['latency'], options['jitter'], options['failure_rate'])
+        server = ThreadingHTTPServer((options['host'], options['port']), make_handler(state, '/v0.2'))
+        self.stdout.write(f"Fake Gamma ouvindo em http://{options['host']}:{options['port']}/v0.2")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write("Fake Gamma encerrado.")
+        finally:
+            server.server_close()
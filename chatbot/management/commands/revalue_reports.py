@@ -0,0 +1,260 @@
+# chatbot/management/commands/revalue_reports.py
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Max, Min
+
+from chatbot.engine import calculate_reports
+from chatbot.insights import build_gamma_prompt, build_pontos_atencao, build_pontos_fortes
+from chatbot.scenarios import simulate_scenarios
+from chatbot.scoring import get_active_tables, get_tables
+from reports.models import RESULT_HOT_FIELDS, ValuationReport
+
+# Mudança menor que isso no valuation_base não conta como diferença
+TOLERANCE = 0.005
+TOP_CHANGES = 10
+
+SHARD_OPTIONS = (
+    'user_id', 'status', 'created_after', 'all_versions', 'scoring_version',
+    'chunk_size', 'sleep', 'dry_run', 'checkpoint', 'restart', 'workers',
+)
+# Opções que mudam o conjunto de reports (ou sua divisão em shards): entram na assinatura do checkpoint
+SIGNATURE_OPTIONS = ('user_id', 'status', 'created_after', 'all_versions', 'scoring_version', 'workers')
+DEFAULT_CHECKPOINT = os.path.join(tempfile.gettempdir(), 'revalue_reports.checkpoint')
+
+
+def base_queryset(options):
+    # Reports em andamento ficam de fora: o pipeline ainda vai escrever neles
+    queryset = ValuationReport.objects.filter(calculated_at__isnull=False).exclude(
+        status__in=[ValuationReport.StatusChoices.PENDING, ValuationReport.StatusChoices.PROCESSING]
+    )
+    if options.get('user_id'):
+        queryset = queryset.filter(user_id=options['user_id'])
+    if options.get('status'):
+        queryset = queryset.filter(status=options['status'])
+    if options.get('created_after'):
+        queryset = queryset.filter(created_at__date__gte=options['created_after'])
+    if options.get('scoring_version') and not options.get('all_versions'):
+        # Incremental: só quem foi calculado com outra versão (ou sem versão registrada)
+        queryset = queryset.exclude(scoring_version=options['scoring_version'])
+    return queryset
+
+
+def revalue(report, indicadores, valores_criterios, valuation_base):
+    """Reescreve no result_data só as partes determinísticas (planilha e derivados)."""
+    result_data = report.result_data
+    result_data["indicadores"] = indicadores
+    result_data["valores_criterios"] = valores_criterios
+    result_data["valuation_base"] = valuation_base
+    result_data["pontos_fortes"] = build_pontos_fortes(valores_criterios)
+    result_data["pontos_atencao"] = build_pontos_atencao(valores_criterios)
+
+    result_data["cenarios"] = simulate_scenarios(indicadores, valuation_base, report.inputs_data.get('setor_atuacao', ''))
+
+    if result_data.get("prompt_gamma"):
+        result_data["prompt_gamma"] = build_gamma_prompt(
+            razao_social=report.user.razao_social,
+            setor_atuacao=report.inputs_data.get('setor_atuacao', 'Não informado'),
+            indicadores=indicadores,
+            cenarios=result_data["cenarios"],
+            pontos_fortes=result_data["pontos_fortes"],
+            pontos_atencao=result_data["pontos_atencao"],
+            recomendacao_investidor=result_data.get("recomendacao_investidor", "")
+        )
+
+
+def _valores_changed(result_data, valores_criterios):
+    old = {item.get("criterio_id"): item.get("valor_calculado") or 0 for item in result_data.get("valores_criterios", [])}
+    if old.keys() != {item["criterio_id"] for item in valores_criterios}:
+        return True
+    return any(abs(item["valor_calculado"] - old[item["criterio_id"]]) > TOLERANCE for item in valores_criterios)
+
+
+def _process_batch(ids, tables, dry_run, summary):
+    # Trava só as linhas do lote, pelo tempo de um cálculo + um UPDATE: uma tarefa que
+    # grave o mesmo report (ex: Gamma concluída) espera milissegundos e não é sobrescrita.
+    # O filtro é refeito aqui porque o report pode ter sido reprocessado desde a listagem.
+    # No --dry-run nada é gravado, então nada é travado.
+    with transaction.atomic():
+        queryset = base_queryset({}) if dry_run else base_queryset({}).select_for_update(of=('self',))
+        reports = list(
+            queryset
+            .select_related('user')
+            .only('id', 'status', 'inputs_data', 'result_data', 'user__razao_social')
+            .filter(id__in=ids)
+            .order_by('id')
+        )
+        results = calculate_reports([report.inputs_data for report in reports], tables)
+
+        changed, unchanged = [], []
+        for report, (indicadores, valores_criterios, valuation_base) in zip(reports, results):
+            old_base = float(report.result_data.get("valuation_base") or 0)
+            summary["scanned"] += 1
+            report.scoring_version = tables.version
+            if abs(valuation_base - old_base) <= TOLERANCE and not _valores_changed(report.result_data, valores_criterios):
+                unchanged.append(report)
+                continue
+
+            delta = valuation_base - old_base
+            summary["changed"] += 1
+            summary["delta_total"] += delta
+            summary["top"].append((abs(delta), report.id, old_base, valuation_base))
+            revalue(report, indicadores, valores_criterios, valuation_base)
+            report.sync_hot_fields(sources=('result_data',))
+            changed.append(report)
+
+        summary["top"] = sorted(summary["top"], reverse=True)[:TOP_CHANGES]
+        if not dry_run:
+            if changed:
+                ValuationReport.objects.bulk_update(changed, ['result_data', 'scoring_version', *RESULT_HOT_FIELDS], batch_size=500)
+            if unchanged:
+                # Mesmos números: só registra que já estão na versão nova
+                ValuationReport.objects.filter(id__in=[report.id for report in unchanged]).update(scoring_version=tables.version)
+
+
+def checkpoint_signature(options):
+    """Versão das tabelas + filtros: um checkpoint só é retomado pela mesma seleção de reports."""
+    return json.dumps({key: options.get(key) for key in SIGNATURE_OPTIONS}, sort_keys=True, default=str)
+
+
+def _load_checkpoint(path, signature):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    return checkpoint if checkpoint.get("signature") == signature else None
+
+
+def _save_checkpoint(path, signature, last_id, summary):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"signature": signature, "last_id": last_id, "summary": summary}, f)
+    os.replace(tmp_path, path)
+
+
+def revalue_shard(shard, id_range, options):
+    """
+    Processa os reports com id no intervalo [início, fim] em lotes de --chunk-size,
+    gravando o último id concluído no checkpoint do shard após cada lote.
+    Roda no processo principal ou num processo filho (--workers).
+    """
+    close_old_connections()
+    tables = get_tables(options['scoring_version'])
+    signature = checkpoint_signature(options)
+    checkpoint_path = f"{options['checkpoint']}.{shard}" if options['checkpoint'] and not options['dry_run'] else None
+
+    summary = {"scanned": 0, "changed": 0, "delta_total": 0.0, "top": []}
+    start_id, end_id = id_range
+    checkpoint = None if options['restart'] else _load_checkpoint(checkpoint_path, signature)
+    if checkpoint:
+        start_id = checkpoint["last_id"] + 1
+        summary = checkpoint["summary"]
+        summary["top"] = [tuple(item) for item in summary["top"]]
+
+    ids = (
+        base_queryset(options)
+        .filter(id__gte=start_id, id__lte=end_id)
+        .order_by('id')
+        .values_list('id', flat=True)
+        .iterator(chunk_size=options['chunk_size'])
+    )
+
+    batch = []
+    for report_id in ids:
+        batch.append(report_id)
+        if len(batch) >= options['chunk_size']:
+            _process_batch(batch, tables, options['dry_run'], summary)
+            if checkpoint_path:
+                _save_checkpoint(checkpoint_path, signature, batch[-1], summary)
+            batch = []
+            if options['sleep']:
+                time.sleep(options['sleep'])  # Alivia o banco para o site ao vivo
+    if batch:
+        _process_batch(batch, tables, options['dry_run'], summary)
+        if checkpoint_path:
+            _save_checkpoint(checkpoint_path, signature, batch[-1], summary)
+
+    connections.close_all()
+    return summary
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula a parte determinística (planilha, pontos fortes/atenção, cenários, "
+        "prompt Gamma) dos relatórios calculados com uma versão da ScoringTable diferente "
+        "da ativa (ou de --scoring-version). A IA não é chamada de novo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help="Só relatórios deste usuário.")
+        parser.add_argument('--status', choices=[ValuationReport.StatusChoices.SUCCESS, ValuationReport.StatusChoices.FAILED])
+        parser.add_argument('--created-after', help="Só relatórios criados a partir desta data (AAAA-MM-DD).")
+        parser.add_argument('--scoring-version', type=int, help="Versão das tabelas a aplicar (padrão: a ativa).")
+        parser.add_argument('--all-versions', action='store_true', help="Inclui relatórios que já estão na versão alvo.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Relatórios por lote (leitura e bulk_update).")
+        parser.add_argument('--workers', type=int, default=1, help="Processos em paralelo, cada um com uma faixa de ids.")
+        parser.add_argument('--sleep', type=float, default=0, help="Pausa em segundos entre lotes.")
+        parser.add_argument('--dry-run', action='store_true', help="Só calcula e mostra o resumo das diferenças.")
+        parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help="Prefixo dos arquivos de checkpoint ('' desativa; padrão no diretório temporário).")
+        parser.add_argument('--restart', action='store_true', help="Ignora checkpoints existentes.")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['chunk_size'] < 1:
+            raise CommandError("--workers e --chunk-size devem ser positivos.")
+        try:
+            tables = get_tables(options['scoring_version']) if options['scoring_version'] else get_active_tables()
+        except ValueError as e:
+            raise CommandError(str(e))
+        options['scoring_version'] = tables.version
+
+        bounds = base_queryset(options).aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            self.stdout.write("Nenhum relatório para recalcular.")
+            return
+
+        # Faixas contíguas de id por worker: cada uma usa o índice da PK
+        workers = options['workers']
+        span = (bounds['last'] - bounds['first']) // workers + 1
+        ranges = [(bounds['first'] + k * span, bounds['first'] + (k + 1) * span - 1) for k in range(workers)]
+
+        # Só o que os shards usam (as options do Django trazem stdout etc., que não vão para outro processo)
+        shard_options = {key: options.get(key) for key in SHARD_OPTIONS}
+
+        started = time.monotonic()
+        if workers == 1:
+            summaries = [revalue_shard(0, ranges[0], shard_options)]
+        else:
+            connections.close_all()  # Os processos filhos abrem as próprias conexões
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+                summaries = list(pool.map(revalue_shard, range(workers), ranges, [shard_options] * workers))
+        elapsed = time.monotonic() - started
+
+        scanned = sum(s["scanned"] for s in summaries)
+        changed = sum(s["changed"] for s in summaries)
+        delta_total = sum(s["delta_total"] for s in summaries)
+        top = sorted((tuple(item) for s in summaries for item in s["top"]), reverse=True)[:TOP_CHANGES]
+
+        mode = "DRY-RUN (nada gravado)" if options['dry_run'] else "gravados"
+        self.stdout.write(self.style.SUCCESS(
+            f"{scanned} relatórios analisados com as tabelas v{tables.version} em {elapsed:.1f}s, "
+            f"{changed} com diferença ({mode})."
+        ))
+        if changed:
+            self.stdout.write(f"Variação média do valuation_base: {delta_total / changed:,.2f}")
+            self.stdout.write("Maiores variações (report: antes -> depois):")
+            for _, report_id, old_base, new_base in top:
+                self.stdout.write(f"  #{report_id}: {old_base:,.2f} -> {new_base:,.2f}")
+            if not options['dry_run']:
+                self.stdout.write("Valuations alterados: rode 'rebuild_sector_benchmarks' para atualizar o benchmark setorial.")
+
+        if options['checkpoint'] and not options['dry_run']:
+            for shard in range(workers):
+                path = f"{options['checkpoint']}.{shard}"
+                if os.path.exists(path):
+                    os.remove(path)  # Execução completa: o próximo run começa do zero
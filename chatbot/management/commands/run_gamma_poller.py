@@ -0,0 +1,72 @@
+# chatbot/management/commands/run_gamma_poller.py
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chatbot.gamma_poller import GammaPoller
+
+
+class Command(BaseCommand):
+    help = (
+        "Inicia o poller assíncrono que acompanha todas as gerações Gamma pendentes "
+        "(use com GAMMA_POLL_MODE=service). Com --load-test N, cria N gerações no "
+        "servidor apontado por GAMMA_API_BASE_URL (ex: fake_gamma_server) sem tocar no banco."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-in-flight', type=int, default=20, help="Máximo de requisições simultâneas à API Gamma.")
+        parser.add_argument('--poll-interval', type=float, default=None, help="Segundos entre consultas de uma mesma geração.")
+        parser.add_argument('--refresh-interval', type=float, default=10, help="Segundos entre leituras de novos pendentes no banco.")
+        parser.add_argument('--load-test', type=int, default=0, metavar='N', help="Cria N gerações e mede o tempo até todas terminarem.")
+
+    def handle(self, *args, **options):
+        poller_kwargs = {
+            "base_url": settings.GAMMA_API_BASE_URL,
+            "api_key": settings.GAMMA_API_KEY,
+            "max_in_flight": options['max_in_flight'],
+            "refresh_interval": options['refresh_interval'],
+        }
+        if options['poll_interval'] is not None:
+            poller_kwargs["poll_interval"] = options['poll_interval']
+
+        if options['load_test']:
+            asyncio.run(self._load_test(options['load_test'], poller_kwargs))
+            return
+
+        self.stdout.write(f"Poller Gamma iniciado em {settings.GAMMA_API_BASE_URL} (max_in_flight={options['max_in_flight']}).")
+        try:
+            asyncio.run(GammaPoller(**poller_kwargs).run())
+        except KeyboardInterrupt:
+            self.stdout.write("Poller Gamma encerrado.")
+
+    async def _load_test(self, total, poller_kwargs):
+        results = {"completed": 0, "failed": 0}
+
+        def on_completed(report_id, gamma_url):
+            results["completed"] += 1
+
+        def on_failed(report_id, reason):
+            results["failed"] += 1
+
+        poller = GammaPoller(load_from_db=False, on_completed=on_completed, on_failed=on_failed, **poller_kwargs)
+
+        async with poller.make_client() as client:
+            async def create(i):
+                async with poller._semaphore:
+                    response = await client.post("/generations", json={"inputText": f"load-test {i}", "format": "presentation"})
+                    response.raise_for_status()
+                    poller.track(i, response.json()["generationId"])
+
+            await asyncio.gather(*(create(i) for i in range(total)))
+
+        start = time.monotonic()
+        await poller.run(stop_when_idle=True)
+        elapsed = time.monotonic() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} gerações acompanhadas em {elapsed:.1f}s: "
+            f"{results['completed']} concluídas, {results['failed']} falhas, "
+            f"{poller.stats['requests']} consultas, {poller.stats['errors']} erros."
+        ))
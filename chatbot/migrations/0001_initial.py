@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoringTable',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(editable=False, unique=True)),
+                ('score_map', models.JSONField(help_text='Resposta -> pontuação (ex: {"ALTO": 2})')),
+                ('weights_map', models.JSONField(help_text='Critério -> peso (ex: {"pmf": 2})')),
+                ('is_active', models.BooleanField(db_index=True, default=False)),
+                ('notes', models.TextField(blank=True, help_text='O que mudou nesta versão')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-version'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('is_active',), name='scoring_table_single_active')],
+            },
+        ),
+    ]
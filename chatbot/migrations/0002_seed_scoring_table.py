@@ -0,0 +1,54 @@
+from django.db import migrations
+
+# Tabelas que estavam fixas no código até aqui (chatbot.engine.SCORE_MAP/WEIGHTS_MAP)
+SCORE_MAP_V1 = {
+    "BAIXO": -1,
+    "NÃO CONSIGO AVALIAR": 0,
+    "MÉDIO": 1,
+    "ALTO": 2,
+    "ELEVADO": 3,
+}
+
+WEIGHTS_MAP_V1 = {
+    "visao_pessoas": 1,
+    "nivel_validacao": 1,
+    "nivel_equipe": 1,
+    "potencial_network": 1,
+    "diferencial_modelo": 2,
+    "possibilidade_escala": 2,
+    "pmf": 2,
+    "potencial_alcance": 2,
+    "nivel_parcerias": 2,
+    "estagio_modelo": 2,
+    "estagio_prototipo": 2,
+    "nivel_analise_financeira": 2,
+    "estagio_comercializacao": 2,
+    "nivel_faturamento": 2,
+    "nivel_lucro": 2,
+    "possibilidade_copia": -2,
+    "potencial_mercado_barreiras": -2,
+    "potencial_internacionalizacao": -2,
+}
+
+
+def seed_scoring_table(apps, schema_editor):
+    ScoringTable = apps.get_model('chatbot', 'ScoringTable')
+    if not ScoringTable.objects.exists():
+        ScoringTable.objects.create(
+            version=1,
+            score_map=SCORE_MAP_V1,
+            weights_map=WEIGHTS_MAP_V1,
+            is_active=True,
+            notes="Versão inicial (tabelas da planilha original).",
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_scoring_table, migrations.RunPython.noop),
+    ]
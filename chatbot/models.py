@@ -1,3 +1,70 @@
-from django.db import models
+# apps/chatbot/models.py
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 
-# Create your models here.
+from .utils import QUALITATIVE_KEYS, VALID_QUALITATIVE_ANSWERS
+
+
+# Limite (em módulo) de pontuações e pesos; a planilha usa valores de -1 a 3
+MAX_TABLE_VALUE = 1000
+
+
+class ScoringTable(models.Model):
+    """
+    Uma versão das tabelas de pontuação da planilha (SCORE_MAP e WEIGHTS_MAP).
+
+    Tabelas não são editadas depois de criadas: para mudar pesos, cria-se uma
+    nova versão e ela é ativada. Só uma versão fica ativa por vez; cada
+    relatório guarda em 'scoring_version' a versão que usou.
+    """
+    version = models.PositiveIntegerField(unique=True, editable=False)
+    score_map = models.JSONField(help_text="Resposta -> pontuação (ex: {\"ALTO\": 2})")
+    weights_map = models.JSONField(help_text="Critério -> peso (ex: {\"pmf\": 2})")
+    is_active = models.BooleanField(default=False, db_index=True)
+    notes = models.TextField(blank=True, help_text="O que mudou nesta versão")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-version']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['is_active'],
+                condition=models.Q(is_active=True),
+                name='scoring_table_single_active',
+            ),
+        ]
+
+    def activate(self):
+        """Torna esta a versão ativa (a anterior é desativada na mesma transação)."""
+        with transaction.atomic():
+            ScoringTable.objects.filter(is_active=True).exclude(pk=self.pk).update(is_active=False)
+            self.is_active = True
+            self.save(update_fields=['is_active'])
+
+    def clean(self):
+        for name, table in (('score_map', self.score_map), ('weights_map', self.weights_map)):
+            if not isinstance(table, dict) or not table:
+                raise ValidationError({name: "Informe um objeto JSON não vazio."})
+            if not all(isinstance(value, int) and not isinstance(value, bool) for value in table.values()):
+                raise ValidationError({name: "Todos os valores devem ser inteiros."})
+            if any(abs(value) > MAX_TABLE_VALUE for value in table.values()):
+                raise ValidationError({name: f"Os valores devem estar entre -{MAX_TABLE_VALUE} e {MAX_TABLE_VALUE}."})
+
+        # Uma chave digitada errado pontuaria 0 em silêncio em todo valuation novo
+        unknown = sorted(set(self.weights_map) - set(QUALITATIVE_KEYS))
+        if unknown:
+            raise ValidationError({'weights_map': f"Critérios desconhecidos: {', '.join(unknown)}."})
+        unknown = sorted(set(self.score_map) - VALID_QUALITATIVE_ANSWERS)
+        missing = sorted(VALID_QUALITATIVE_ANSWERS - set(self.score_map))
+        if unknown or missing:
+            problems = [f"{label}: {', '.join(keys)}" for label, keys in (("desconhecidas", unknown), ("faltando", missing)) if keys]
+            raise ValidationError({'score_map': f"Respostas {'; '.join(problems)}."})
+
+    def save(self, *args, **kwargs):
+        if self.version is None:
+            last = ScoringTable.objects.aggregate(models.Max('version'))['version__max']
+            self.version = (last or 0) + 1
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Tabela de pontuação v{self.version}{' (ativa)' if self.is_active else ''}"
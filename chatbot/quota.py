@@ -0,0 +1,188 @@
+# chatbot/quota.py
+"""
+Cota de simulações gratuitas por usuário, reservada atomicamente no Redis.
+
+Por usuário há duas chaves:
+  quota:<id>:used      usos já confirmados (espelho de CustomUser.usage_count)
+  quota:<id>:reserved  sorted set de reservas em andamento (membro -> expiração em ms)
+
+A view reserva uma vaga antes de criar o report (reserve, script Lua: usados +
+reservas em andamento < limite) e depois amarra a reserva ao id do report
+(bind_reservation). A etapa 'finalize' confirma a vaga (commit_reservation) e
+uma falha do pipeline a devolve (release_reservation). Como a checagem e a
+reserva são um único comando no Redis, N requisições simultâneas não passam
+todas pelo limite, e nada disso consulta o banco.
+
+'used' nasce do usage_count do request.user (já carregado pela autenticação)
+e expira em QUOTA_KEY_TTL_SECONDS; reconcile_quotas() (tarefa periódica)
+descarta espelhos divergentes do banco e reservas de reports já encerrados.
+Com o Redis fora, a view volta a checar só o usage_count (fail-open).
+"""
+import logging
+import uuid
+
+from django.conf import settings
+
+from valuation.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'quota'
+
+# KEYS[1] = usados, KEYS[2] = reservas; ARGV = limite, usados segundo o banco, membro, TTL da reserva (ms), TTL das chaves (s)
+RESERVE_LUA = """
+local limit = tonumber(ARGV[1])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+local used = tonumber(redis.call('GET', KEYS[1]))
+if used == nil then
+    used = tonumber(ARGV[2])
+    redis.call('SET', KEYS[1], used, 'EX', tonumber(ARGV[5]))
+end
+local pending = redis.call('ZCARD', KEYS[2])
+if used + pending >= limit then
+    return {0, used, pending}
+end
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[4]), ARGV[3])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[5]))
+return {1, used, pending + 1}
+"""
+
+# KEYS[1] = reservas; ARGV = membro antigo, membro novo
+BIND_LUA = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not score then
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZADD', KEYS[1], score, ARGV[2])
+return 1
+"""
+
+# KEYS[1] = usados, KEYS[2] = reservas; ARGV = membro
+# Sem a chave 'used' (expirada/reconciliada) não incrementa: a próxima reserva
+# recria o espelho a partir do banco, que já contém este uso.
+COMMIT_LUA = """
+redis.call('ZREM', KEYS[2], ARGV[1])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCR', KEYS[1])
+end
+return -1
+"""
+
+_scripts = {}
+
+
+def _script(name, source):
+    if name not in _scripts:
+        _scripts[name] = get_redis().register_script(source)
+    return _scripts[name]
+
+
+def _used_key(user_id):
+    return f'{KEY_PREFIX}:{user_id}:used'
+
+
+def _reserved_key(user_id):
+    return f'{KEY_PREFIX}:{user_id}:reserved'
+
+
+class QuotaExceeded(Exception):
+    """O usuário não tem vaga: 'used' confirmados + 'pending' em andamento >= limite."""
+
+    def __init__(self, used, pending):
+        self.used = used
+        self.pending = pending
+        super().__init__(f"Limite de uso atingido ({used} usados, {pending} em andamento).")
+
+
+def reserve(user, limit: int) -> str | None:
+    """
+    Reserva uma vaga para o usuário e devolve o token da reserva.
+    Levanta QuotaExceeded sem vaga. Devolve None se o Redis estiver fora,
+    e aí quem chama decide pelo usage_count.
+    """
+    token = f"pending:{uuid.uuid4().hex}"
+    try:
+        allowed, used, pending = _script('reserve', RESERVE_LUA)(
+            keys=[_used_key(user.pk), _reserved_key(user.pk)],
+            args=[limit, user.usage_count, token, settings.QUOTA_RESERVATION_TTL_SECONDS * 1000, settings.QUOTA_KEY_TTL_SECONDS],
+        )
+    except Exception as e:
+        logger.warning(f"Cota no Redis indisponível para user {user.pk}: {e}")
+        return None
+    if not allowed:
+        raise QuotaExceeded(int(used), int(pending))
+    return token
+
+
+def bind_reservation(user_id, token, report_id) -> None:
+    """Troca o token provisório pelo id do report, que as tarefas conhecem."""
+    try:
+        if not _script('bind', BIND_LUA)(keys=[_reserved_key(user_id)], args=[token, report_id]):
+            logger.warning(f"Reserva {token} do user {user_id} expirou antes de ser ligada ao Report {report_id}.")
+    except Exception as e:
+        logger.warning(f"Não foi possível ligar a reserva de cota ao Report {report_id}: {e}")
+
+
+def commit_reservation(user_id, report_id) -> None:
+    """O report concluiu: a reserva vira um uso confirmado."""
+    try:
+        _script('commit', COMMIT_LUA)(keys=[_used_key(user_id), _reserved_key(user_id)], args=[report_id])
+    except Exception as e:
+        logger.warning(f"Não foi possível confirmar a cota do Report {report_id} (a reconciliação corrige): {e}")
+
+
+def release_reservation(user_id, member) -> None:
+    """Devolve a vaga (report falhou ou não chegou a ser criado). 'member' é o token ou o id do report."""
+    try:
+        get_redis().zrem(_reserved_key(user_id), member)
+    except Exception as e:
+        logger.warning(f"Não foi possível liberar a reserva de cota {member} do user {user_id}: {e}")
+
+
+def reconcile_quotas() -> dict:
+    """
+    Compara os espelhos 'used' com CustomUser.usage_count e apaga os divergentes
+    (a próxima reserva os recria do banco); remove reservas de reports que já
+    terminaram (SUCCESS/FAILED) sem confirmar ou liberar a vaga.
+    """
+    from django.contrib.auth import get_user_model
+
+    from reports.models import ValuationReport
+
+    client = get_redis()
+    summary = {"users": 0, "reset": 0, "stale_reservations": 0}
+    user_ids = set()
+    for key in client.scan_iter(match=f'{KEY_PREFIX}:*', count=500):
+        user_ids.add(key.split(':')[1])
+
+    for batch_start in range(0, len(user_ids), 500):
+        batch = sorted(user_ids)[batch_start:batch_start + 500]
+        usage = dict(get_user_model().objects.filter(pk__in=batch).values_list('pk', 'usage_count'))
+        for user_id in batch:
+            summary["users"] += 1
+            used = client.get(_used_key(user_id))
+            if used is not None and int(used) != usage.get(int(user_id), 0):
+                client.delete(_used_key(user_id))
+                summary["reset"] += 1
+
+            report_ids = [member for member in client.zrange(_reserved_key(user_id), 0, -1) if member.isdigit()]
+            if report_ids:
+                finished = ValuationReport.objects.filter(
+                    pk__in=report_ids,
+                    status__in=[ValuationReport.StatusChoices.SUCCESS, ValuationReport.StatusChoices.FAILED],
+                ).values_list('pk', flat=True)
+                finished = [str(pk) for pk in finished]
+                if finished:
+                    client.zrem(_reserved_key(user_id), *finished)
+                    summary["stale_reservations"] += len(finished)
+
+    if summary["reset"] or summary["stale_reservations"]:
+        logger.info(
+            f"Cotas reconciliadas: {summary['users']} usuários, {summary['reset']} espelhos recriados, "
+            f"{summary['stale_reservations']} reservas órfãs removidas."
+        )
+    return summary
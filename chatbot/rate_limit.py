@@ -0,0 +1,148 @@
+# chatbot/rate_limit.py
+"""
+Rate limiter compartilhado por todos os workers (token bucket no Redis).
+
+Cada provedor externo (Gemini, Gamma) tem um balde por API key, com taxa de
+reposição e capacidade definidas em settings.RATE_LIMITS. A conta é feita
+atomicamente por um script Lua usando o relógio do próprio Redis, então
+vários workers em máquinas diferentes enxergam o mesmo orçamento.
+
+Quem não conseguir um token recebe o tempo de espera sugerido e deve se
+re-agendar (countdown) em vez de dormir segurando o worker.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+
+from valuation.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'ratelimit'
+
+# KEYS[1] = balde; ARGV = taxa (tokens/s), capacidade, tokens pedidos, consumir (1/0)
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local consume = tonumber(ARGV[4])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+local ts = tonumber(redis.call('HGET', KEYS[1], 'ts'))
+if tokens == nil or ts == nil then
+    tokens = capacity
+    ts = now
+end
+
+tokens = math.min(capacity, tokens + (math.max(0, now - ts) / 1000) * rate)
+
+local allowed = 0
+local wait = 0
+if tokens >= requested then
+    allowed = 1
+    if consume == 1 then
+        tokens = tokens - requested
+    end
+else
+    wait = (requested - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) * 2)
+return {allowed, tostring(wait), tostring(tokens)}
+"""
+
+_script = None
+
+
+class RateLimitExceeded(Exception):
+    """Sem token disponível; 'wait_seconds' é quanto falta para o próximo."""
+
+    def __init__(self, provider, wait_seconds):
+        self.provider = provider
+        self.wait_seconds = wait_seconds
+        super().__init__(f"Rate limit de '{provider}' atingido. Tente novamente em {wait_seconds:.1f}s.")
+
+
+def _api_key_for(provider):
+    return {
+        'gemini': settings.GEMINI_API_KEY,
+        'gamma': settings.GAMMA_API_KEY,
+    }.get(provider) or ''
+
+
+def _bucket_key(provider):
+    # A API key nunca vai em claro para o Redis
+    key_hash = hashlib.sha256(_api_key_for(provider).encode()).hexdigest()[:12]
+    return f'{KEY_PREFIX}:{provider}:{key_hash}'
+
+
+def _metrics_key(provider):
+    return f'{KEY_PREFIX}:metrics:{provider}'
+
+
+def _run_bucket(provider, tokens, consume):
+    global _script
+    config = settings.RATE_LIMITS[provider]
+    client = get_redis()
+    if _script is None:
+        _script = client.register_script(TOKEN_BUCKET_LUA)
+    allowed, wait, available = _script(
+        keys=[_bucket_key(provider)],
+        args=[config['rate'], config['capacity'], tokens, 1 if consume else 0],
+    )
+    return bool(allowed), float(wait), float(available)
+
+
+def acquire(provider: str, tokens: int = 1) -> tuple[bool, float]:
+    """
+    Tenta consumir 'tokens' do balde do provedor.
+    Retorna (permitido, segundos_de_espera_sugeridos).
+    Se o Redis estiver indisponível, libera a chamada (fail-open).
+    """
+    try:
+        allowed, wait, _ = _run_bucket(provider, tokens, consume=True)
+        metrics = get_redis().pipeline()
+        if allowed:
+            metrics.hincrby(_metrics_key(provider), 'acquired', 1)
+        else:
+            metrics.hincrby(_metrics_key(provider), 'throttled', 1)
+            metrics.hincrbyfloat(_metrics_key(provider), 'wait_seconds_total', wait)
+        metrics.execute()
+        return allowed, wait
+    except Exception as e:
+        logger.warning(f"Rate limiter indisponível para '{provider}', liberando chamada: {e}")
+        return True, 0.0
+
+
+def acquire_or_raise(provider: str, tokens: int = 1) -> None:
+    allowed, wait = acquire(provider, tokens)
+    if not allowed:
+        raise RateLimitExceeded(provider, wait)
+
+
+def get_limiter_state(provider: str) -> dict:
+    """Orçamento atual do balde e métricas acumuladas (acquired, throttled, espera total)."""
+    config = settings.RATE_LIMITS[provider]
+    try:
+        _, _, available = _run_bucket(provider, 0, consume=False)
+        metrics = get_redis().hgetall(_metrics_key(provider))
+    except Exception as e:
+        logger.warning(f"Rate limiter indisponível para '{provider}': {e}")
+        return {"provider": provider, "available": None, **config}
+
+    acquired = int(metrics.get('acquired', 0))
+    throttled = int(metrics.get('throttled', 0))
+    wait_total = float(metrics.get('wait_seconds_total', 0))
+    return {
+        "provider": provider,
+        "available": available,
+        "capacity": config['capacity'],
+        "rate_per_second": config['rate'],
+        "acquired": acquired,
+        "throttled": throttled,
+        "avg_wait_seconds": (wait_total / throttled) if throttled else 0.0,
+    }
@@ -0,0 +1,145 @@
+# chatbot/scenarios.py
+"""
+Cenários pessimista/otimista por simulação de Monte Carlo (NumPy).
+
+Em vez de a IA chutar uma única taxa de crescimento, simulamos milhares de
+anos seguintes para a empresa: crescimento do setor (distribuição normal da
+tabela SECTOR_GROWTH) combinado com a volatilidade própria do faturamento.
+Como o valuation_base é proporcional ao faturamento anual (chatbot.engine),
+cada faturamento simulado vira um valuation; os cenários são os percentis
+P10 (pessimista), P50 e P90 (otimista).
+
+A semente vem do hash dos próprios inputs: o mesmo relatório gera sempre os
+mesmos cenários, e o cálculo leva poucos milissegundos.
+"""
+import hashlib
+import json
+import re
+import unicodedata
+
+import numpy as np
+
+SIMULATIONS = 5000
+
+# Volatilidade do faturamento da empresa em torno do crescimento do setor (desvio do log)
+COMPANY_REVENUE_VOLATILITY = 0.15
+# Variação relativa da margem de contribuição entre simulações
+MARGIN_VOLATILITY = 0.10
+
+# Grupos de setor, reconhecidos por palavras inteiras no texto livre 'setor_atuacao'
+# (a primeira entrada que casar vale), com o crescimento anual em % (média, desvio).
+# Um '*' no fim da palavra aceita qualquer terminação ('financ*' casa "financeira"),
+# mas só no começo de uma palavra: 'bar' não casa "barbearia" nem 'app' casa "apparel".
+# O mesmo agrupamento define os pares do benchmark setorial (reports/benchmarks.py).
+SECTOR_GROWTH = (
+    ('tecnologia', ('software*', 'saas', 'tecnologi*', 'ti', 'startup*', 'aplicativo*', 'app', 'apps'), 12.0, 10.0),
+    ('financeiro', ('fintech*', 'financ*', 'banco', 'bancos', 'bancari*', 'credito', 'seguro', 'seguros', 'segurador*', 'pagamento*'), 9.0, 8.0),
+    ('saude', ('saude', 'clinica*', 'medic*', 'farmac*', 'odonto*', 'hospita*'), 8.0, 5.0),
+    ('educacao', ('educa*', 'escola*', 'curso*', 'ensino', 'treinamento*'), 7.0, 6.0),
+    ('agronegocio', ('agro*', 'agricul*', 'pecuaria', 'rural'), 6.0, 7.0),
+    ('energia', ('energia*', 'solar', 'sustentab*', 'reciclagem'), 10.0, 9.0),
+    ('logistica', ('logistica', 'transporte*', 'entrega*', 'frete*'), 6.0, 6.0),
+    ('e-commerce', ('e-commerce', 'ecommerce', 'marketplace*', 'loja virtual', 'lojas virtuais'), 10.0, 9.0),
+    ('varejo', ('varejo*', 'loja', 'lojas', 'comercio', 'mercado', 'mercados', 'supermercado*', 'minimercado*'), 4.0, 5.0),
+    ('alimentacao', ('aliment*', 'restaurante*', 'bar', 'bares', 'lanchonete*', 'padaria*', 'bebida*', 'food'), 5.0, 6.0),
+    ('construcao', ('construcao', 'construtora*', 'imobili*', 'engenharia', 'arquitetura'), 4.0, 7.0),
+    ('industria', ('industria*', 'fabrica*', 'manufatura*', 'metal*'), 3.0, 6.0),
+    ('turismo', ('turismo', 'hotel*', 'viage*', 'evento*'), 5.0, 9.0),
+    ('moda_beleza', ('moda', 'vestuario', 'beleza', 'estetica', 'cosmetic*', 'barbearia*', 'salao', 'cabelei*'), 5.0, 7.0),
+    ('servicos', ('servico*', 'consultoria*', 'marketing', 'agencia*'), 6.0, 6.0),
+)
+DEFAULT_SECTOR = 'outros'
+DEFAULT_SECTOR_GROWTH = (6.0, 7.0)
+
+
+def _keyword_regex(keyword: str) -> str:
+    if keyword.endswith('*'):
+        return rf"\b{re.escape(keyword[:-1])}"
+    return rf"\b{re.escape(keyword)}\b"
+
+
+_SECTOR_PATTERNS = tuple(
+    (key, re.compile('|'.join(_keyword_regex(keyword) for keyword in keywords)), mean, std)
+    for key, keywords, mean, std in SECTOR_GROWTH
+)
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+
+
+def _match_sector(setor_atuacao: str):
+    setor = _normalize(setor_atuacao)
+    for key, pattern, mean, std in _SECTOR_PATTERNS:
+        if pattern.search(setor):
+            return key, mean, std
+    return (DEFAULT_SECTOR, *DEFAULT_SECTOR_GROWTH)
+
+
+def sector_key(setor_atuacao: str) -> str:
+    """Grupo de setor ('tecnologia', 'varejo', ..., ou 'outros') do texto informado."""
+    return _match_sector(setor_atuacao)[0]
+
+
+def sector_growth(setor_atuacao: str) -> tuple[float, float]:
+    """(média, desvio) do crescimento anual em % para o setor informado."""
+    _, mean, std = _match_sector(setor_atuacao)
+    return mean, std
+
+
+def scenario_seed(indicadores: dict, valuation_base: float, setor_atuacao: str) -> int:
+    raw = json.dumps(
+        {"indicadores": indicadores, "valuation_base": valuation_base, "setor": _normalize(setor_atuacao).strip()},
+        sort_keys=True,
+    )
+    return int.from_bytes(hashlib.sha256(raw.encode()).digest()[:8], 'big')
+
+
+def _bands(values: np.ndarray) -> dict:
+    p10, p50, p90 = np.percentile(values, [10, 50, 90])
+    return {"p10": float(p10), "p50": float(p50), "p90": float(p90)}
+
+
+def simulate_scenarios(
+    indicadores: dict,
+    valuation_base: float,
+    setor_atuacao: str,
+    simulations: int = SIMULATIONS,
+    seed: int | None = None
+) -> dict:
+    """
+    Retorna o dict 'cenarios' do result_data: realista (= valuation_base),
+    pessimista (P10), otimista (P90), as bandas P10/P50/P90 do valuation e
+    dos indicadores simulados, e os parâmetros usados.
+    """
+    if seed is None:
+        seed = scenario_seed(indicadores, valuation_base, setor_atuacao)
+    rng = np.random.default_rng(seed)
+    mean, std = sector_growth(setor_atuacao)
+
+    growth = rng.normal(mean / 100, std / 100, simulations)
+    # Log-normal com média 1: a volatilidade não desloca o centro da distribuição
+    noise = rng.lognormal(-COMPANY_REVENUE_VOLATILITY ** 2 / 2, COMPANY_REVENUE_VOLATILITY, simulations)
+    revenue_factor = np.maximum(1 + growth, 0) * noise
+
+    faturamento_anual = float(indicadores.get('faturamento_anual') or 0)
+    valuation = valuation_base * revenue_factor
+    margem = np.clip(
+        float(indicadores.get('margem_contribuicao_perc') or 0) * rng.normal(1, MARGIN_VOLATILITY, simulations),
+        -1, 1
+    )
+
+    bands = _bands(valuation)
+    return {
+        "realista": valuation_base,
+        "pessimista": bands["p10"],
+        "otimista": bands["p90"],
+        **bands,
+        "setor_crescimento_perc": mean,
+        "setor_crescimento_desvio": std,
+        "faturamento_anual": _bands(faturamento_anual * revenue_factor),
+        "margem_contribuicao_perc": _bands(margem),
+        "simulacoes": simulations,
+        "seed": seed,
+    }
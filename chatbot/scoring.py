@@ -0,0 +1,121 @@
+# chatbot/scoring.py
+"""
+Cache em processo das tabelas de pontuação (chatbot.models.ScoringTable).
+
+Cada worker guarda a versão ativa em memória e, no máximo a cada
+SCORING_STAMP_CHECK_SECONDS, compara com o carimbo 'scoring:active_version'
+no Redis (um GET). O banco só é consultado quando o carimbo muda, ou seja,
+quando alguém ativa outra versão; nunca por relatório.
+
+Se o Redis estiver fora, o cache continua valendo e é recarregado do banco
+a cada SCORING_DB_FALLBACK_SECONDS.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from valuation.redis_client import get_redis
+from .engine import DEFAULT_TABLES, ScoringTables
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_VERSION_KEY = 'scoring:active_version'
+
+_lock = threading.Lock()
+_active = None
+_checked_at = 0.0
+_loaded_at = 0.0
+_by_version = {}
+
+
+def _to_tables(table) -> ScoringTables:
+    return ScoringTables(version=table.version, score_map=table.score_map, weights_map=table.weights_map)
+
+
+def _load_active_from_db() -> ScoringTables:
+    from .models import ScoringTable
+
+    table = ScoringTable.objects.filter(is_active=True).first()
+    if table is None:
+        logger.warning("Nenhuma ScoringTable ativa no banco. Usando as tabelas padrão (v1).")
+        return DEFAULT_TABLES
+    return _to_tables(table)
+
+
+def _read_stamp():
+    """Versão ativa segundo o Redis; None se o carimbo não existir ou o Redis estiver fora."""
+    try:
+        stamp = get_redis().get(ACTIVE_VERSION_KEY)
+        return int(stamp) if stamp is not None else None
+    except Exception as e:
+        logger.warning(f"Não foi possível ler o carimbo das tabelas de pontuação: {e}")
+        return None
+
+
+def get_active_tables() -> ScoringTables:
+    """Tabelas da versão ativa, do cache do processo."""
+    global _active, _checked_at, _loaded_at
+    now = time.monotonic()
+    if _active is not None and now - _checked_at < settings.SCORING_STAMP_CHECK_SECONDS:
+        return _active
+
+    with _lock:
+        if _active is not None and now - _checked_at < settings.SCORING_STAMP_CHECK_SECONDS:
+            return _active
+
+        stamp = _read_stamp()
+        stale = (
+            _active is None
+            or (stamp is not None and stamp != _active.version)
+            or (stamp is None and now - _loaded_at >= settings.SCORING_DB_FALLBACK_SECONDS)
+        )
+        if stale:
+            _active = _load_active_from_db()
+            _loaded_at = now
+            logger.info(f"Tabelas de pontuação v{_active.version} carregadas do banco.")
+            if stamp is None:
+                try:
+                    # Carimbo ausente (ex: Redis novo): grava sem sobrescrever uma ativação concorrente
+                    get_redis().set(ACTIVE_VERSION_KEY, _active.version, nx=True)
+                except Exception:
+                    pass
+        _checked_at = now
+    return _active
+
+
+def get_tables(version: int) -> ScoringTables:
+    """Tabelas de uma versão específica (ex: recálculo ou comparação entre versões)."""
+    if version in _by_version:
+        return _by_version[version]
+
+    from .models import ScoringTable
+
+    table = ScoringTable.objects.filter(version=version).first()
+    if table is None:
+        if version != DEFAULT_TABLES.version:
+            raise ValueError(f"Tabela de pontuação v{version} não existe.")
+        tables = DEFAULT_TABLES
+    else:
+        tables = _to_tables(table)
+    _by_version[version] = tables
+    return tables
+
+
+def publish_active_version(version: int) -> None:
+    """Grava o novo carimbo no Redis; os outros processos recarregam na próxima checagem."""
+    reset_scoring_cache()
+    try:
+        get_redis().set(ACTIVE_VERSION_KEY, version)
+        logger.info(f"Tabelas de pontuação v{version} publicadas como ativas.")
+    except Exception as e:
+        logger.warning(f"Não foi possível publicar a versão {version} das tabelas de pontuação: {e}")
+
+
+def reset_scoring_cache() -> None:
+    global _active, _checked_at, _loaded_at
+    with _lock:
+        _active = None
+        _checked_at = 0.0
+        _loaded_at = 0.0
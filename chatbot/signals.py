@@ -0,0 +1,19 @@
+# chatbot/signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .engine import DEFAULT_TABLES
+from .models import ScoringTable
+from .scoring import publish_active_version
+
+
+@receiver(post_save, sender=ScoringTable)
+@receiver(post_delete, sender=ScoringTable)
+def invalidate_scoring_cache(sender, **kwargs):
+    """Qualquer mudança nas tabelas republica o carimbo da versão ativa (após o commit)."""
+    def publish():
+        active = ScoringTable.objects.filter(is_active=True).values_list('version', flat=True).first()
+        publish_active_version(active or DEFAULT_TABLES.version)
+
+    transaction.on_commit(publish)
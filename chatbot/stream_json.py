@@ -0,0 +1,71 @@
+# chatbot/stream_json.py
+import json
+
+_WHITESPACE = ' \t\r\n'
+
+
+class IncrementalJSONObjectParser:
+    """
+    Lê um objeto JSON que chega em pedaços (streaming da IA) e devolve cada
+    campo de primeiro nível assim que o valor dele estiver completo.
+
+    Um valor só é aceito quando o próximo caractere não-branco (',' ou '}')
+    já chegou, para não cortar números ao meio (ex: "8" de "8.5").
+    Texto antes do primeiro '{' (ex: ```json) é ignorado.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = None  # None = ainda não encontrou o '{' inicial
+        self._done = False
+
+    def feed(self, chunk: str) -> list:
+        """Adiciona um pedaço de texto e retorna os pares (chave, valor) concluídos."""
+        self._buffer += chunk
+        completed = []
+        if self._done:
+            return completed
+
+        if self._pos is None:
+            start = self._buffer.find('{')
+            if start == -1:
+                return completed
+            self._pos = start + 1
+
+        while True:
+            pos = self._skip(self._pos, ',')
+            if pos >= len(self._buffer):
+                break
+            if self._buffer[pos] == '}':
+                self._done = True
+                break
+
+            try:
+                key, pos = self._decoder.raw_decode(self._buffer, pos)
+            except json.JSONDecodeError:
+                break
+            pos = self._skip(pos)
+            if pos >= len(self._buffer) or self._buffer[pos] != ':':
+                break
+            pos = self._skip(pos + 1)
+            if pos >= len(self._buffer):
+                break
+
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, pos)
+            except json.JSONDecodeError:
+                break
+            after = self._skip(end)
+            if after >= len(self._buffer) or self._buffer[after] not in ',}':
+                break
+
+            completed.append((key, value))
+            self._pos = after
+
+        return completed
+
+    def _skip(self, pos, extra=''):
+        while pos < len(self._buffer) and self._buffer[pos] in _WHITESPACE + extra:
+            pos += 1
+        return pos
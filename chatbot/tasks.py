@@ -1,216 +1,402 @@
 # chatbot/tasks.py
-from celery import shared_task
-from reports.models import ValuationReport
+from celery import chain, group, shared_task
+from reports.benchmarks import add_report_to_benchmark
+from reports.models import RESULT_HOT_FIELDS, ValuationBatch, ValuationReport
+from reports.status import publish_report_partial, publish_report_status, publish_reports_status
+from users.outbox import queue_email
+from django.db import transaction
 from django.db.models import F
+from django.utils import timezone
 from .agents import run_analysis_agent
+from .engine import calculate_report, calculate_reports
+from .insights import build_gamma_prompt, build_pontos_atencao, build_pontos_fortes
+from .quota import commit_reservation, reconcile_quotas, release_reservation
+from .rate_limit import RateLimitExceeded, acquire, acquire_or_raise
+from .scenarios import simulate_scenarios
+from .scoring import get_active_tables
 import requests
-import time
 import logging
 from django.conf import settings
 from django.apps import apps
 import random
-from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 
 logger = logging.getLogger(__name__)
 
-# --- MAPAS DE CÁLCULO (Nova Lógica) ---
-SCORE_MAP = {
-    "BAIXO": -1,
-    "NÃO CONSIGO AVALIAR": 0,
-    "MÉDIO": 1,
-    "ALTO": 2,
-    "ELEVADO": 3
-}
-
-WEIGHTS_MAP = {
-    # Peso 1
-    "visao_pessoas": 1,
-    "nivel_validacao": 1,
-    "nivel_equipe": 1,
-    "potencial_network": 1,
-    # Peso 2
-    "diferencial_modelo": 2,
-    "possibilidade_escala": 2,
-    "pmf": 2,
-    "potencial_alcance": 2,
-    "nivel_parcerias": 2,
-    "estagio_modelo": 2,
-    "estagio_prototipo": 2,
-    "nivel_analise_financeira": 2,
-    "estagio_comercializacao": 2,
-    "nivel_faturamento": 2,
-    "nivel_lucro": 2,
-    # Peso -2
-    "possibilidade_copia": -2,
-    "potencial_mercado_barreiras": -2,
-    "potencial_internacionalizacao": -2,
-}
-
-# --- TAREFA PRINCIPAL (MODIFICADA) ---
+# --- PIPELINE DE VALUATION (Etapas com checkpoint) ---
+# process_valuation_request monta a cadeia calculate -> analyse -> finalize -> present.
+# A view de cálculo roda a etapa 'calculate' inline (run_calculate_stage) e
+# enfileira só as demais.
+# Cada etapa salva sua saída no report e registra um checkpoint em
+# result_data['stages'] (espelhado nas colunas calculated_at, analysed_at, ...
+# por ValuationReport.save()); ao rodar de novo (retry, redelivery, reprocessamento
+# manual) as etapas já concluídas são puladas, e só a que falhou é refeita.
+# As etapas de cálculo rodam na fila 'fast' e as de IA/Gamma na fila 'io'
+# (ver CELERY_TASK_ROUTES em settings.py).
+STAGE_CALCULATE = 'calculate'
+STAGE_ANALYSE = 'analyse'
+STAGE_FINALIZE = 'finalize'
+STAGE_PRESENT = 'present'
+
+
+def _stage_done(report, stage):
+    return bool((report.result_data or {}).get('stages', {}).get(stage))
+
+
+def _mark_stage_done(report, stage):
+    report.result_data.setdefault('stages', {})[stage] = timezone.now().isoformat()
+
+
+def _fail_report(report_id, stage, error):
+    """Marca o report como FAILED preservando as saídas das etapas já concluídas."""
+    logger.exception(f"Erro CRÍTICO inesperado na etapa '{stage}' para Report {report_id}: {error}")
+    try:
+        report = ValuationReport.objects.filter(id=report_id).first()
+        if report:
+            result_data = report.result_data or {}
+            result_data["error"] = f"Erro inesperado na tarefa Celery: {str(error)}"
+            result_data["failed_stage"] = stage
+            report.result_data = result_data
+            report.status = ValuationReport.StatusChoices.FAILED
+            report.save(update_fields=['result_data', 'status'])
+            publish_report_status(report)
+            # A simulação não conta para a cota: devolve a vaga reservada
+            release_reservation(report.user_id, report.id)
+    except Exception as inner_e:
+        logger.error(f"Erro ao tentar marcar Report {report_id} como falho após exceção principal: {inner_e}")
+
+
+def build_valuation_pipeline(report_id, bypass_cache=False, include_calculate=True):
+    """
+    Cadeia Celery com as etapas do valuation para um report.
+    include_calculate=False quando a planilha já foi calculada na própria
+    requisição (ver chatbot.views.calculate_valuation_view): só as etapas
+    de IA, finalização e Gamma vão para a fila.
+    """
+    stages = [
+        analyse_valuation.si(report_id, bypass_cache=bypass_cache),
+        finalize_valuation.si(report_id),
+        present_valuation.si(report_id),
+    ]
+    if include_calculate:
+        stages.insert(0, calculate_valuation.si(report_id))
+    return chain(*stages)
+
+
+def _apply_calculation(report, tables, indicadores_financeiros, valores_criterios, valuation_base):
+    """Monta o result_data inicial (planilha, cenários, pontos) e marca a etapa 'calculate'."""
+    report.result_data = {
+        "indicadores": indicadores_financeiros,
+        "valores_criterios": valores_criterios,
+        "valuation_base": valuation_base,
+        "cenarios": simulate_scenarios(
+            indicadores_financeiros, valuation_base, report.inputs_data.get('setor_atuacao', '')
+        ),
+        "pontos_fortes": build_pontos_fortes(valores_criterios),
+        "pontos_atencao": build_pontos_atencao(valores_criterios),
+        "recomendacao_investidor": "",
+        "prompt_gamma": None
+    }
+    _mark_stage_done(report, STAGE_CALCULATE)
+    report.scoring_version = tables.version
+
+
+def run_calculate_stage(report):
+    """
+    Etapa 'calculate' propriamente dita: aplica as tabelas de pontuação ativas,
+    simula os cenários (Monte Carlo), grava o result_data inicial e publica o
+    resultado parcial.
+    Usada pela tarefa calculate_valuation e, inline, pela view de cálculo.
+    """
+    tables = get_active_tables()
+    indicadores_financeiros, valores_criterios, valuation_base = calculate_report(report.inputs_data, tables)
+    logger.info(f"Cálculo de planilha (tabelas v{tables.version}) concluído para Report {report.id}. Valuation Base: {valuation_base}")
+
+    _apply_calculation(report, tables, indicadores_financeiros, valores_criterios, valuation_base)
+    report.status = ValuationReport.StatusChoices.PROCESSING
+    report.save(update_fields=['result_data', 'scoring_version', 'status'])
+    publish_report_partial(report)
+
+
+# --- TAREFA PRINCIPAL (Dispara o pipeline) ---
 @shared_task
-def process_valuation_request(report_id):
+def process_valuation_request(report_id, bypass_cache=False):
     """
-    Tarefa Celery para processar o valuation usando a lógica de planilha
-    e disparar a análise da IA e a geração Gamma.
+    Tarefa Celery que dispara o pipeline de valuation do report.
+    Pode ser chamada novamente para um report que falhou: as etapas
+    já concluídas são puladas. bypass_cache força uma nova chamada à IA.
     """
-    user = None
+    updated = ValuationReport.objects.filter(id=report_id).exclude(
+        status=ValuationReport.StatusChoices.SUCCESS
+    ).update(status=ValuationReport.StatusChoices.PROCESSING)
+    if not updated and not ValuationReport.objects.filter(id=report_id).exists():
+        logger.error(f"Erro CRÍTICO: Relatório {report_id} não encontrado em process_valuation_request.")
+        return
+    if updated:
+        # O registro de status no Redis ainda pode dizer FAILED (reprocessamento)
+        publish_reports_status([report_id])
+
+    logger.info(f"Disparando pipeline de valuation para Report {report_id}")
+    build_valuation_pipeline(report_id, bypass_cache=bypass_cache).apply_async()
+
+
+@shared_task(acks_late=True)
+def calculate_valuation(report_id):
+    """Etapa 1 (fila 'fast'): cálculo de planilha (indicadores, critérios, valuation base)."""
     try:
         report = ValuationReport.objects.get(id=report_id)
-        report.status = ValuationReport.StatusChoices.PROCESSING
-        report.save(update_fields=['status'])
-
-        user = report.user
-        inputs = report.inputs_data
+        if _stage_done(report, STAGE_CALCULATE):
+            logger.info(f"Etapa '{STAGE_CALCULATE}' já concluída para Report {report_id}. Pulando.")
+            return
 
         logger.info(f"Iniciando cálculo de planilha para Report {report_id}")
-        
-        # 1. Obter dados financeiros
-        faturamento_mensal = float(inputs.get('faturamento_mensal', 0))
-        gastos_variaveis = float(inputs.get('gastos_variaveis', 0))
-        gastos_fixos = float(inputs.get('gastos_fixos', 0))
-        num_vendas = float(inputs.get('num_vendas', 1) or 1)
-        num_prospeccoes = float(inputs.get('num_prospeccoes', 1) or 1)
-        setor_atuacao = inputs.get('setor_atuacao', 'Não informado')
-
-        # Etapa 1: Calcular Indicadores Financeiros
-        faturamento_anual = faturamento_mensal * 12
-        margem_contribuicao_valor = faturamento_mensal - gastos_variaveis
-        margem_contribuicao_perc = (margem_contribuicao_valor / faturamento_mensal) if faturamento_mensal > 0 else 0
-        ticket_medio = faturamento_mensal / num_vendas
-        ponto_equilibrio = gastos_fixos / margem_contribuicao_perc if margem_contribuicao_perc > 0 else 0
-        taxa_conversao = (num_vendas / num_prospeccoes) * 100
-
-        indicadores_financeiros = {
-            "faturamento_anual": faturamento_anual,
-            "faturamento_mensal": faturamento_mensal,
-            "margem_contribuicao_valor": margem_contribuicao_valor,
-            "margem_contribuicao_perc": margem_contribuicao_perc,
-            "ticket_medio": ticket_medio,
-            "ponto_equilibrio": ponto_equilibrio,
-            "taxa_conversao": taxa_conversao,
-        }
-        
-        # Etapas 2 & 3: Calcular Valor Ponderado
-        valores_criterios = []
-        soma_valores_criterios = 0
-
-        for crit_id, crit_peso in WEIGHTS_MAP.items():
-            resposta_texto = inputs.get(crit_id, "NÃO CONSIGO AVALIAR")
-            pontuacao = SCORE_MAP.get(resposta_texto, 0)
-            valor_calculado = faturamento_anual * pontuacao * crit_peso
-            
-            valores_criterios.append({
-                "criterio_id": crit_id,
-                "resposta": resposta_texto,
-                "pontuacao": pontuacao,
-                "peso": crit_peso,
-                "valor_calculado": valor_calculado
-            })
-            soma_valores_criterios += valor_calculado
-
-        # Etapa 4: Calcular Valuation Base
-        valuation_base = soma_valores_criterios / 18 if valores_criterios else 0
-
-        logger.info(f"Cálculo de planilha concluído para Report {report_id}. Valuation Base: {valuation_base}")
-
-        report.result_data = {
-            "indicadores": indicadores_financeiros,
-            "valores_criterios": valores_criterios,
-            "valuation_base": valuation_base,
-            "cenarios": {
-                "realista": valuation_base,
-                "otimista": None,
-                "pessimista": None,
-                "setor_crescimento_perc": None
-            },
-            "pontos_fortes": [],
-            "pontos_atencao": [],
-            "recomendacao_investidor": "",
-            "prompt_gamma": None
-        }
+        run_calculate_stage(report)
+
+    except ValuationReport.DoesNotExist:
+        logger.error(f"Erro CRÍTICO: Relatório {report_id} não encontrado em calculate_valuation.")
+        raise
+    except Exception as e:
+        _fail_report(report_id, STAGE_CALCULATE, e)
+        raise
+
+
+@shared_task(bind=True, acks_late=True)
+def analyse_valuation(self, report_id, bypass_cache=False):
+    """
+    Etapa 2 (fila 'io'): consulta o Agente Gemini (texto sobre perfil de
+    investidor) e monta localmente o prompt do Gamma. Os cenários já vêm
+    da etapa 'calculate' (chatbot/scenarios.py).
+    """
+    try:
+        report = ValuationReport.objects.select_related('user').get(id=report_id)
+        if _stage_done(report, STAGE_ANALYSE):
+            logger.info(f"Etapa '{STAGE_ANALYSE}' já concluída para Report {report_id}. Pulando.")
+            return
+
+        result_data = report.result_data
+
+        def publish_partial_field(key, value):
+            # Grava o texto da IA assim que chega, para a página mostrar resultados parciais
+            if key != "recomendacao_investidor":
+                return
+            result_data["recomendacao_investidor"] = str(value).strip()
+            report.save(update_fields=['result_data'])
+            publish_report_partial(report)
 
-        # 5. Chama o Agente Gemini (Modificado)
         logger.info(f"Iniciando chamada ao Agente Gemini (Análise) para Report {report_id}")
-        
-        # --- MUDANÇA AQUI ---
-        # Adicionamos user.razao_social à chamada
         agent_result = run_analysis_agent(
-            user_razao_social=user.razao_social,
-            setor_atuacao=setor_atuacao,
-            indicadores=indicadores_financeiros,
-            valores_criterios=valores_criterios,
-            valuation_base=valuation_base
+            user_razao_social=report.user.razao_social,
+            setor_atuacao=report.inputs_data.get('setor_atuacao', 'Não informado'),
+            indicadores=result_data["indicadores"],
+            valores_criterios=result_data["valores_criterios"],
+            valuation_base=result_data["valuation_base"],
+            use_cache=not bypass_cache,
+            on_field=publish_partial_field
         )
-        # --- FIM DA MUDANÇA ---
-        
         logger.info(f"Agente Gemini (Análise) retornou para Report {report_id}")
 
         if agent_result and not agent_result.get("error"):
-            report.result_data.update(agent_result)
+            result_data.pop("agent_error", None)
+            result_data["recomendacao_investidor"] = agent_result["recomendacao_investidor"]
+            result_data["metricas_ia"] = agent_result.get("metricas")
+            result_data["prompt_gamma"] = build_gamma_prompt(
+                razao_social=report.user.razao_social,
+                setor_atuacao=report.inputs_data.get('setor_atuacao', 'Não informado'),
+                indicadores=result_data["indicadores"],
+                cenarios=result_data["cenarios"],
+                pontos_fortes=result_data["pontos_fortes"],
+                pontos_atencao=result_data["pontos_atencao"],
+                recomendacao_investidor=result_data["recomendacao_investidor"]
+            )
+            # Só marca o checkpoint com sucesso: um reprocessamento tenta a IA de novo
+            _mark_stage_done(report, STAGE_ANALYSE)
         elif agent_result.get("error"):
-            report.result_data["agent_error"] = agent_result.get("error")
+            result_data["agent_error"] = agent_result.get("error")
             logger.error(f"Agente Gemini (Análise) falhou para Report {report_id}: {agent_result.get('error')}")
-        
-        report.status = ValuationReport.StatusChoices.SUCCESS
-        gamma_generation_triggered = False
 
-        # 7. Atualiza o contador de uso
-        if user:
+        report.save(update_fields=['result_data'])
+        publish_report_partial(report)
+
+    except RateLimitExceeded as e:
+        # Sem orçamento no Gemini: re-agenda a etapa (a cadeia continua depois dela).
+        # Esgotados os adiamentos, falha o report: senão ele ficaria em PROCESSING
+        # para sempre, segurando a reserva de cota e a vaga do lote.
+        if self.request.retries >= settings.RATE_LIMIT_MAX_DEFERRALS:
+            _fail_report(report_id, STAGE_ANALYSE, e)
+            raise
+        countdown = e.wait_seconds + random.uniform(0, 1)
+        logger.info(f"{e} Etapa '{STAGE_ANALYSE}' do Report {report_id} re-agendada em {countdown:.1f}s.")
+        raise self.retry(countdown=countdown, max_retries=settings.RATE_LIMIT_MAX_DEFERRALS)
+    except ValuationReport.DoesNotExist:
+        logger.error(f"Erro CRÍTICO: Relatório {report_id} não encontrado em analyse_valuation.")
+        raise
+    except Exception as e:
+        _fail_report(report_id, STAGE_ANALYSE, e)
+        raise
+
+
+@shared_task(acks_late=True)
+def finalize_valuation(report_id):
+    """
+    Etapa 3 (fila 'fast'): marca o report como SUCCESS, incrementa o
+    contador de uso e o benchmark setorial (uma única vez) e prepara o gamma_status.
+    """
+    try:
+        with transaction.atomic():
+            report = ValuationReport.objects.select_for_update().get(id=report_id)
+
+            if _stage_done(report, STAGE_FINALIZE):
+                logger.info(f"Etapa '{STAGE_FINALIZE}' já concluída para Report {report_id}. Pulando.")
+                if report.status != ValuationReport.StatusChoices.SUCCESS:
+                    report.result_data.pop("error", None)
+                    report.status = ValuationReport.StatusChoices.SUCCESS
+                    report.save(update_fields=['result_data', 'status'])
+                    transaction.on_commit(lambda: publish_report_status(report))
+                return
+
+            # 7. Atualiza o contador de uso
             User = apps.get_model(settings.AUTH_USER_MODEL)
-            User.objects.filter(pk=user.pk).update(usage_count=F('usage_count') + 1)
-            logger.info(f"Contador de uso incrementado para user {user.pk}")
-        else:
-            logger.warning(f"Objeto User não disponível para incrementar usage_count no Report {report_id}")
+            User.objects.filter(pk=report.user_id).update(usage_count=F('usage_count') + 1)
+            logger.info(f"Contador de uso incrementado para user {report.user_id}")
+            transaction.on_commit(lambda: commit_reservation(report.user_id, report.id))
 
-        # 8. Prepara para disparar Gamma
-        if report.result_data and report.result_data.get('prompt_gamma'):
-            report.result_data['gamma_status'] = 'pending'
-            gamma_generation_triggered = True
-            logger.info(f"Gamma status definido como 'pending' para Report {report_id}")
-        else:
-            logger.warning(f"Prompt Gamma não encontrado na resposta do Gemini para Report {report_id}. Geração Gamma não será disparada.")
+            # 7.1 Soma o relatório ao benchmark do setor (mesma transação: conta uma vez só).
+            # Em savepoint: uma falha aqui não derruba o relatório; o rebuild corrige depois.
+            try:
+                with transaction.atomic():
+                    add_report_to_benchmark(report)
+            except Exception as e:
+                logger.error(f"Falha ao atualizar o benchmark setorial com o Report {report_id}: {e}", exc_info=True)
+
+            # 8. Prepara para disparar Gamma
+            if report.result_data.get('prompt_gamma'):
+                if report.gamma_status not in ['completed', 'failed']:
+                    report.result_data['gamma_status'] = 'pending'
+                logger.info(f"Gamma status definido como 'pending' para Report {report_id}")
+            else:
+                logger.warning(f"Prompt Gamma não encontrado na resposta do Gemini para Report {report_id}. Geração Gamma não será disparada.")
+
+            # 9. Salva o resultado final e status
+            report.result_data.pop("error", None)
+            report.status = ValuationReport.StatusChoices.SUCCESS
+            _mark_stage_done(report, STAGE_FINALIZE)
+            report.save(update_fields=['result_data', 'status'])
+            transaction.on_commit(lambda: publish_report_status(report))
+            logger.info(f"Resultado final e status salvos para Report {report_id}")
 
-        # 9. Salva o resultado final e status
-        report.save(update_fields=['result_data', 'status'])
-        logger.info(f"Resultado final e status salvos para Report {report_id}")
+    except ValuationReport.DoesNotExist:
+        logger.error(f"Erro CRÍTICO: Relatório {report_id} não encontrado em finalize_valuation.")
+        raise
+    except Exception as e:
+        _fail_report(report_id, STAGE_FINALIZE, e)
+        raise
 
-        # 10. Dispara a tarefa Gamma
-        if gamma_generation_triggered:
-            logger.info(f"Disparando tarefa generate_gamma_presentation para Report {report_id}")
-            generate_gamma_presentation.delay(report_id)
+
+@shared_task(acks_late=True)
+def present_valuation(report_id):
+    """Etapa 4 (fila 'io'): dispara a geração da apresentação Gamma."""
+    try:
+        report = ValuationReport.objects.get(id=report_id)
+        if _stage_done(report, STAGE_PRESENT):
+            logger.info(f"Etapa '{STAGE_PRESENT}' já concluída para Report {report_id}. Pulando.")
+            return
+
+        # 10. Marca a etapa ANTES de disparar a tarefa Gamma: ela grava no mesmo
+        # result_data (generationId, tentativas, status) e não pode ser sobrescrita
+        with transaction.atomic():
+            _mark_stage_done(report, STAGE_PRESENT)
+            report.save(update_fields=['result_data'])
+            if report.gamma_status == 'pending':
+                logger.info(f"Disparando tarefa generate_gamma_presentation para Report {report_id}")
+                transaction.on_commit(lambda: generate_gamma_presentation.delay(report_id))
 
     except ValuationReport.DoesNotExist:
-        logger.error(f"Erro CRÍTICO: Relatório {report_id} não encontrado em process_valuation_request.")
+        logger.error(f"Erro CRÍTICO: Relatório {report_id} não encontrado em present_valuation.")
+        raise
     except Exception as e:
-        logger.exception(f"Erro CRÍTICO inesperado em process_valuation_request para Report {report_id}: {e}")
-        try:
-            report_qs = ValuationReport.objects.filter(id=report_id)
-            if report_qs.exists():
-                report_qs.update(
-                    status=ValuationReport.StatusChoices.FAILED,
-                    result_data={"error": f"Erro inesperado na tarefa Celery: {str(e)}"}
-                )
-        except Exception as inner_e:
-            logger.error(f"Erro ao tentar marcar Report {report_id} como falho após exceção principal: {inner_e}")
+        _fail_report(report_id, STAGE_PRESENT, e)
+        raise
+
+
+# --- TAREFAS PARA GERAR APRESENTAÇÃO GAMMA (Polling não-bloqueante) ---
+# A geração é dividida em dois passos curtos: 'generate_gamma_presentation'
+# envia o prompt e guarda o generationId no report; 'poll_gamma_generation'
+# consulta o status UMA vez e, se ainda não terminou, se re-agenda com countdown.
+# Assim nenhum slot do worker fica preso em time.sleep() entre as consultas.
+# Com GAMMA_POLL_MODE='service', o polling fica a cargo do processo único
+# 'run_gamma_poller' (chatbot/gamma_poller.py) e estas tarefas só enviam o prompt.
+GAMMA_ENDPOINT = f"{settings.GAMMA_API_BASE_URL}/generations"
+GAMMA_POLL_INTERVAL_SECONDS = 30
+GAMMA_POLL_TIMEOUT_SECONDS = 480
+GAMMA_MAX_POLL_ATTEMPTS = GAMMA_POLL_TIMEOUT_SECONDS // GAMMA_POLL_INTERVAL_SECONDS
+GAMMA_MAX_GENERATION_ATTEMPTS = 3
+
+
+def _gamma_headers():
+    return {"X-API-KEY": settings.GAMMA_API_KEY, "Content-Type": "application/json"}
+
+
+def _mark_gamma_failed(report):
+    """Marca o gamma_status como 'failed' se a geração ainda estiver pendente."""
+    if report and report.result_data and report.gamma_status == 'pending':
+        report.result_data['gamma_status'] = 'failed'
+        report.save(update_fields=['result_data'])
+        publish_report_status(report)
+
+
+def _complete_gamma_generation(report, gamma_url):
+    """Salva a URL da apresentação concluída e dispara o email para o usuário."""
+    report.gamma_presentation_url = gamma_url
+    report.result_data['gamma_status'] = 'completed'
+    report.save(update_fields=['gamma_presentation_url', 'result_data'])
+    publish_report_status(report)
+    logger.info(f"Apresentação Gamma concluída e URL salva para Report {report.id}: {gamma_url}")
+    try:
+        send_gamma_report_email.delay(report.id)
+        logger.info(f"Tarefa de envio de email disparada para Report {report.id}")
+    except Exception as e_email:
+        logger.error(f"Falha ao disparar tarefa send_gamma_report_email para Report {report.id}: {e_email}")
+
+
+def _restart_gamma_generation(report, reason):
+    """
+    Descarta o generationId atual e dispara uma nova geração (com backoff),
+    até GAMMA_MAX_GENERATION_ATTEMPTS. Depois disso, marca a falha.
+    """
+    attempts = report.result_data.get('gamma_generation_attempts', 1)
+    report.result_data.pop('gamma_generation_id', None)
+    report.result_data['gamma_poll_attempts'] = 0
+
+    if attempts >= GAMMA_MAX_GENERATION_ATTEMPTS:
+        logger.error(f"Máximo de gerações Gamma atingido para Report {report.id} ({reason}).")
+        report.result_data['gamma_status'] = 'failed'
+        report.save(update_fields=['result_data'])
+        publish_report_status(report)
+        return
+
+    report.save(update_fields=['result_data'])
+    retry_delay = int(random.uniform(2, 5) * (2 ** attempts))
+    logger.warning(f"Reiniciando geração Gamma para Report {report.id} em {retry_delay}s ({reason}).")
+    generate_gamma_presentation.apply_async(args=[report.id], countdown=retry_delay)
 
 
-# --- TAREFA PARA GERAR APRESENTAÇÃO GAMMA (Sem mudanças) ---
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
-def generate_gamma_presentation(self, report_id):
+def generate_gamma_presentation(self, report_id, deferrals=0):
     """
-    Tarefa Celery para pegar o prompt do report, chamar a API Gamma,
-    fazer polling e salvar a URL da apresentação gerada.
+    Tarefa Celery para pegar o prompt do report, enviar à API Gamma,
+    salvar o generationId e agendar o primeiro passo de polling.
+    Se o report já tiver um generationId (ex: restart do worker), apenas
+    retoma o polling em vez de enviar o prompt novamente.
+    'deferrals' conta os re-agendamentos por falta de token (até RATE_LIMIT_MAX_DEFERRALS).
     """
     logger.info(f"Iniciando geração Gamma para Report ID: {report_id} (Tentativa {self.request.retries + 1})")
     report = None
-    generation_id = None
     try:
         report = ValuationReport.objects.get(id=report_id)
 
         prompt_gamma = report.result_data.get('prompt_gamma')
-        current_gamma_status = report.result_data.get('gamma_status')
+        current_gamma_status = report.gamma_status
 
         if not prompt_gamma:
             logger.warning(f"Report {report_id} não possui prompt_gamma. Abortando tarefa Gamma.")
@@ -219,77 +405,58 @@ def generate_gamma_presentation(self, report_id):
              logger.warning(f"Report {report_id} já tem gamma_status '{current_gamma_status}'. Abortando tarefa Gamma.")
              return
 
-        gamma_api_key = settings.GAMMA_API_KEY
-        if not gamma_api_key:
+        if report.result_data.get('gamma_generation_id'):
+            logger.info(f"Report {report_id} já possui generationId {report.result_data['gamma_generation_id']}. Retomando polling.")
+            if settings.GAMMA_POLL_MODE != 'service':
+                poll_gamma_generation.delay(report_id)
+            return
+
+        if not settings.GAMMA_API_KEY:
             logger.error(f"GAMMA_API_KEY não configurada. Marcando falha para Report {report_id}.")
             if report.result_data:
                 report.result_data['gamma_status'] = 'failed'
                 report.save(update_fields=['result_data'])
+                publish_report_status(report)
             return
 
-        headers = {"X-API-KEY": gamma_api_key, "Content-Type": "application/json"}
         gamma_payload = {"inputText": prompt_gamma, "format": "presentation", "textMode": "generate", "textOptions": {"language": "pt-br"}}
-        gamma_endpoint = "https://public-api.gamma.app/v0.2/generations"
 
+        acquire_or_raise('gamma')
         logger.info(f"Enviando prompt para Gamma API para Report {report_id}")
-        response_post = requests.post(gamma_endpoint, headers=headers, json=gamma_payload, timeout=30)
+        response_post = requests.post(GAMMA_ENDPOINT, headers=_gamma_headers(), json=gamma_payload, timeout=30)
         response_post.raise_for_status()
         generation_id = response_post.json().get("generationId")
         if not generation_id:
             logger.error(f"Gamma API não retornou generationId para Report {report_id}. Resposta: {response_post.text}")
             raise ValueError("Gamma API não retornou ID de geração.")
 
-        logger.info(f"Gamma iniciou geração (ID: {generation_id}) para Report {report_id}. Iniciando polling...")
-        status_endpoint = f"{gamma_endpoint}/{generation_id}"
-        start_time = time.time()
-        timeout_seconds = 480
+        # Checkpoint: a partir daqui um restart retoma o polling sem reenviar o prompt
+        report.result_data['gamma_generation_id'] = generation_id
+        report.result_data['gamma_poll_attempts'] = 0
+        report.result_data['gamma_generation_attempts'] = report.result_data.get('gamma_generation_attempts', 0) + 1
+        report.save(update_fields=['result_data'])
 
-        while (time.time() - start_time) < timeout_seconds:
-            time.sleep(30)
-            try:
-                response_get = requests.get(status_endpoint, headers=headers, timeout=15)
-                response_get.raise_for_status()
-                status_data = response_get.json()
-                current_status = status_data.get('status')
-                logger.info(f"Status Gamma para {generation_id} (Report {report_id}): {current_status}")
-
-                if current_status == "completed":
-                    gamma_url = status_data.get("gammaUrl")
-                    if gamma_url:
-                        report.gamma_presentation_url = gamma_url
-                        if report.result_data:
-                            report.result_data['gamma_status'] = 'completed'
-                        report.save(update_fields=['gamma_presentation_url', 'result_data'])
-                        logger.info(f"Apresentação Gamma concluída e URL salva para Report {report_id}: {gamma_url}")                        
-                        try:
-                            send_gamma_report_email.delay(report_id)
-                            logger.info(f"Tarefa de envio de email disparada para Report {report_id}")
-                        except Exception as e_email:
-                            logger.error(f"Falha ao disparar tarefa send_gamma_report_email para Report {report_id}: {e_email}")                        
-                        return
-                    else:
-                        logger.error(f"Status Gamma 'completed' mas sem gammaUrl para {generation_id}. Resposta: {status_data}")
-                        raise ValueError("Resposta Gamma 'completed' sem URL.")
-
-                elif current_status in ["failed", "error"]:
-                     logger.error(f"Geração Gamma falhou explicitamente para {generation_id}. Status: {current_status}. Resposta: {status_data}")
-                     raise ValueError(f"Geração Gamma falhou com status: {current_status}")
-
-            except requests.exceptions.Timeout:
-                logger.warning(f"Timeout durante polling do status Gamma para {generation_id}. Tentando novamente...")
-            except requests.exceptions.RequestException as poll_error:
-                if poll_error.response is not None and 400 <= poll_error.response.status_code < 500:
-                     logger.error(f"Erro cliente ({poll_error.response.status_code}) durante polling Gamma para {generation_id}. Abortando retentativas. Erro: {poll_error}")
-                     raise
-                else:
-                     logger.warning(f"Erro de rede/servidor durante polling Gamma para {generation_id}: {poll_error}. Tentando novamente...")
-            
-        logger.error(f"Timeout geral ({timeout_seconds}s) atingido ao esperar geração Gamma para Report {report_id} (ID: {generation_id}).")
-        raise TimeoutError("Geração Gamma demorou demasiado.")
+        if settings.GAMMA_POLL_MODE == 'service':
+            logger.info(f"Gamma iniciou geração (ID: {generation_id}) para Report {report_id}. Polling delegado ao run_gamma_poller.")
+            return
+
+        logger.info(f"Gamma iniciou geração (ID: {generation_id}) para Report {report_id}. Agendando polling...")
+        poll_gamma_generation.apply_async(args=[report_id], countdown=GAMMA_POLL_INTERVAL_SECONDS)
 
+    except RateLimitExceeded as e:
+        # Re-enfileira sem consumir as retentativas reservadas para erros reais
+        if deferrals >= settings.RATE_LIMIT_MAX_DEFERRALS:
+            logger.error(f"{e} Geração Gamma do Report {report_id} adiada {deferrals} vezes. Desistindo.")
+            _mark_gamma_failed(report)
+            return
+        countdown = e.wait_seconds + random.uniform(0, 1)
+        logger.info(f"{e} Geração Gamma do Report {report_id} re-agendada em {countdown:.1f}s.")
+        generate_gamma_presentation.apply_async(
+            args=[report_id], kwargs={'deferrals': deferrals + 1}, countdown=countdown
+        )
     except ValuationReport.DoesNotExist:
         logger.error(f"Erro CRÍTICO: Report {report_id} não encontrado em generate_gamma_presentation.")
-    except (requests.exceptions.RequestException, ValueError, TimeoutError) as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         logger.warning(f"Erro tratável ({type(e).__name__}) na tarefa Gamma para Report {report_id}: {e}. Verificando retentativas...")
         try:
             retry_delay = int(random.uniform(2, 5) * (2 ** self.request.retries))
@@ -297,25 +464,103 @@ def generate_gamma_presentation(self, report_id):
             raise self.retry(exc=e, countdown=retry_delay)
         except self.MaxRetriesExceededError:
              logger.error(f"Máximo de retentativas atingido para Report {report_id} na tarefa Gamma.")
-             if report and report.result_data and report.result_data.get('gamma_status') == 'pending':
-                 report.result_data['gamma_status'] = 'failed'
-                 report.save(update_fields=['result_data'])
+             _mark_gamma_failed(report)
     except Exception as e:
         logger.exception(f"Erro INESPERADO na tarefa generate_gamma_presentation para Report {report_id}: {e}")
-        if report and report.result_data and report.result_data.get('gamma_status') == 'pending':
-            report.result_data['gamma_status'] = 'failed'
-            report.save(update_fields=['result_data'])
+        _mark_gamma_failed(report)
+
+
+@shared_task
+def poll_gamma_generation(report_id):
+    """
+    Consulta UMA vez o status da geração Gamma salva no report.
+    Se ainda estiver em andamento, re-agenda a si mesma com countdown;
+    o número de tentativas fica salvo no report para sobreviver a restarts.
+    """
+    report = None
+    try:
+        report = ValuationReport.objects.get(id=report_id)
+        result_data = report.result_data or {}
+
+        if report.gamma_status != 'pending':
+            logger.info(f"Report {report_id} com gamma_status '{report.gamma_status}'. Polling encerrado.")
+            return
+
+        generation_id = result_data.get('gamma_generation_id')
+        if not generation_id:
+            logger.warning(f"Report {report_id} sem generationId salvo. Redisparando geração Gamma.")
+            generate_gamma_presentation.delay(report_id)
+            return
+
+        attempts = result_data.get('gamma_poll_attempts', 0)
+        if attempts >= GAMMA_MAX_POLL_ATTEMPTS:
+            logger.error(f"Timeout geral ({GAMMA_POLL_TIMEOUT_SECONDS}s) atingido ao esperar geração Gamma para Report {report_id} (ID: {generation_id}).")
+            _restart_gamma_generation(report, "timeout")
+            return
+
+        allowed, wait = acquire('gamma')
+        if not allowed:
+            # Sem orçamento: a consulta é adiada e não conta como tentativa
+            poll_gamma_generation.apply_async(args=[report_id], countdown=wait + random.uniform(0, 1))
+            return
 
+        result_data['gamma_poll_attempts'] = attempts + 1
+        report.save(update_fields=['result_data'])
 
-# --- TAREFA PARA ENVIAR O EMAIL DO RELATÓRIO (Sem mudanças) ---
+        try:
+            response_get = requests.get(f"{GAMMA_ENDPOINT}/{generation_id}", headers=_gamma_headers(), timeout=15)
+            response_get.raise_for_status()
+        except requests.exceptions.Timeout:
+            logger.warning(f"Timeout durante polling do status Gamma para {generation_id}. Tentando novamente...")
+            poll_gamma_generation.apply_async(args=[report_id], countdown=GAMMA_POLL_INTERVAL_SECONDS)
+            return
+        except requests.exceptions.RequestException as poll_error:
+            if poll_error.response is not None and 400 <= poll_error.response.status_code < 500:
+                logger.error(f"Erro cliente ({poll_error.response.status_code}) durante polling Gamma para {generation_id}. Erro: {poll_error}")
+                _restart_gamma_generation(report, f"erro cliente {poll_error.response.status_code}")
+            else:
+                logger.warning(f"Erro de rede/servidor durante polling Gamma para {generation_id}: {poll_error}. Tentando novamente...")
+                poll_gamma_generation.apply_async(args=[report_id], countdown=GAMMA_POLL_INTERVAL_SECONDS)
+            return
+
+        status_data = response_get.json()
+        current_status = status_data.get('status')
+        logger.info(f"Status Gamma para {generation_id} (Report {report_id}): {current_status} (consulta {attempts + 1}/{GAMMA_MAX_POLL_ATTEMPTS})")
+
+        if current_status == "completed":
+            gamma_url = status_data.get("gammaUrl")
+            if not gamma_url:
+                logger.error(f"Status Gamma 'completed' mas sem gammaUrl para {generation_id}. Resposta: {status_data}")
+                _restart_gamma_generation(report, "resposta 'completed' sem URL")
+                return
+
+            _complete_gamma_generation(report, gamma_url)
+
+        elif current_status in ["failed", "error"]:
+            logger.error(f"Geração Gamma falhou explicitamente para {generation_id}. Status: {current_status}. Resposta: {status_data}")
+            _restart_gamma_generation(report, f"status {current_status}")
+
+        else:
+            poll_gamma_generation.apply_async(args=[report_id], countdown=GAMMA_POLL_INTERVAL_SECONDS)
+
+    except ValuationReport.DoesNotExist:
+        logger.error(f"Erro CRÍTICO: Report {report_id} não encontrado em poll_gamma_generation.")
+    except Exception as e:
+        logger.exception(f"Erro INESPERADO na tarefa poll_gamma_generation para Report {report_id}: {e}")
+        _mark_gamma_failed(report)
+
+
+# --- TAREFA PARA ENVIAR O EMAIL DO RELATÓRIO ---
 @shared_task(bind=True, max_retries=3, default_retry_delay=180)
 def send_gamma_report_email(self, report_id):
     """
-    Envia um email para o usuário com o link da apresentação Gamma concluída.
+    Monta o email com o link da apresentação Gamma concluída e o grava na
+    caixa de saída (users.outbox); o envio SMTP é feito em lote pela
+    tarefa periódica drain_email_outbox.
     """
     logger.info(f"Iniciando envio de email do relatório Gamma para Report ID: {report_id}")
     try:
-        report = ValuationReport.objects.get(id=report_id)
+        report = ValuationReport.objects.select_related('user').get(id=report_id)
         
         if not report.gamma_presentation_url:
             logger.warning(f"Report {report_id} não tem URL Gamma. Abortando envio de email.")
@@ -331,21 +576,87 @@ def send_gamma_report_email(self, report_id):
         
         html_message = render_to_string('users/gamma_report_email.html', context)
         plain_message = strip_tags(html_message) 
-        
-        from_email = settings.DEFAULT_FROM_EMAIL
-        to_email = user.email
-
-        msg = EmailMultiAlternatives(subject, plain_message, from_email, [to_email])
-        msg.attach_alternative(html_message, "text/html")
-        msg.send()
 
-        logger.info(f"Email do relatório Gamma enviado com sucesso para {to_email} (Report {report_id})")
+        queue_email(subject, plain_message, user.email, html_body=html_message, kind='gamma_report')
+        logger.info(f"Email do relatório Gamma enfileirado para {user.email} (Report {report_id})")
 
     except ValuationReport.DoesNotExist:
          logger.error(f"Erro CRÍTICO: Report {report_id} não encontrado em send_gamma_report_email.")
     except Exception as e:
-        logger.error(f"Erro ao enviar email do relatório Gamma para Report {report_id}: {e}", exc_info=True)
+        logger.error(f"Erro ao enfileirar email do relatório Gamma para Report {report_id}: {e}", exc_info=True)
         try:
             raise self.retry(exc=e, countdown=int(random.uniform(2, 5) * (self.request.retries + 1)))
         except self.MaxRetriesExceededError:
-             logger.error(f"Máximo de retentativas atingido para envio de email do Report {report_id}.")
\ No newline at end of file
+             logger.error(f"Máximo de retentativas atingido para envio de email do Report {report_id}.")
+
+
+# --- RECONCILIAÇÃO DA COTA DE USO ---
+@shared_task
+def reconcile_usage_quotas():
+    """Periódica (CELERY_BEAT_SCHEDULE): alinha a cota no Redis com CustomUser.usage_count."""
+    return reconcile_quotas()
+
+
+# --- LOTES (várias empresas num envio, ver chatbot/batch.py) ---
+@shared_task
+def start_valuation_batch(batch_id):
+    """
+    Calcula a planilha de todos os reports do lote numa única passada do motor
+    vetorizado (os números já aparecem no progresso) e começa o despacho.
+    """
+    reports = list(
+        ValuationReport.objects.filter(
+            batch_id=batch_id, status=ValuationReport.StatusChoices.PENDING, calculated_at__isnull=True
+        ).order_by('id')
+    )
+    try:
+        if reports:
+            tables = get_active_tables()
+            results = calculate_reports([report.inputs_data for report in reports], tables)
+            for report, (indicadores, valores_criterios, valuation_base) in zip(reports, results):
+                _apply_calculation(report, tables, indicadores, valores_criterios, valuation_base)
+                report.sync_hot_fields(sources=('result_data',))
+            ValuationReport.objects.bulk_update(reports, ['result_data', 'scoring_version', *RESULT_HOT_FIELDS], batch_size=500)
+            logger.info(f"Planilha calculada para {len(reports)} reports do lote {batch_id} (tabelas v{tables.version}).")
+    except Exception as e:
+        # Despacha mesmo assim: a etapa 'calculate' de cada pipeline calcula report a report
+        logger.error(f"Falha no cálculo em bloco do lote {batch_id}. Seguindo com o cálculo por report: {e}", exc_info=True)
+    finally:
+        dispatch_valuation_batch.delay(batch_id)
+
+
+@shared_task
+def dispatch_valuation_batch(batch_id):
+    """
+    Enfileira os pipelines do lote em ondas (um group por onda), mantendo no
+    máximo VALUATION_BATCH_MAX_IN_FLIGHT reports em PROCESSING. Reagenda-se
+    até não sobrar report pendente.
+    """
+    batch = ValuationBatch.objects.filter(id=batch_id).first()
+    if batch is None:
+        logger.error(f"Lote {batch_id} não encontrado em dispatch_valuation_batch.")
+        return
+
+    reports = ValuationReport.objects.filter(batch_id=batch_id)
+    in_flight = reports.filter(status=ValuationReport.StatusChoices.PROCESSING).count()
+    slots = settings.VALUATION_BATCH_MAX_IN_FLIGHT - in_flight
+    if slots > 0:
+        with transaction.atomic():
+            report_ids = list(
+                reports.select_for_update(skip_locked=True)
+                .filter(status=ValuationReport.StatusChoices.PENDING)
+                .order_by('id')
+                .values_list('id', flat=True)[:slots]
+            )
+            reports.filter(id__in=report_ids).update(status=ValuationReport.StatusChoices.PROCESSING)
+        if report_ids:
+            publish_reports_status(report_ids)
+            # A etapa 'calculate' já foi feita em start_valuation_batch e é pulada; fica na
+            # cadeia para o caso de o cálculo em bloco ter falhado
+            group(build_valuation_pipeline(report_id, bypass_cache=batch.bypass_cache) for report_id in report_ids).apply_async()
+            logger.info(f"Lote {batch_id}: {len(report_ids)} pipelines despachados ({in_flight} já em andamento).")
+
+    if reports.filter(status=ValuationReport.StatusChoices.PENDING).exists():
+        dispatch_valuation_batch.apply_async((batch_id,), countdown=settings.VALUATION_BATCH_DISPATCH_SECONDS)
+    else:
+        logger.info(f"Lote {batch_id}: todos os reports foram despachados.")
@@ -1,3 +1,950 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import random
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db.models import QuerySet
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from reports.models import ValuationBatch, ValuationReport, inputs_fingerprint
+from reports.status import get_status_record
+from valuation.testing import FakeRedisMixin, make_report, make_user
+from . import scoring
+from .analysis_cache import get_cached_analysis, set_cached_analysis
+from .batch import BatchError, create_batch, parse_batch_file, validate_rows
+from .dedup import (
+    CLAIMED, DUPLICATE, IN_PROGRESS, PENDING, PENDING_TTL_SECONDS, claim_submission, record_submission,
+)
+from .engine import (
+    CRITERIA, DEFAULT_ANSWER, FINANCIAL_FIELDS, FINANCIAL_MULTIPLIERS, SCORE_MAP, WEIGHTS_MAP, ScoringTables,
+    calculate_report, calculate_reports, what_if,
+)
+from .gamma_poller import GammaPoller
+from .gemini_client import GEMINI_MAX_OUTPUT_TOKENS, get_gemini_model, reset_gemini_client
+from .insights import build_gamma_prompt
+from .management.commands.revalue_reports import checkpoint_signature
+from .models import MAX_TABLE_VALUE, ScoringTable
+from .quota import (
+    QuotaExceeded, bind_reservation, commit_reservation, reconcile_quotas, release_reservation, reserve,
+)
+from .rate_limit import RateLimitExceeded, acquire, acquire_or_raise, get_limiter_state
+from .scenarios import DEFAULT_SECTOR, DEFAULT_SECTOR_GROWTH, scenario_seed, sector_growth, sector_key, simulate_scenarios
+from .stream_json import IncrementalJSONObjectParser
+from .tasks import (
+    GAMMA_MAX_POLL_ATTEMPTS, GAMMA_POLL_INTERVAL_SECONDS, STAGE_PRESENT, analyse_valuation, dispatch_valuation_batch,
+    generate_gamma_presentation, poll_gamma_generation, present_valuation, process_valuation_request,
+    send_gamma_report_email, start_valuation_batch,
+)
+from .utils import QUALITATIVE_KEYS, validate_inputs_backend
+
+
+# --- parser incremental do streaming da IA ---
+
+class IncrementalJSONObjectParserTests(SimpleTestCase):
+
+    def feed_all(self, parser, chunks):
+        fields = []
+        for chunk in chunks:
+            fields += parser.feed(chunk)
+        return fields
+
+    def test_emits_each_field_once_complete_char_by_char(self):
+        text = '{"a": "x}\\"y", "b": {"c": [1, 2]}, "d": 3.5}'
+        fields = self.feed_all(IncrementalJSONObjectParser(), text)
+        self.assertEqual(fields, [("a", 'x}"y'), ("b", {"c": [1, 2]}), ("d", 3.5)])
+
+    def test_number_is_not_cut_at_chunk_boundary(self):
+        parser = IncrementalJSONObjectParser()
+        self.assertEqual(parser.feed('{"nota": 8'), [])
+        self.assertEqual(parser.feed('.5'), [])
+        self.assertEqual(parser.feed('}'), [("nota", 8.5)])
+
+    def test_ignores_text_before_object_and_after_end(self):
+        parser = IncrementalJSONObjectParser()
+        fields = self.feed_all(parser, ['```json\n', '{"texto": "ok"}', '\n```', ', "extra": 1}'])
+        self.assertEqual(fields, [("texto", "ok")])
+
+    def test_incomplete_value_waits_for_more_data(self):
+        parser = IncrementalJSONObjectParser()
+        self.assertEqual(parser.feed('{"texto": "meio'), [])
+        self.assertEqual(parser.feed(' do texto", '), [("texto", "meio do texto")])
+
+
+# --- rate limiter compartilhado (token bucket no Redis) ---
+
+LIMITS = {
+    'gemini': {'rate': 0.001, 'capacity': 3},
+    'gamma': {'rate': 0.001, 'capacity': 1},
+}
+
+
+@override_settings(RATE_LIMITS=LIMITS, GEMINI_API_KEY='chave-gemini', GAMMA_API_KEY='chave-gamma')
+class TokenBucketTests(FakeRedisMixin, SimpleTestCase):
+
+    def test_allows_up_to_capacity_then_throttles(self):
+        self.assertEqual([acquire('gemini')[0] for _ in range(3)], [True, True, True])
+        allowed, wait = acquire('gemini')
+        self.assertFalse(allowed)
+        self.assertGreater(wait, 0)
+
+    def test_buckets_are_per_provider(self):
+        self.assertTrue(acquire('gamma')[0])
+        self.assertFalse(acquire('gamma')[0])
+        self.assertTrue(acquire('gemini')[0])
+
+    def test_acquire_or_raise_carries_wait_time(self):
+        acquire_or_raise('gamma')
+        with self.assertRaises(RateLimitExceeded) as ctx:
+            acquire_or_raise('gamma')
+        self.assertGreater(ctx.exception.wait_seconds, 0)
+
+    def test_state_reports_metrics(self):
+        acquire('gamma')
+        acquire('gamma')
+        state = get_limiter_state('gamma')
+        self.assertEqual((state['acquired'], state['throttled']), (1, 1))
+        self.assertLess(state['available'], 1)
+
+    def test_api_key_is_not_stored_in_clear(self):
+        acquire('gemini')
+        self.assertFalse(any('chave-gemini' in key for key in self.redis.keys('*')))
+
+    def test_fails_open_when_redis_is_down(self):
+        with mock.patch('chatbot.rate_limit.get_redis', side_effect=ConnectionError("fora")):
+            self.assertEqual(acquire('gemini'), (True, 0.0))
+
+
+@override_settings(RATE_LIMIT_MAX_DEFERRALS=2, GAMMA_API_KEY='chave-gamma')
+class RateLimitDeferralTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+
+    def test_analyse_fails_report_when_deferrals_run_out(self):
+        report = make_report(self.user)
+        with mock.patch('chatbot.tasks.run_analysis_agent', side_effect=RateLimitExceeded('gemini', 5)) as agent:
+            analyse_valuation.apply(args=[report.id])
+
+        # Tentativa original + RATE_LIMIT_MAX_DEFERRALS adiamentos
+        self.assertEqual(agent.call_count, 3)
+        report.refresh_from_db()
+        self.assertEqual(report.status, ValuationReport.StatusChoices.FAILED)
+        self.assertEqual(report.result_data['failed_stage'], 'analyse')
+
+    def test_gamma_generation_is_deferred_with_counter(self):
+        report = make_report(self.user, prompt_gamma='prompt', gamma_status='pending')
+        with mock.patch('chatbot.tasks.acquire_or_raise', side_effect=RateLimitExceeded('gamma', 5)), \
+                mock.patch.object(generate_gamma_presentation, 'apply_async') as reschedule:
+            generate_gamma_presentation.apply(args=[report.id], kwargs={'deferrals': 1})
+
+        self.assertEqual(reschedule.call_args.kwargs['kwargs'], {'deferrals': 2})
+        report.refresh_from_db()
+        self.assertEqual(report.gamma_status, 'pending')
+
+    def test_gamma_generation_fails_when_deferrals_run_out(self):
+        report = make_report(self.user, prompt_gamma='prompt', gamma_status='pending')
+        with mock.patch('chatbot.tasks.acquire_or_raise', side_effect=RateLimitExceeded('gamma', 5)), \
+                mock.patch.object(generate_gamma_presentation, 'apply_async') as reschedule:
+            generate_gamma_presentation.apply(args=[report.id], kwargs={'deferrals': 2})
+
+        reschedule.assert_not_called()
+        report.refresh_from_db()
+        self.assertEqual(report.gamma_status, 'failed')
+
+
+# --- motor vetorizado da planilha ---
+
+def random_inputs(rng):
+    inputs = {
+        'setor_atuacao': 'Tecnologia',
+        'faturamento_mensal': rng.choice([0, rng.uniform(1, 500_000)]),
+        'gastos_variaveis': rng.uniform(0, 200_000),
+        'gastos_fixos': rng.uniform(0, 100_000),
+        'num_vendas': rng.choice([0, rng.randint(1, 500)]),
+        'num_prospeccoes': rng.choice([0, rng.randint(1, 5000)]),
+    }
+    inputs.update({crit_id: rng.choice(list(SCORE_MAP)) for crit_id in CRITERIA})
+    return inputs
+
+
+class EngineTests(SimpleTestCase):
+
+    def test_matches_the_spreadsheet_by_hand(self):
+        inputs = {
+            'faturamento_mensal': 10_000, 'gastos_variaveis': 4_000, 'gastos_fixos': 3_000,
+            'num_vendas': 20, 'num_prospeccoes': 100,
+            **{crit_id: 'ALTO' for crit_id in CRITERIA},
+        }
+        indicadores, valores_criterios, valuation_base = calculate_report(inputs)
+
+        self.assertEqual(indicadores['faturamento_anual'], 120_000)
+        self.assertAlmostEqual(indicadores['margem_contribuicao_perc'], 0.6)
+        self.assertEqual(indicadores['ticket_medio'], 500)
+        self.assertAlmostEqual(indicadores['ponto_equilibrio'], 5_000)
+        self.assertEqual(indicadores['taxa_conversao'], 20)
+        pmf = next(item for item in valores_criterios if item['criterio_id'] == 'pmf')
+        self.assertEqual((pmf['pontuacao'], pmf['peso'], pmf['valor_calculado']), (2, 2, 480_000))
+        # 120.000 x 2 x soma dos pesos (20) / 18 critérios
+        self.assertAlmostEqual(valuation_base, 120_000 * 2 * sum(WEIGHTS_MAP.values()) / len(WEIGHTS_MAP))
+
+    def test_batch_equals_one_report_at_a_time(self):
+        rng = random.Random(7)
+        inputs_list = [random_inputs(rng) for _ in range(50)]
+        for inputs, batch_row in zip(inputs_list, calculate_reports(inputs_list)):
+            self.assertEqual(calculate_report(inputs), batch_row)
+
+    def test_zero_sales_and_revenue_do_not_divide_by_zero(self):
+        indicadores, _, valuation_base = calculate_report({
+            'faturamento_mensal': 0, 'gastos_variaveis': 0, 'gastos_fixos': 1_000, 'num_vendas': 0, 'num_prospeccoes': 0,
+        })
+        self.assertEqual(indicadores['margem_contribuicao_perc'], 0)
+        self.assertEqual(indicadores['ponto_equilibrio'], 0)
+        self.assertEqual(indicadores['taxa_conversao'], 100)
+        self.assertEqual(valuation_base, 0)
+
+    def test_missing_or_unknown_answers_score_zero(self):
+        _, valores_criterios, _ = calculate_report({'faturamento_mensal': 1_000, 'pmf': 'TALVEZ'})
+        by_id = {item['criterio_id']: item for item in valores_criterios}
+        self.assertEqual(by_id['pmf']['pontuacao'], 0)
+        self.assertEqual(by_id['nivel_equipe']['resposta'], DEFAULT_ANSWER)
+        self.assertEqual(by_id['nivel_equipe']['valor_calculado'], 0)
+
+
+# --- tabelas de pontuação versionadas no banco ---
+
+@override_settings(SCORING_STAMP_CHECK_SECONDS=0)
+class ScoringTableTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        scoring.reset_scoring_cache()
+        scoring._by_version.clear()
+        self.addCleanup(scoring.reset_scoring_cache)
+        self.addCleanup(scoring._by_version.clear)
+
+    def test_clean_rejects_non_integer_and_out_of_range_values(self):
+        for score_map in ({'ALTO': 1.5}, {'ALTO': True}, {'ALTO': MAX_TABLE_VALUE + 1}, {}):
+            with self.subTest(score_map=score_map), self.assertRaises(ValidationError):
+                ScoringTable(score_map=score_map, weights_map=WEIGHTS_MAP).clean()
+        ScoringTable(score_map={**SCORE_MAP, 'ALTO': MAX_TABLE_VALUE, 'BAIXO': -MAX_TABLE_VALUE}, weights_map=WEIGHTS_MAP).clean()
+
+    def test_clean_rejects_unknown_or_missing_keys(self):
+        answers_missing = {k: v for k, v in SCORE_MAP.items() if k != 'ELEVADO'}
+        for score_map, weights_map, field in (
+            ({**SCORE_MAP, 'ALT0': 2}, WEIGHTS_MAP, 'score_map'),
+            (answers_missing, WEIGHTS_MAP, 'score_map'),
+            (SCORE_MAP, {**WEIGHTS_MAP, 'pmf_': 2}, 'weights_map'),
+        ):
+            with self.subTest(field=field), self.assertRaises(ValidationError) as ctx:
+                ScoringTable(score_map=score_map, weights_map=weights_map).clean()
+            self.assertIn(field, ctx.exception.message_dict)
+        # Uma versão pode deixar critérios de fora (peso zero), mas não inventar nomes
+        ScoringTable(score_map=SCORE_MAP, weights_map={'pmf': 2}).clean()
+
+    def test_large_scores_do_not_wrap(self):
+        tables = ScoringTables(version=99, score_map={**SCORE_MAP, 'ALTO': MAX_TABLE_VALUE}, weights_map=WEIGHTS_MAP)
+        _, valores_criterios, _ = calculate_report({'faturamento_mensal': 1, 'pmf': 'ALTO'}, tables)
+        pmf = next(item for item in valores_criterios if item['criterio_id'] == 'pmf')
+        self.assertEqual(pmf['pontuacao'], MAX_TABLE_VALUE)
+        self.assertEqual(pmf['valor_calculado'], 12 * MAX_TABLE_VALUE * WEIGHTS_MAP['pmf'])
+
+    def test_defaults_to_version_one_without_tables(self):
+        self.assertEqual(scoring.get_active_tables().version, 1)
+
+    def test_activation_is_picked_up_through_the_stamp(self):
+        self.assertEqual(scoring.get_active_tables().version, 1)
+        table = ScoringTable.objects.create(score_map={**SCORE_MAP, 'ALTO': 4}, weights_map=WEIGHTS_MAP)
+        with self.captureOnCommitCallbacks(execute=True):
+            table.activate()
+
+        active = scoring.get_active_tables()
+        self.assertEqual(active.version, table.version)
+        self.assertEqual(active.score_map['ALTO'], 4)
+        self.assertEqual(scoring.get_tables(1).version, 1)
+
+
+# --- simulação "e se" ---
+
+class WhatIfTests(SimpleTestCase):
+
+    def setUp(self):
+        self.inputs = random_inputs(random.Random(3))
+        self.inputs['faturamento_mensal'] = 50_000
+        self.result = what_if(self.inputs)
+
+    def test_base_row_is_the_report_as_is(self):
+        indicadores, _, valuation_base = calculate_report(self.inputs)
+        self.assertAlmostEqual(self.result['valuation_base'], valuation_base)
+        self.assertEqual(self.result['indicadores'], indicadores)
+
+    def test_each_answer_row_changes_only_that_criterion(self):
+        for crit_id in ('pmf', 'possibilidade_copia'):
+            for answer in SCORE_MAP:
+                _, _, expected = calculate_report({**self.inputs, crit_id: answer})
+                row = self.result['criterios'][crit_id]['respostas'][answer]
+                self.assertAlmostEqual(row['valuation_base'], expected)
+                self.assertAlmostEqual(row['delta'], expected - self.result['valuation_base'])
+            current = self.result['criterios'][crit_id]['atual']
+            self.assertAlmostEqual(self.result['criterios'][crit_id]['respostas'][current]['delta'], 0)
+
+    def test_each_financial_row_scales_only_that_input(self):
+        for i, name in enumerate(FINANCIAL_FIELDS):
+            rows = self.result['financeiro'][name]
+            self.assertEqual([row['multiplicador'] for row in rows], list(FINANCIAL_MULTIPLIERS))
+            for row in rows:
+                indicadores, _, expected = calculate_report({**self.inputs, name: self.inputs[name] * row['multiplicador']})
+                self.assertAlmostEqual(row['valuation_base'], expected)
+                self.assertEqual(row['indicadores'], indicadores)
+
+
+# --- cenários por Monte Carlo ---
+
+class ScenarioTests(SimpleTestCase):
+    indicadores = {'faturamento_anual': 600_000.0, 'margem_contribuicao_perc': 0.4}
+
+    def test_same_inputs_give_same_scenarios(self):
+        first = simulate_scenarios(self.indicadores, 1_000_000.0, 'Software SaaS')
+        second = simulate_scenarios(dict(self.indicadores), 1_000_000.0, 'software saas ')
+        self.assertEqual(first, second)
+
+    def test_seed_depends_on_inputs(self):
+        seed = scenario_seed(self.indicadores, 1_000_000.0, 'Software')
+        self.assertNotEqual(seed, scenario_seed(self.indicadores, 1_000_001.0, 'Software'))
+        self.assertNotEqual(seed, scenario_seed(self.indicadores, 1_000_000.0, 'Varejo'))
+
+    def test_bands_are_ordered_around_the_base(self):
+        cenarios = simulate_scenarios(self.indicadores, 1_000_000.0, 'Tecnologia')
+        self.assertEqual(cenarios['realista'], 1_000_000.0)
+        self.assertEqual(cenarios['pessimista'], cenarios['p10'])
+        self.assertEqual(cenarios['otimista'], cenarios['p90'])
+        self.assertLess(cenarios['p10'], cenarios['p50'])
+        self.assertLess(cenarios['p50'], cenarios['p90'])
+        # Crescimento médio do setor de 12% a.a.: a mediana fica acima do valuation atual
+        self.assertGreater(cenarios['p50'], 1_000_000.0)
+        margem = cenarios['margem_contribuicao_perc']
+        self.assertTrue(-1 <= margem['p10'] <= margem['p90'] <= 1)
+
+    def test_sector_matching_ignores_accents_and_case(self):
+        self.assertEqual(sector_key('Clínica Médica'), 'saude')
+        self.assertEqual(sector_key('SaaS B2B'), 'tecnologia')
+        self.assertEqual(sector_key('Outra coisa qualquer'), DEFAULT_SECTOR)
+        self.assertEqual(sector_growth('Outra coisa qualquer'), DEFAULT_SECTOR_GROWTH)
+
+    def test_sector_keywords_match_whole_words(self):
+        cases = {
+            'Barbearia': 'moda_beleza',
+            'Bar e restaurante': 'alimentacao',
+            'Bares e lanchonetes': 'alimentacao',
+            'Empresa de TI': 'tecnologia',
+            'App de entregas': 'tecnologia',
+            'Aplicativos móveis': 'tecnologia',
+            'Serviços financeiros': 'financeiro',
+            'Happy hour e festas': DEFAULT_SECTOR,
+            'Titânio e ligas especiais': DEFAULT_SECTOR,
+            'Embarcações de pesca': DEFAULT_SECTOR,
+        }
+        for setor, expected in cases.items():
+            with self.subTest(setor=setor):
+                self.assertEqual(sector_key(setor), expected)
+
+
+# --- cota reservada atomicamente no Redis ---
+
+class QuotaTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user(usage_count=1)
+
+    def reserved(self):
+        return self.redis.zrange(f'quota:{self.user.pk}:reserved', 0, -1)
+
+    def test_reservations_count_against_the_limit(self):
+        tokens = [reserve(self.user, 3), reserve(self.user, 3)]
+        self.assertEqual(sorted(self.reserved()), sorted(tokens))
+        with self.assertRaises(QuotaExceeded) as ctx:
+            reserve(self.user, 3)
+        self.assertEqual((ctx.exception.used, ctx.exception.pending), (1, 2))
+
+    def test_released_reservation_frees_the_slot(self):
+        token = reserve(self.user, 2)
+        with self.assertRaises(QuotaExceeded):
+            reserve(self.user, 2)
+        release_reservation(self.user.pk, token)
+        self.assertIsNotNone(reserve(self.user, 2))
+
+    def test_bind_and_commit_turn_the_reservation_into_a_use(self):
+        token = reserve(self.user, 5)
+        bind_reservation(self.user.pk, token, 42)
+        self.assertEqual(self.reserved(), ['42'])
+        commit_reservation(self.user.pk, 42)
+        self.assertEqual(self.reserved(), [])
+        self.assertEqual(self.redis.get(f'quota:{self.user.pk}:used'), '2')
+
+    def test_commit_without_mirror_does_not_invent_usage(self):
+        token = reserve(self.user, 5)
+        self.redis.delete(f'quota:{self.user.pk}:used')
+        commit_reservation(self.user.pk, token)
+        self.assertIsNone(self.redis.get(f'quota:{self.user.pk}:used'))
+
+    def test_expired_reservations_are_dropped(self):
+        with self.settings(QUOTA_RESERVATION_TTL_SECONDS=-1):
+            reserve(self.user, 2)
+        self.assertIsNotNone(reserve(self.user, 2))
+
+    def test_redis_down_returns_none(self):
+        with mock.patch('chatbot.quota.get_redis', side_effect=ConnectionError('fora')):
+            self.assertIsNone(reserve(self.user, 3))
+            release_reservation(self.user.pk, 'x')
+
+    def test_reconcile_resets_mirror_and_drops_finished_reservations(self):
+        done = make_report(self.user, status=ValuationReport.StatusChoices.SUCCESS)
+        running = make_report(self.user)
+        for report in (done, running):
+            bind_reservation(self.user.pk, reserve(self.user, 5), report.id)
+        self.redis.set(f'quota:{self.user.pk}:used', 4)
+
+        summary = reconcile_quotas()
+        self.assertEqual((summary['reset'], summary['stale_reservations']), (1, 1))
+        self.assertEqual(self.reserved(), [str(running.id)])
+        self.assertIsNone(self.redis.get(f'quota:{self.user.pk}:used'))
+
+
+# --- envios repetidos e chave de idempotência ---
+
+def valid_inputs(**overrides):
+    inputs = {
+        'faturamento_mensal': 50_000, 'gastos_variaveis': 10_000, 'gastos_fixos': 5_000,
+        'num_vendas': 20, 'num_prospeccoes': 200, 'setor_atuacao': 'Tecnologia',
+    }
+    inputs.update({key: 'MÉDIO' for key in QUALITATIVE_KEYS})
+    inputs.update(overrides)
+    return inputs
+
+
+class ClaimSubmissionTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+
+    def test_first_claim_then_duplicate_of_the_recorded_report(self):
+        self.assertEqual(claim_submission(self.user.pk, 'h'), (CLAIMED, None))
+        report = make_report(self.user)
+        record_submission(self.user.pk, 'h', report.id)
+        self.assertEqual(claim_submission(self.user.pk, 'h'), (DUPLICATE, report))
+
+    @override_settings(DUPLICATE_SUBMISSION_WINDOW_SECONDS=600)
+    def test_pending_claim_is_short_lived_until_recorded(self):
+        claim_submission(self.user.pk, 'h')
+        self.assertLessEqual(self.redis.ttl(f'dedup:{self.user.pk}:h'), PENDING_TTL_SECONDS)
+        record_submission(self.user.pk, 'h', make_report(self.user).id)
+        self.assertGreater(self.redis.ttl(f'dedup:{self.user.pk}:h'), PENDING_TTL_SECONDS)
+
+    def test_pending_claim_is_in_progress_without_waiting(self):
+        claim_submission(self.user.pk, 'h')
+        with mock.patch('time.sleep') as sleep:
+            self.assertEqual(claim_submission(self.user.pk, 'h'), (IN_PROGRESS, None))
+        sleep.assert_not_called()
+
+    def test_pending_claim_finds_report_already_in_the_database(self):
+        report = make_report(self.user)
+        self.redis.set(f'dedup:{self.user.pk}:{report.inputs_hash}', PENDING)
+        self.assertEqual(claim_submission(self.user.pk, report.inputs_hash), (DUPLICATE, report))
+
+    def test_failed_report_can_be_resubmitted(self):
+        report = make_report(self.user, status=ValuationReport.StatusChoices.FAILED)
+        record_submission(self.user.pk, 'h', report.id)
+        self.assertEqual(claim_submission(self.user.pk, 'h'), (CLAIMED, None))
+
+    def test_falls_back_to_the_database_when_redis_is_down(self):
+        report = make_report(self.user)
+        with mock.patch('chatbot.dedup.get_redis', side_effect=ConnectionError('fora')):
+            self.assertEqual(claim_submission(self.user.pk, report.inputs_hash), (DUPLICATE, report))
+            self.assertEqual(claim_submission(self.user.pk, 'outro'), (CLAIMED, None))
+
+
+class CalculateDedupViewTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.client.force_login(self.user)
+        patcher = mock.patch('chatbot.views.build_valuation_pipeline')
+        self.pipeline = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, inputs, **headers):
+        return self.client.post(
+            reverse('chatbot:api_calculate'), {'inputs': inputs}, content_type='application/json', headers=headers
+        )
+
+    def test_identical_inputs_return_the_existing_report(self):
+        first = self.post(valid_inputs())
+        second = self.post(valid_inputs())
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.json()['report_id'], first.json()['report_id'])
+        self.assertTrue(second.json()['duplicate'])
+        self.assertEqual(ValuationReport.objects.count(), 1)
+        self.pipeline.assert_called_once()
+        self.assertNotEqual(self.post(valid_inputs(num_vendas=21)).json()['report_id'], first.json()['report_id'])
+
+    def test_idempotency_key_returns_the_same_report(self):
+        first = self.post(valid_inputs(), **{'Idempotency-Key': 'abc'})
+        second = self.post(valid_inputs(num_vendas=21), **{'Idempotency-Key': 'abc'})
+        self.assertEqual(second.json()['report_id'], first.json()['report_id'])
+        self.assertEqual(ValuationReport.objects.count(), 1)
+
+    def test_submission_still_being_created_gets_409_with_retry_after(self):
+        inputs_hash = inputs_fingerprint(validate_inputs_backend({'inputs': valid_inputs()})[0])
+        self.redis.set(f'dedup:{self.user.pk}:{inputs_hash}', PENDING)
+        response = self.post(valid_inputs())
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(response.json()['retry_after'], 1)
+        self.assertFalse(ValuationReport.objects.exists())
+
+
+# --- envio em lote (CSV/JSON) ---
+
+def batch_csv(rows, delimiter=','):
+    columns = list(valid_inputs())
+    lines = [delimiter.join(columns)]
+    lines += [delimiter.join(str(row[column]) for column in columns) for row in rows]
+    return '\n'.join(lines).encode()
+
+
+class BatchParseTests(SimpleTestCase):
+
+    def test_csv_with_comma_or_semicolon(self):
+        for delimiter in (',', ';'):
+            rows = parse_batch_file(batch_csv([valid_inputs(), valid_inputs(num_vendas=7)], delimiter), 'lote.csv')
+            self.assertEqual(len(rows), 2)
+            self.assertEqual(rows[1]['num_vendas'], '7')
+
+    def test_csv_missing_columns(self):
+        with self.assertRaisesMessage(BatchError, 'Colunas ausentes no CSV: num_vendas'):
+            parse_batch_file(batch_csv([valid_inputs()]).replace(b'num_vendas', b'vendas'))
+
+    def test_json_list_or_rows_object(self):
+        inputs = valid_inputs()
+        for payload in ([inputs], {'rows': [{'inputs': inputs}]}):
+            self.assertEqual(parse_batch_file(json.dumps(payload).encode()), [inputs])
+        with self.assertRaises(BatchError):
+            parse_batch_file(b'{"empresas": []}', 'lote.json')
+
+    @override_settings(VALUATION_BATCH_MAX_ROWS=2, VALUATION_BATCH_MAX_BYTES=10_000)
+    def test_size_and_row_limits(self):
+        with self.assertRaisesMessage(BatchError, 'Máximo de 2 empresas'):
+            parse_batch_file(json.dumps([{}] * 3).encode())
+        with self.assertRaisesMessage(BatchError, 'Arquivo maior'):
+            parse_batch_file(b'[' + b' ' * 10_000 + b']')
+        with self.assertRaisesMessage(BatchError, 'nenhuma empresa'):
+            parse_batch_file(b'[]')
+
+    def test_validate_rows_reports_every_error_by_row(self):
+        rows = [valid_inputs(), valid_inputs(num_vendas=0, pmf='TALVEZ'), 'texto']
+        validated, errors = validate_rows(rows)
+        self.assertEqual(len(validated), 1)
+        self.assertEqual([error['row'] for error in errors], [2, 3])
+        self.assertEqual(len(errors[0]['errors']), 2)
+
+
+class BatchViewTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user(is_staff=True)
+        self.client.force_login(self.user)
+
+    def post(self, content):
+        return self.client.post(reverse('chatbot:api_batch'), content, content_type='text/csv')
+
+    def test_staff_only(self):
+        self.client.force_login(make_user('22333444000181'))
+        self.assertEqual(self.post(batch_csv([valid_inputs()])).status_code, 403)
+
+    def test_scripted_upload_without_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        upload = SimpleUploadedFile('lote.csv', batch_csv([valid_inputs()]), content_type='text/csv')
+        with mock.patch.object(start_valuation_batch, 'delay'):
+            response = client.post(reverse('chatbot:api_batch'), {'file': upload})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['total'], 1)
+
+    def test_any_invalid_row_rejects_the_whole_batch(self):
+        response = self.post(batch_csv([valid_inputs(), valid_inputs(faturamento_mensal=-1)]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['row'], 2)
+        self.assertFalse(ValuationReport.objects.exists())
+        self.assertEqual(self.post(b'{"x": 1}').status_code, 400)
+
+    def test_creates_pending_reports_and_starts_after_commit(self):
+        with mock.patch.object(start_valuation_batch, 'delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.post(batch_csv([valid_inputs(), valid_inputs(num_vendas=7)]))
+        self.assertEqual(response.status_code, 202)
+        body = response.json()
+        self.assertEqual((body['total'], body['pending'], body['finished']), (2, 2, False))
+        delay.assert_called_once_with(body['batch_id'])
+        reports = ValuationReport.objects.filter(batch_id=body['batch_id'])
+        self.assertEqual(reports.count(), 2)
+        self.assertTrue(all(report.inputs_hash for report in reports))
+
+
+class BatchTasksTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        scoring.reset_scoring_cache()
+        self.addCleanup(scoring.reset_scoring_cache)
+        user = make_user(is_staff=True)
+        with mock.patch.object(start_valuation_batch, 'delay'):
+            self.batch = create_batch(
+                ValuationBatch(user=user), [validate_inputs_backend({'inputs': valid_inputs(num_vendas=n)})[0] for n in range(1, 6)]
+            )
+
+    def test_start_calculates_every_report_and_dispatches(self):
+        with mock.patch.object(dispatch_valuation_batch, 'delay') as dispatch:
+            start_valuation_batch.apply(args=[self.batch.id])
+        dispatch.assert_called_once_with(self.batch.id)
+        for report in self.batch.reports.all():
+            _, _, expected = calculate_report(report.inputs_data)
+            self.assertAlmostEqual(report.valuation_base, expected)
+
+    def test_start_dispatches_even_if_the_bulk_calculation_fails(self):
+        with mock.patch('chatbot.tasks.calculate_reports', side_effect=ValueError('quebrou')), \
+                mock.patch.object(dispatch_valuation_batch, 'delay') as dispatch:
+            start_valuation_batch.apply(args=[self.batch.id])
+        dispatch.assert_called_once_with(self.batch.id)
+        self.assertFalse(self.batch.reports.filter(calculated_at__isnull=False).exists())
+
+    @override_settings(VALUATION_BATCH_MAX_IN_FLIGHT=2)
+    def test_dispatch_respects_the_in_flight_limit(self):
+        with mock.patch('chatbot.tasks.group') as group, \
+                mock.patch.object(dispatch_valuation_batch, 'apply_async') as reschedule:
+            dispatch_valuation_batch.apply(args=[self.batch.id])
+            dispatch_valuation_batch.apply(args=[self.batch.id])
+
+        group.assert_called_once()
+        self.assertEqual(self.batch.reports.filter(status=ValuationReport.StatusChoices.PROCESSING).count(), 2)
+        self.assertEqual(reschedule.call_count, 2)
+        report_id = self.batch.reports.filter(status=ValuationReport.StatusChoices.PROCESSING).first().id
+        _, payload, _ = get_status_record(report_id)
+        self.assertEqual(payload['status'], ValuationReport.StatusChoices.PROCESSING)
+
+
+# --- etapa 'present': disparo da geração Gamma ---
+
+class PresentValuationTests(FakeRedisMixin, TestCase):
+
+    def test_gamma_task_writes_are_not_overwritten(self):
+        report = make_report(make_user(), prompt_gamma='Slides', gamma_status='pending')
+
+        def gamma_task_runs_first(report_id):
+            other = ValuationReport.objects.get(id=report_id)
+            other.result_data['gamma_generation_id'] = 'gen-1'
+            other.save(update_fields=['result_data'])
+
+        with mock.patch.object(generate_gamma_presentation, 'delay', side_effect=gamma_task_runs_first) as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                present_valuation.apply(args=[report.id])
+                delay.assert_not_called()
+
+        delay.assert_called_once_with(report.id)
+        report.refresh_from_db()
+        self.assertEqual(report.result_data['gamma_generation_id'], 'gen-1')
+        self.assertIn(STAGE_PRESENT, report.result_data['stages'])
+
+    def test_already_presented_report_is_skipped(self):
+        report = make_report(make_user(), prompt_gamma='Slides', gamma_status='pending', stages={STAGE_PRESENT: 'x'})
+        with mock.patch.object(generate_gamma_presentation, 'delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                present_valuation.apply(args=[report.id])
+        delay.assert_not_called()
+
+
+# --- cliente Gemini ---
+
+class GeminiClientTests(SimpleTestCase):
+
+    def test_output_budget_leaves_room_for_thinking_tokens(self):
+        reset_gemini_client()
+        self.addCleanup(reset_gemini_client)
+        with mock.patch('google.generativeai.configure'), \
+                mock.patch('google.generativeai.GenerativeModel') as model_class:
+            model, _ = get_gemini_model()
+            self.assertIs(get_gemini_model()[0], model)
+
+        model_class.assert_called_once()
+        config = model_class.call_args.kwargs['generation_config']
+        self.assertEqual(config.max_output_tokens, GEMINI_MAX_OUTPUT_TOKENS)
+        self.assertGreaterEqual(config.max_output_tokens, 8192)
+
+
+# --- prompt do Gamma montado localmente ---
+
+class GammaPromptTests(SimpleTestCase):
+
+    def test_numbers_match_the_spreadsheet(self):
+        prompt = build_gamma_prompt(
+            'Empresa X', 'Tecnologia',
+            {'faturamento_anual': 600_000.0, 'margem_contribuicao_perc': 0.6, 'ticket_medio': 2500.0},
+            {'pessimista': 1.0, 'realista': 2.0, 'otimista': 3.0},
+            [{'criterio': 'Equipe', 'valor': 'R$ 10,00'}], [], 'Anjo',
+        )
+        self.assertIn('Margem: 60.0%', prompt)
+        self.assertIn('Empresa X', prompt)
+
+
+# --- poller único das gerações Gamma ---
+
+class GammaPollerTests(FakeRedisMixin, TestCase):
+
+    def test_load_test_mode_skips_the_rate_limiter(self):
+        completed = []
+        poller = GammaPoller(
+            'https://gamma.test', 'key', poll_interval=0, load_from_db=False,
+            on_completed=lambda report_id, url: completed.append((report_id, url)),
+        )
+        for i in range(3):
+            poller.track(i, f'gen-{i}', delay=0)
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, json={
+            'status': 'completed', 'gammaUrl': f'https://gamma.test/{request.url.path.rsplit("/", 1)[-1]}',
+        }))
+
+        async def run():
+            async with httpx.AsyncClient(base_url=poller.base_url, transport=transport) as client:
+                return await poller.tick(client)
+
+        with mock.patch('chatbot.gamma_poller.acquire') as acquire_token:
+            self.assertEqual(asyncio.run(run()), 3)
+        acquire_token.assert_not_called()
+        self.assertEqual(sorted(completed), [(i, f'https://gamma.test/gen-{i}') for i in range(3)])
+
+    def test_save_poll_attempts_only_touches_the_current_generation(self):
+        report = make_report(make_user(), gamma_generation_id='gen-1', gamma_status='pending')
+        GammaPoller._save_poll_attempts(report.id, 'gen-1', 4)
+        GammaPoller._save_poll_attempts(report.id, 'gen-velha', 9)
+        report.refresh_from_db()
+        self.assertEqual(report.result_data['gamma_poll_attempts'], 4)
+        self.assertEqual(report.result_data['valuation_base'], 5000.0)
+
+
+# --- recálculo em massa (revalue_reports) ---
+
+class RevalueReportsTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        scoring.reset_scoring_cache()
+        self.addCleanup(scoring.reset_scoring_cache)
+        user = make_user()
+        self.reports = []
+        for n in range(1, 5):
+            inputs = validate_inputs_backend({'inputs': valid_inputs(num_vendas=n)})[0]
+            report = ValuationReport.objects.create(
+                user=user,
+                status=ValuationReport.StatusChoices.SUCCESS,
+                inputs_data=inputs,
+                result_data={'valuation_base': 1.0, 'valores_criterios': [], 'stages': {'calculate': '2025-01-01T00:00:00+00:00'}},
+            )
+            self.reports.append(report)
+        self.expected = calculate_report(self.reports[0].inputs_data)[2]
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.checkpoint = os.path.join(tmp.name, 'revalue')
+
+    def revalue(self, *args):
+        out = io.StringIO()
+        call_command('revalue_reports', '--checkpoint', self.checkpoint, *args, stdout=out)
+        return out.getvalue()
+
+    def bases(self):
+        return [ValuationReport.objects.get(id=report.id).valuation_base for report in self.reports]
+
+    def test_dry_run_writes_and_locks_nothing(self):
+        with mock.patch.object(QuerySet, 'select_for_update', side_effect=AssertionError('travou no dry-run')):
+            output = self.revalue('--dry-run')
+        self.assertIn('4 com diferença (DRY-RUN', output)
+        self.assertEqual(self.bases(), [1.0] * 4)
+        self.assertFalse(ValuationReport.objects.filter(scoring_version__isnull=False).exists())
+
+    def test_rewrites_changed_reports_in_chunks(self):
+        output = self.revalue('--chunk-size', '3')
+        self.assertIn('4 relatórios analisados com as tabelas v1', output)
+        self.assertAlmostEqual(self.bases()[0], self.expected)
+        self.assertEqual(ValuationReport.objects.filter(scoring_version=1).count(), 4)
+        self.assertFalse(os.path.exists(f'{self.checkpoint}.0'))
+        # Incremental: tudo já está na v1
+        self.assertIn('Nenhum relatório', self.revalue())
+
+    def write_checkpoint(self, signature_options):
+        signature = checkpoint_signature(signature_options)
+        summary = {'scanned': 2, 'changed': 2, 'delta_total': 0.0, 'top': []}
+        with open(f'{self.checkpoint}.0', 'w') as f:
+            json.dump({'signature': signature, 'last_id': self.reports[1].id, 'summary': summary}, f)
+
+    def test_resumes_after_the_checkpointed_id(self):
+        self.write_checkpoint({'all_versions': False, 'scoring_version': 1, 'workers': 1})
+        output = self.revalue('--chunk-size', '1')
+        self.assertIn('4 relatórios analisados', output)
+        self.assertEqual(self.bases()[:2], [1.0, 1.0])
+        self.assertTrue(all(base != 1.0 for base in self.bases()[2:]))
+
+    def test_checkpoint_from_another_selection_or_restart_is_ignored(self):
+        self.write_checkpoint({'all_versions': False, 'scoring_version': 1, 'workers': 1, 'status': 'FAILED'})
+        self.revalue()
+        self.assertTrue(all(base != 1.0 for base in self.bases()))
+
+        ValuationReport.objects.update(scoring_version=None)
+        self.write_checkpoint({'all_versions': False, 'scoring_version': 1, 'workers': 1})
+        self.revalue('--restart')
+        self.assertEqual(ValuationReport.objects.filter(scoring_version=1).count(), 4)
+
+
+# --- geração Gamma com polling não-bloqueante ---
+
+def gamma_response(**body):
+    response = mock.Mock(status_code=200)
+    response.json.return_value = body
+    return response
+
+
+@override_settings(GAMMA_API_KEY='chave', GAMMA_POLL_MODE='task')
+class GammaPollingTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.report = make_report(make_user(), prompt_gamma='Slides', gamma_status='pending', gamma_generation_id='gen-1')
+
+    def test_running_generation_reschedules_itself(self):
+        with mock.patch('chatbot.tasks.requests.get', return_value=gamma_response(status='pending')), \
+                mock.patch.object(poll_gamma_generation, 'apply_async') as reschedule:
+            poll_gamma_generation.apply(args=[self.report.id])
+
+        reschedule.assert_called_once_with(args=[self.report.id], countdown=GAMMA_POLL_INTERVAL_SECONDS)
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.result_data['gamma_poll_attempts'], 1)
+
+    def test_completed_generation_saves_the_url_and_sends_the_email(self):
+        response = gamma_response(status='completed', gammaUrl='https://gamma.app/docs/x')
+        with mock.patch('chatbot.tasks.requests.get', return_value=response), \
+                mock.patch.object(send_gamma_report_email, 'delay') as send_email:
+            poll_gamma_generation.apply(args=[self.report.id])
+
+        send_email.assert_called_once_with(self.report.id)
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.gamma_presentation_url, 'https://gamma.app/docs/x')
+        self.assertEqual(self.report.gamma_status, 'completed')
+
+    def test_restart_resumes_polling_without_resending_the_prompt(self):
+        with mock.patch('chatbot.tasks.requests.post') as post, \
+                mock.patch.object(poll_gamma_generation, 'delay') as poll:
+            generate_gamma_presentation.apply(args=[self.report.id])
+        post.assert_not_called()
+        poll.assert_called_once_with(self.report.id)
+
+    def test_new_generation_stores_the_id_before_polling(self):
+        self.report.result_data.pop('gamma_generation_id')
+        self.report.save(update_fields=['result_data'])
+        with mock.patch('chatbot.tasks.requests.post', return_value=gamma_response(generationId='gen-2')), \
+                mock.patch.object(poll_gamma_generation, 'apply_async') as poll:
+            generate_gamma_presentation.apply(args=[self.report.id])
+
+        poll.assert_called_once_with(args=[self.report.id], countdown=GAMMA_POLL_INTERVAL_SECONDS)
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.result_data['gamma_generation_id'], 'gen-2')
+        self.assertEqual(self.report.result_data['gamma_generation_attempts'], 1)
+
+    def test_poll_timeout_starts_a_new_generation(self):
+        self.report.result_data['gamma_poll_attempts'] = GAMMA_MAX_POLL_ATTEMPTS
+        self.report.save(update_fields=['result_data'])
+        with mock.patch('chatbot.tasks.requests.get') as get, \
+                mock.patch.object(generate_gamma_presentation, 'apply_async') as regenerate:
+            poll_gamma_generation.apply(args=[self.report.id])
+
+        get.assert_not_called()
+        regenerate.assert_called_once()
+        self.report.refresh_from_db()
+        self.assertNotIn('gamma_generation_id', self.report.result_data)
+        self.assertEqual(self.report.gamma_status, 'pending')
+
+
+# --- cálculo inline na view (resposta rápida) ---
+
+class CalculateFastPathTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        scoring.reset_scoring_cache()
+        self.addCleanup(scoring.reset_scoring_cache)
+        self.client.force_login(make_user())
+        patcher = mock.patch('chatbot.views.build_valuation_pipeline')
+        self.pipeline = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self):
+        return self.client.post(reverse('chatbot:api_calculate'), {'inputs': valid_inputs()}, content_type='application/json')
+
+    def test_response_carries_the_spreadsheet_result(self):
+        response = self.post()
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        indicadores, _, valuation_base = calculate_report(validate_inputs_backend({'inputs': valid_inputs()})[0])
+        self.assertAlmostEqual(body['valuation_base'], valuation_base)
+        self.assertEqual(body['indicadores'], json.loads(json.dumps(indicadores)))
+        self.assertIn('pontos_fortes', body)
+        self.pipeline.assert_called_once_with(body['report_id'], bypass_cache=False, include_calculate=False)
+
+        report = ValuationReport.objects.get(id=body['report_id'])
+        self.assertEqual(report.status, ValuationReport.StatusChoices.PROCESSING)
+        self.assertIsNotNone(report.calculated_at)
+
+    def test_inline_failure_falls_back_to_the_full_pipeline(self):
+        with mock.patch('chatbot.views.run_calculate_stage', side_effect=ValueError('quebrou')), \
+                mock.patch.object(process_valuation_request, 'delay') as full_pipeline:
+            response = self.post()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('valuation_base', response.json())
+        full_pipeline.assert_called_once_with(report_id=response.json()['report_id'], bypass_cache=False)
+        self.pipeline.assert_not_called()
+
+
+# --- métricas para a equipe ---
+
+class MetricsApiTests(FakeRedisMixin, TestCase):
+
+    def get(self, user):
+        self.client.force_login(user)
+        return self.client.get(reverse('chatbot:api_metrics'))
+
+    def test_staff_only(self):
+        self.assertEqual(self.get(make_user()).status_code, 403)
+
+    def test_reports_analysis_cache_hits_and_misses(self):
+        get_cached_analysis('gemini_analysis:teste')
+        set_cached_analysis('gemini_analysis:teste', {'ok': True})
+        get_cached_analysis('gemini_analysis:teste')
+
+        cache = self.get(make_user(is_staff=True)).json()['analysis_cache']
+        self.assertEqual((cache['hits'], cache['misses'], cache['hit_rate']), (1, 1, 0.5))
+
+    def test_reports_rate_limiter_state_per_provider(self):
+        acquire('gemini')
+        limits = self.get(make_user(is_staff=True)).json()['rate_limits']
+        self.assertEqual(set(limits), {'gemini', 'gamma'})
+        self.assertEqual(limits['gemini']['acquired'], 1)
+        self.assertEqual(limits['gamma']['acquired'], 0)
+        self.assertLess(limits['gemini']['available'], limits['gemini']['capacity'])
@@ -10,4 +10,8 @@ urlpatterns = [
     
     # Endpoint da API para calcular
     path('api/calculate/', views.calculate_valuation_view, name='api_calculate'),
+    # Envio em lote (CSV/JSON com várias empresas), só para a equipe
+    path('api/batch/', views.batch_valuation_view, name='api_batch'),
+    # Métricas operacionais (cache da IA, rate limiter), só para a equipe
+    path('api/metrics/', views.metrics_api_view, name='api_metrics'),
 ]
\ No newline at end of file
@@ -34,26 +34,22 @@ VALID_QUALITATIVE_ANSWERS = {
     "ELEVADO"
 }
 
-def validate_inputs_backend(data: dict) -> tuple[dict | None, str | None]:
+def collect_input_errors(inputs_raw: dict) -> tuple[dict, list[str]]:
     """
-    Valida os dados de input (6 financeiros + 18 qualitativos)
-    recebidos pela API no backend.
+    Valida todos os campos de um dict de inputs (6 financeiros + 18 qualitativos)
+    sem parar no primeiro problema. Retorna (dados validados, lista de erros);
+    usado pelo envio em lote, que mostra todos os erros de cada linha de uma vez.
     """
-    if not isinstance(data, dict):
-        return None, "Formato de dados inválido."
-
-    inputs_raw = data.get('inputs')
-    if not isinstance(inputs_raw, dict):
-        return None, "Estrutura de 'inputs' ausente ou inválida."
-
     validated_data = {}
-    
+    errors = []
+
     # --- 1. Validar Chaves Financeiras ---
     for key, val_type in FINANCIAL_KEYS.items():
         value = inputs_raw.get(key)
         
         if value is None:
-            return None, f"Dado obrigatório ausente: {key}"
+            errors.append(f"Dado obrigatório ausente: {key}")
+            continue
         
         try:
             if val_type == 'float_positive':
@@ -77,27 +73,48 @@ def validate_inputs_backend(data: dict) -> tuple[dict | None, str | None]:
             
         except (ValueError, TypeError):
             logger.warning(f"Erro de validação backend para '{key}': recebido '{value}', esperado '{val_type}'")
-            return None, f"Valor inválido para o campo '{key}'. Esperado: {val_type}."
+            errors.append(f"Valor inválido para o campo '{key}'. Esperado: {val_type}.")
 
     # --- 2. Validar Chaves Qualitativas ---
     for key in QUALITATIVE_KEYS:
         value = inputs_raw.get(key)
         
         if not isinstance(value, str):
-            return None, f"Valor inválido para o campo '{key}'. Esperado: texto."
+            errors.append(f"Valor inválido para o campo '{key}'. Esperado: texto.")
+            continue
         
         value_upper = value.upper().strip()
         
         if value_upper not in VALID_QUALITATIVE_ANSWERS:
             logger.warning(f"Erro de validação backend para '{key}': recebido '{value_upper}'")
-            return None, f"Resposta inválida para o campo '{key}': {value}"
+            errors.append(f"Resposta inválida para o campo '{key}': {value}")
+            continue
         
         validated_data[key] = value_upper 
 
+    return validated_data, errors
+
+
+def validate_inputs_backend(data: dict) -> tuple[dict | None, str | None]:
+    """
+    Valida os dados de input (6 financeiros + 18 qualitativos)
+    recebidos pela API no backend. Retorna o primeiro erro encontrado.
+    """
+    if not isinstance(data, dict):
+        return None, "Formato de dados inválido."
+
+    inputs_raw = data.get('inputs')
+    if not isinstance(inputs_raw, dict):
+        return None, "Estrutura de 'inputs' ausente ou inválida."
+
+    validated_data, errors = collect_input_errors(inputs_raw)
+    if errors:
+        return None, errors[0]
+
     # --- 3. Verificar contagem ---
     total_keys = len(FINANCIAL_KEYS) + len(QUALITATIVE_KEYS)
     if len(validated_data) != total_keys:
          return None, f"Número incorreto de campos de input recebidos. Esperado: {total_keys}, Recebido: {len(validated_data)}"
 
     logger.info("Validação de backend concluída com sucesso.")
-    return validated_data, None
\ No newline at end of file
+    return validated_data, None
@@ -1,14 +1,24 @@
 # chatbot/views.py
+from django.conf import settings
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse, HttpRequest
 from django.views.decorators.csrf import csrf_exempt
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.urls import reverse
 import json
 import logging
 
-from reports.models import ValuationReport
-from .tasks import process_valuation_request
+from reports.models import ValuationBatch, ValuationReport, inputs_fingerprint
+from reports.pagination import recent_reports
+from .analysis_cache import get_cache_stats
+from .batch import BatchError, batch_progress, create_batch, parse_batch_file, validate_rows
+from .dedup import (
+    CLAIMED, DUPLICATE, IN_PROGRESS_RETRY_SECONDS, abandon_submission, claim_submission, record_submission,
+)
+from .quota import QuotaExceeded, bind_reservation, release_reservation, reserve
+from .rate_limit import get_limiter_state
+from .tasks import build_valuation_pipeline, process_valuation_request, run_calculate_stage
 # ESTA LINHA É ESSENCIAL
 from .utils import validate_inputs_backend 
 
@@ -17,43 +27,129 @@ logger = logging.getLogger(__name__)
 # O limite de usos (pode ajustar)
 MAX_FREE_USES = 5 
 
+DUPLICATE_MESSAGE = "Esta simulação já foi enviada. Mostrando o relatório existente em vez de gerar outro."
+
+
+def _report_response(report, message, duplicate=False):
+    """Resposta de sucesso com o report (e o resultado da planilha, se já calculado)."""
+    body = {
+        "message": message,
+        "report_id": report.id,
+        "detail_url": reverse('reports:report_detail', kwargs={'pk': report.id}),
+    }
+    if duplicate:
+        body["duplicate"] = True
+    result_data = report.result_data or {}
+    if "valuation_base" in result_data:
+        body.update({
+            "valuation_base": result_data["valuation_base"],
+            "indicadores": result_data["indicadores"],
+            "pontos_fortes": result_data.get("pontos_fortes", []),
+            "pontos_atencao": result_data.get("pontos_atencao", []),
+        })
+    return JsonResponse(body, status=200)
+
 @csrf_exempt
 @login_required
 def calculate_valuation_view(request: HttpRequest):
     if request.method == "POST":
         try:
             data = json.loads(request.body)
-            
-            # 1. VERIFICAR LIMITE DE USO
-            if not request.user.is_superuser and request.user.usage_count >= MAX_FREE_USES:
-                return JsonResponse({
-                    "message": "Você atingiu o limite de simulações gratuitas."
-                }, status=403) # 403 Forbidden
-
-            # 2. VALIDAR OS INPUTS (AQUI ESTÁ O PONTO DE FALHA)
+
+            # 1. VALIDAR OS INPUTS
             # Esta função chama o utils.py
             validated_data, error = validate_inputs_backend(data)
-            
-            # Se o 'utils.py' novo estiver rodando, 'error' será None
-            # Se o 'utils.py' antigo estiver rodando, ele vai gerar o erro que você viu.
             if error:
                 return JsonResponse({"message": error}, status=400) # 400 Bad Request
 
-            # 3. CRIAR O RELATÓRIO
-            with transaction.atomic():
-                report = ValuationReport.objects.create(
-                    user=request.user,
-                    status=ValuationReport.StatusChoices.PENDING,
-                    inputs_data=validated_data # Salva os dados validados (24 campos)
+            # 2. ENVIO REPETIDO? (antes da cota: duplicatas não gastam simulação)
+            # 'bypass_cache': true força uma nova análise da IA (ignora o cache e a deduplicação)
+            bypass_cache = bool(data.get('bypass_cache'))
+            idempotency_key = (request.headers.get('Idempotency-Key') or data.get('idempotency_key') or '').strip()[:64] or None
+            if idempotency_key:
+                existing = ValuationReport.objects.filter(user=request.user, idempotency_key=idempotency_key).first()
+                if existing:
+                    return _report_response(existing, DUPLICATE_MESSAGE, duplicate=True)
+
+            inputs_hash = inputs_fingerprint(validated_data)
+            dedup_claimed = False
+            if not bypass_cache:
+                claim, existing = claim_submission(request.user.pk, inputs_hash)
+                if claim == DUPLICATE:
+                    return _report_response(existing, DUPLICATE_MESSAGE, duplicate=True)
+                if claim != CLAIMED:
+                    # Não segura o worker esperando: o cliente reenvia (mesma Idempotency-Key)
+                    response = JsonResponse({
+                        "message": "Uma simulação idêntica ainda está sendo registrada. Aguarde alguns segundos.",
+                        "retry_after": IN_PROGRESS_RETRY_SECONDS,
+                    }, status=409) # 409 Conflict
+                    response['Retry-After'] = str(IN_PROGRESS_RETRY_SECONDS)
+                    return response
+                dedup_claimed = True
+
+            # 3. RESERVAR UMA VAGA NA COTA (atômico no Redis: requisições simultâneas
+            # não passam todas pelo limite). Confirmada na etapa 'finalize', devolvida se falhar.
+            quota_token = None
+            if not request.user.is_superuser:
+                try:
+                    quota_token = reserve(request.user, MAX_FREE_USES)
+                except QuotaExceeded:
+                    if dedup_claimed:
+                        abandon_submission(request.user.pk, inputs_hash)
+                    return JsonResponse({
+                        "message": "Você atingiu o limite de simulações gratuitas."
+                    }, status=403) # 403 Forbidden
+                # Redis fora: vale a checagem antiga pelo contador do banco
+                if quota_token is None and request.user.usage_count >= MAX_FREE_USES:
+                    if dedup_claimed:
+                        abandon_submission(request.user.pk, inputs_hash)
+                    return JsonResponse({
+                        "message": "Você atingiu o limite de simulações gratuitas."
+                    }, status=403)
+
+            # 4. CRIAR O RELATÓRIO
+            try:
+                with transaction.atomic():
+                    report = ValuationReport.objects.create(
+                        user=request.user,
+                        status=ValuationReport.StatusChoices.PENDING,
+                        inputs_data=validated_data, # Salva os dados validados (24 campos)
+                        idempotency_key=idempotency_key,
+                    )
+            except Exception as e:
+                if quota_token:
+                    release_reservation(request.user.pk, quota_token)
+                if dedup_claimed:
+                    abandon_submission(request.user.pk, inputs_hash)
+                if isinstance(e, IntegrityError) and idempotency_key:
+                    # Outra requisição com a mesma chave criou o report primeiro
+                    existing = ValuationReport.objects.filter(user=request.user, idempotency_key=idempotency_key).first()
+                    if existing:
+                        return _report_response(existing, DUPLICATE_MESSAGE, duplicate=True)
+                raise
+            if quota_token:
+                bind_reservation(request.user.pk, quota_token, report.id)
+            if dedup_claimed:
+                record_submission(request.user.pk, inputs_hash, report.id)
+
+            # 5. CALCULAR A PLANILHA AQUI MESMO (microssegundos) E ENFILEIRAR SÓ IA + GAMMA
+            try:
+                run_calculate_stage(report)
+            except Exception as e:
+                # Se o cálculo inline falhar, o pipeline completo (com retentativas) assume
+                logger.error(f"Cálculo inline falhou para Report {report.id}, enfileirando pipeline completo: {e}", exc_info=True)
+                process_valuation_request.delay(report_id=report.id, bypass_cache=bypass_cache)
+                return _report_response(
+                    report,
+                    "Sua solicitação foi recebida! Seu relatório está sendo processado. Você será notificado por e-mail e pode verificar o histórico em alguns minutos."
                 )
-            
-            # 4. DISPARAR A TAREFA CELERY
-            process_valuation_request.delay(report_id=report.id)
-            
-            return JsonResponse({
-                "message": "Sua solicitação foi recebida! Seu relatório está sendo processado. Você será notificado por e-mail e pode verificar o histórico em alguns minutos.",
-                "report_id": report.id
-            }, status=200)
+
+            build_valuation_pipeline(report.id, bypass_cache=bypass_cache, include_calculate=False).apply_async()
+
+            return _report_response(
+                report,
+                "Valuation calculado! A análise da IA e a apresentação ficam prontas em alguns minutos; você será notificado por e-mail."
+            )
 
         except json.JSONDecodeError:
             return JsonResponse({"message": "Corpo da requisição JSON inválido."}, status=400)
@@ -64,11 +160,75 @@ def calculate_valuation_view(request: HttpRequest):
     return JsonResponse({"message": "Método GET não permitido."}, status=405)
 
 
+@csrf_exempt
+@login_required
+def batch_valuation_view(request: HttpRequest):
+    """
+    Envio em lote (equipe interna): arquivo CSV ou JSON com várias empresas,
+    no campo 'file' (multipart) ou direto no corpo da requisição. Como a API de
+    cálculo, dispensa o token CSRF (envios por script com a sessão da equipe).
+    Qualquer linha inválida recusa o lote inteiro, com todos os erros por linha.
+    """
+    if request.method != "POST":
+        return JsonResponse({"message": "Método GET não permitido."}, status=405)
+    if not request.user.is_staff:
+        return JsonResponse({"message": "Envio em lote disponível apenas para a equipe."}, status=403)
+
+    try:
+        upload = request.FILES.get('file')
+        if upload:
+            content, source_name = upload.read(), upload.name
+        else:
+            content, source_name = request.body, ''
+        rows = parse_batch_file(content, source_name)
+    except BatchError as e:
+        return JsonResponse({"message": str(e)}, status=400)
+
+    validated, errors = validate_rows(rows)
+    if errors:
+        return JsonResponse({
+            "message": f"{len(errors)} de {len(rows)} linhas com erro. Nenhuma empresa foi enviada.",
+            "errors": errors,
+        }, status=400)
+
+    try:
+        bypass_cache = request.POST.get('bypass_cache') in ('1', 'true', 'True')
+        batch = create_batch(
+            ValuationBatch(user=request.user, source_name=source_name[:255], bypass_cache=bypass_cache),
+            validated
+        )
+    except Exception as e:
+        logger.error(f"Erro inesperado em batch_valuation_view: {e}", exc_info=True)
+        return JsonResponse({"message": "Erro interno no servidor."}, status=500)
+
+    return JsonResponse({
+        "message": f"Lote com {batch.total} empresas recebido.",
+        "batch_id": batch.id,
+        "progress_url": reverse('reports:batch_detail', kwargs={'pk': batch.id}),
+        "progress_api_url": reverse('reports:api_batch_progress', kwargs={'pk': batch.id}),
+        **batch_progress(batch),
+    }, status=202)
+
+
+@login_required
+def metrics_api_view(request: HttpRequest):
+    """
+    Métricas operacionais para a equipe: hits/misses do cache de análises da IA
+    e, por provedor, o orçamento e os contadores do rate limiter compartilhado.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({"message": "Métricas disponíveis apenas para a equipe."}, status=403)
+    return JsonResponse({
+        "analysis_cache": get_cache_stats(),
+        "rate_limits": {provider: get_limiter_state(provider) for provider in settings.RATE_LIMITS},
+    })
+
+
 @login_required
 def dashboard_view(request):
     """Renderiza a página principal do chatbot (dashboard.html)."""
     # Pega os 5 relatórios mais recentes para o "Histórico Recente"
-    reports = ValuationReport.objects.filter(user=request.user).order_by('-created_at')[:5]
+    reports = recent_reports(request.user)[:5]
     context = {
         'reports': reports
     }
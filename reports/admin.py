@@ -1,9 +1,22 @@
 # reports/admin.py
+from django import forms
 from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, Q
+from django.urls import reverse
 from django.utils.html import format_html, json_script
 from django.utils.safestring import mark_safe
 import json
-from .models import ValuationReport
+from chatbot.batch import BatchError, batch_progress, create_batch, parse_batch_file, validate_rows
+from .models import SectorBenchmark, ValuationBatch, ValuationReport
+from .status import publish_report_status
+
+# Colunas mantidas pelo pipeline (derivadas do JSON em ValuationReport.save()): só leitura
+HOT_COLUMNS = (
+    'setor_atuacao', 'valuation_base', 'gamma_status',
+    'calculated_at', 'analysed_at', 'finalized_at', 'presented_at', 'scoring_version',
+)
 
 @admin.register(ValuationReport)
 class ValuationReportAdmin(admin.ModelAdmin):
@@ -18,8 +31,10 @@ class ValuationReportAdmin(admin.ModelAdmin):
     )
     list_filter = (
         'status', 
+        'gamma_status',
+        'setor_atuacao',
+        'scoring_version',
         'created_at'
-        
     )
     search_fields = ('id', 'user__razao_social', 'user__cnpj')
     ordering = ('-created_at',)
@@ -40,6 +55,14 @@ class ValuationReportAdmin(admin.ModelAdmin):
         'gamma_presentation_link',
         'created_at', 
         'updated_at',
+        'setor_atuacao',
+        'valuation_base',
+        'gamma_status',
+        'calculated_at',
+        'analysed_at',
+        'finalized_at',
+        'presented_at',
+        'scoring_version',
         'inputs_data_formatted', 
         'result_data_formatted'
     )
@@ -47,8 +70,14 @@ class ValuationReportAdmin(admin.ModelAdmin):
     def get_readonly_fields(self, request, obj=None):
         # Torna campos-chave readonly se o objeto já existir
         if obj:
-            return self.readonly_fields + ('id', 'user', 'created_at', 'updated_at')
-        return self.readonly_fields
+            return self.readonly_fields + ('id', 'user', 'created_at', 'updated_at') + HOT_COLUMNS
+        return self.readonly_fields + HOT_COLUMNS
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Status editado à mão: o registro no Redis (polling/ETag/SSE) não pode ficar para trás
+        if change and {'status', 'gamma_presentation_url'} & set(form.changed_data):
+            transaction.on_commit(lambda: publish_report_status(obj))
 
     # --- FUNÇÃO DE FORMATAÇÃO JSON (sem mudanças) ---
     def pretty_print_json(self, data):
@@ -73,22 +102,18 @@ class ValuationReportAdmin(admin.ModelAdmin):
 
     # --- NOVAS COLUNAS PARA A LISTA ---
 
-    @admin.display(description="Valuation (Realista)", ordering='result_data__valuation_base')
+    @admin.display(description="Valuation (Realista)", ordering='valuation_base')
     def get_valuation_realista(self, obj):
         """Exibe o valuation realista na lista."""
-        if obj.result_data and obj.result_data.get('valuation_base'):
-            try:
-                val = float(obj.result_data['valuation_base'])
-                return f"R$ {val:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-            except (ValueError, TypeError):
-                return "Erro de formato"
+        if obj.valuation_base:
+            return f"R$ {obj.valuation_base:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
         return "N/A"
 
-    @admin.display(description="Status Gamma", ordering='result_data__gamma_status')
+    @admin.display(description="Status Gamma", ordering='gamma_status')
     def get_gamma_status(self, obj):
         """Exibe o status do Gamma (pending, completed, failed) na lista."""
-        if obj.result_data and obj.result_data.get('gamma_status'):
-            status = obj.result_data['gamma_status']
+        if obj.gamma_status:
+            status = obj.gamma_status
             if status == 'completed':
                 return format_html('<span style="color: green;">● Completed</span>')
             elif status == 'pending':
@@ -102,4 +127,103 @@ class ValuationReportAdmin(admin.ModelAdmin):
     def gamma_presentation_link(self, obj):
         if obj.gamma_presentation_url:
             return format_html('<a href="{}" target="_blank">Abrir Apresentação</a>', obj.gamma_presentation_url)
-        return "Nenhum link gerado"
\ No newline at end of file
+        return "Nenhum link gerado"
+
+
+@admin.register(SectorBenchmark)
+class SectorBenchmarkAdmin(admin.ModelAdmin):
+    """Só leitura: mantido pela etapa 'finalize' e por 'rebuild_sector_benchmarks'."""
+    list_display = ('sector', 'count', 'valuation_mean', 'valuation_p50', 'updated_at')
+    ordering = ('-count',)
+    fields = ('sector', 'count', 'valuation_mean', 'valuation_p50', 'stats_formatted', 'updated_at')
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description="Estatísticas")
+    def stats_formatted(self, obj):
+        return format_html(
+            '<pre style="background: #f4f4f4; border: 1px solid #ddd; padding: 10px; border-radius: 5px;">{}</pre>',
+            json.dumps(obj.stats, indent=4, ensure_ascii=False)
+        )
+
+
+class ValuationBatchUploadForm(forms.ModelForm):
+    """Criação de lote pelo admin: valida o arquivo inteiro antes de gravar qualquer report."""
+    file = forms.FileField(label="Arquivo (CSV ou JSON)")
+
+    class Meta:
+        model = ValuationBatch
+        fields = ('user', 'bypass_cache')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        upload = cleaned_data.get('file')
+        if not upload:
+            return cleaned_data
+        try:
+            rows = parse_batch_file(upload.read(), upload.name)
+        except BatchError as e:
+            raise ValidationError(str(e))
+        self.validated_rows, errors = validate_rows(rows)
+        if errors:
+            raise ValidationError([f"Linha {error['row']}: {'; '.join(error['errors'])}" for error in errors])
+        return cleaned_data
+
+
+@admin.register(ValuationBatch)
+class ValuationBatchAdmin(admin.ModelAdmin):
+    """Lotes enviados em CSV/JSON. O 'adicionar' recebe o arquivo; depois, só leitura."""
+    list_display = ('id', 'user', 'source_name', 'total', 'get_done', 'created_at')
+    list_select_related = ('user',)
+    ordering = ('-created_at',)
+    search_fields = ('id', 'source_name', 'user__razao_social', 'user__cnpj')
+    fields = ('user', 'source_name', 'total', 'bypass_cache', 'progress_formatted', 'created_at')
+    readonly_fields = fields
+
+    def get_queryset(self, request):
+        statuses = ValuationReport.StatusChoices
+        return super().get_queryset(request).annotate(
+            done_count=Count('reports', filter=Q(reports__status__in=[statuses.SUCCESS, statuses.FAILED]))
+        )
+
+    def get_form(self, request, obj=None, **kwargs):
+        if obj is None:
+            kwargs['form'] = ValuationBatchUploadForm
+        return super().get_form(request, obj, **kwargs)
+
+    def get_fields(self, request, obj=None):
+        if obj is None:
+            return ('user', 'bypass_cache', 'file')
+        return self.fields
+
+    def get_readonly_fields(self, request, obj=None):
+        return self.readonly_fields if obj else ()
+
+    def has_change_permission(self, request, obj=None):
+        # A página do lote abre normalmente, mas nada é editável
+        return obj is None and super().has_change_permission(request)
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            return
+        obj.source_name = form.cleaned_data['file'].name[:255]
+        create_batch(obj, form.validated_rows)
+
+    @admin.display(description="Concluídos", ordering='done_count')
+    def get_done(self, obj):
+        return f"{obj.done_count} / {obj.total}"
+
+    @admin.display(description="Progresso")
+    def progress_formatted(self, obj):
+        progress = batch_progress(obj)
+        return format_html(
+            '{}% ({} concluídos, {} com falha, {} em andamento) — <a href="{}" target="_blank">Abrir página do lote</a>',
+            progress['percent'], progress['success'], progress['failed'],
+            progress['pending'] + progress['processing'],
+            reverse('reports:batch_detail', args=[obj.pk]),
+        )
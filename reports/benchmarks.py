@@ -0,0 +1,207 @@
+# reports/benchmarks.py
+"""
+Benchmark setorial mantido incrementalmente.
+
+Cada relatório concluído entra nas estatísticas do seu grupo de setor
+(chatbot.scenarios.sector_key) uma única vez, na etapa 'finalize'. Por
+métrica guardamos contagem, média e M2 (algoritmo de Welford, para desvio
+padrão sem reler nada) e um QuantileSketch: histograma em baldes
+logarítmicos (no estilo DDSketch) com erro relativo de ~SKETCH_ACCURACY
+e tamanho limitado, que responde percentis e "em que percentil estou".
+
+Assim a página de detalhe descobre a posição da empresa no setor lendo
+uma linha pela chave, sem agregar os relatórios a cada visualização.
+'rebuild_sector_benchmarks' recalcula tudo do zero.
+"""
+import math
+
+from chatbot.scenarios import sector_key
+
+# Métricas acompanhadas (chaves de 'stats' e 'sketches' no SectorBenchmark)
+METRICS = ('valuation_base', 'margem_contribuicao_perc', 'taxa_conversao')
+PERCENTILES = (10, 25, 50, 75, 90)
+SKETCH_ACCURACY = 0.02
+# Abaixo disso o percentil não é exibido (poucos pares para comparar)
+MIN_SECTOR_COUNT = 5
+
+
+def report_metrics(valuation_base, indicadores: dict) -> dict:
+    indicadores = indicadores or {}
+    return {
+        "valuation_base": valuation_base,
+        "margem_contribuicao_perc": indicadores.get('margem_contribuicao_perc'),
+        "taxa_conversao": indicadores.get('taxa_conversao'),
+    }
+
+
+class QuantileSketch:
+    """
+    Histograma em baldes logarítmicos: o valor x > 0 cai no balde
+    ceil(log_gamma(x)), com gamma = (1 + a) / (1 - a). Negativos usam o
+    mesmo esquema sobre |x|; zeros têm contador próprio. NaN e infinito são
+    ignorados (não têm balde). Serializa em JSON.
+    """
+    MIN_VALUE = 1e-9
+
+    def __init__(self, data: dict | None = None):
+        data = data or {}
+        self.gamma = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+        self._log_gamma = math.log(self.gamma)
+        self.positive = {int(k): v for k, v in data.get('positive', {}).items()}
+        self.negative = {int(k): v for k, v in data.get('negative', {}).items()}
+        self.zero = data.get('zero', 0)
+        self.count = data.get('count', 0)
+
+    def _bucket(self, value):
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _bucket_value(self, index):
+        # Ponto médio (relativo) do balde: erro máximo de SKETCH_ACCURACY
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value: float):
+        if not math.isfinite(value):
+            return
+        self.count += 1
+        if abs(value) < self.MIN_VALUE:
+            self.zero += 1
+        elif value > 0:
+            index = self._bucket(value)
+            self.positive[index] = self.positive.get(index, 0) + 1
+        else:
+            index = self._bucket(-value)
+            self.negative[index] = self.negative.get(index, 0) + 1
+
+    def _ordered(self):
+        """(valor representativo, contagem) do menor para o maior."""
+        for index in sorted(self.negative, reverse=True):
+            yield -self._bucket_value(index), self.negative[index]
+        if self.zero:
+            yield 0.0, self.zero
+        for index in sorted(self.positive):
+            yield self._bucket_value(index), self.positive[index]
+
+    def quantile(self, q: float):
+        if not self.count:
+            return None
+        target = q * (self.count - 1)
+        seen = 0
+        for value, count in self._ordered():
+            seen += count
+            if seen > target:
+                return value
+        return value
+
+    def rank(self, value: float):
+        """Fração (0-1) dos valores menores que 'value' (empates contam pela metade)."""
+        if not self.count or not math.isfinite(value):
+            return None
+        probe = QuantileSketch()
+        probe.add(value)
+        position = next(probe._ordered())[0]
+        below = equal = 0
+        for bucket_value, count in self._ordered():
+            if math.isclose(bucket_value, position, rel_tol=1e-9, abs_tol=self.MIN_VALUE):
+                equal += count
+            elif bucket_value < position:
+                below += count
+        return (below + equal / 2) / self.count
+
+    def to_json(self) -> dict:
+        return {
+            "count": self.count,
+            "zero": self.zero,
+            "positive": {str(k): v for k, v in self.positive.items()},
+            "negative": {str(k): v for k, v in self.negative.items()},
+        }
+
+
+class MetricAggregate:
+    """Contagem, média e M2 (Welford) + sketch de uma métrica."""
+
+    def __init__(self, stats: dict | None = None, sketch: dict | None = None):
+        stats = stats or {}
+        self.count = stats.get('count', 0)
+        self.mean = stats.get('mean', 0.0)
+        self.m2 = stats.get('m2', 0.0)
+        self.min = stats.get('min')
+        self.max = stats.get('max')
+        self.sketch = QuantileSketch(sketch)
+
+    def add(self, value):
+        if value is None:
+            return
+        value = float(value)
+        if not math.isfinite(value):
+            return  # Um NaN/inf estragaria média e M2 para sempre
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.sketch.add(value)
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "m2": self.m2,
+            "std": math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0,
+            "min": self.min,
+            "max": self.max,
+            **{f"p{p}": self.sketch.quantile(p / 100) for p in PERCENTILES},
+        }
+
+
+def load_aggregates(benchmark) -> dict:
+    return {
+        metric: MetricAggregate(benchmark.stats.get(metric), benchmark.sketches.get(metric))
+        for metric in METRICS
+    }
+
+
+def store_aggregates(benchmark, aggregates: dict, count: int):
+    benchmark.count = count
+    benchmark.stats = {metric: agg.stats() for metric, agg in aggregates.items()}
+    benchmark.sketches = {metric: agg.sketch.to_json() for metric, agg in aggregates.items()}
+    benchmark.valuation_mean = benchmark.stats['valuation_base']['mean']
+    benchmark.valuation_p50 = benchmark.stats['valuation_base']['p50']
+
+
+def add_report_to_benchmark(report):
+    """
+    Soma um relatório concluído ao benchmark do seu setor. Deve rodar dentro
+    da transação da etapa 'finalize' (que garante uma única contagem).
+    """
+    from .models import SectorBenchmark
+
+    sector = sector_key(report.setor_atuacao)
+    # INSERT ... ON CONFLICT DO NOTHING e depois a trava da linha: dois 'finalize'
+    # simultâneos do mesmo setor novo não colidem no unique (um espera o outro)
+    SectorBenchmark.objects.bulk_create([SectorBenchmark(sector=sector)], ignore_conflicts=True)
+    benchmark = SectorBenchmark.objects.select_for_update().get(sector=sector)
+    aggregates = load_aggregates(benchmark)
+    for metric, value in report_metrics(report.valuation_base, (report.result_data or {}).get('indicadores')).items():
+        aggregates[metric].add(value)
+    store_aggregates(benchmark, aggregates, benchmark.count + 1)
+    benchmark.save()
+
+
+def sector_position(report) -> dict | None:
+    """
+    Posição do relatório no seu setor: {setor, total, percentis por métrica}.
+    Uma leitura pela chave única do setor. None se o setor tiver poucos relatórios.
+    """
+    from .models import SectorBenchmark
+
+    benchmark = SectorBenchmark.objects.filter(sector=sector_key(report.setor_atuacao)).first()
+    if benchmark is None or benchmark.count < MIN_SECTOR_COUNT:
+        return None
+
+    aggregates = load_aggregates(benchmark)
+    percentiles = {}
+    for metric, value in report_metrics(report.valuation_base, (report.result_data or {}).get('indicadores')).items():
+        rank = aggregates[metric].sketch.rank(float(value)) if value is not None else None
+        percentiles[metric] = round(rank * 100) if rank is not None else None
+    return {"setor": benchmark.sector, "total": benchmark.count, "percentis": percentiles}
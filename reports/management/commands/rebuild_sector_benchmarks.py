@@ -0,0 +1,71 @@
+# reports/management/commands/rebuild_sector_benchmarks.py
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from chatbot.scenarios import sector_key
+from reports.benchmarks import METRICS, MetricAggregate, report_metrics, store_aggregates
+from reports.models import SectorBenchmark, ValuationReport
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula do zero o benchmark setorial (SectorBenchmark) a partir dos "
+        "relatórios concluídos. Use após mudar o agrupamento de setores, após "
+        "revalue_reports, ou se a atualização incremental tiver falhado."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Relatórios lidos por vez do banco.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        # Tudo numa transação: quem lê nunca vê a tabela pela metade. A trava em modo
+        # SHARE ROW EXCLUSIVE deixa as leituras passarem, mas espera os 'finalize' que já
+        # somaram algo (e ainda não commitaram) e segura os novos até o fim: nenhum
+        # incremento se perde nem é contado duas vezes.
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LOCK TABLE {SectorBenchmark._meta.db_table} IN SHARE ROW EXCLUSIVE MODE')
+
+            # Uma passada em streaming; só as colunas e o trecho do JSON que entram nas métricas.
+            # Mesmo critério da atualização incremental: relatórios que passaram pela etapa 'finalize'.
+            rows = (
+                ValuationReport.objects
+                .filter(status=ValuationReport.StatusChoices.SUCCESS, finalized_at__isnull=False)
+                .order_by('id')
+                .values_list('setor_atuacao', 'valuation_base', 'result_data__indicadores')
+                .iterator(chunk_size=options['chunk_size'])
+            )
+            aggregates = defaultdict(lambda: {metric: MetricAggregate() for metric in METRICS})
+            counts = defaultdict(int)
+            for setor_atuacao, valuation_base, indicadores in rows:
+                sector = sector_key(setor_atuacao)
+                counts[sector] += 1
+                for metric, value in report_metrics(valuation_base, indicadores).items():
+                    aggregates[sector][metric].add(value)
+
+            benchmarks = []
+            for sector, sector_aggregates in aggregates.items():
+                benchmark = SectorBenchmark(sector=sector)
+                store_aggregates(benchmark, sector_aggregates, counts[sector])
+                benchmarks.append(benchmark)
+
+            SectorBenchmark.objects.exclude(sector__in=list(aggregates)).delete()
+            SectorBenchmark.objects.bulk_create(
+                benchmarks,
+                update_conflicts=True,
+                unique_fields=['sector'],
+                update_fields=['count', 'valuation_mean', 'valuation_p50', 'stats', 'sketches', 'updated_at'],
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(benchmarks)} setores recalculados a partir de {sum(counts.values())} relatórios "
+            f"em {time.monotonic() - started:.1f}s."
+        ))
+        for benchmark in benchmarks:
+            self.stdout.write(f"  {benchmark.sector}: {benchmark.count} relatórios, mediana {benchmark.valuation_p50 or 0:,.2f}")
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0003_valuationreport_gamma_presentation_url'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='valuationreport',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='report_user_created_idx'),
+        ),
+    ]
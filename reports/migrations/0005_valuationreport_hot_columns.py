@@ -0,0 +1,46 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0004_valuationreport_report_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='valuationreport',
+            name='valuation_base',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='valuationreport',
+            name='gamma_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pendente'), ('completed', 'Concluída'), ('failed', 'Falha')], db_index=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='valuationreport',
+            name='setor_atuacao',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='valuationreport',
+            name='calculated_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='valuationreport',
+            name='analysed_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='valuationreport',
+            name='finalized_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='valuationreport',
+            name='presented_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,59 @@
+from django.db import migrations
+from django.utils.dateparse import parse_datetime
+
+BATCH_SIZE = 500
+
+STAGE_TIMESTAMP_FIELDS = {
+    'calculate': 'calculated_at',
+    'analyse': 'analysed_at',
+    'finalize': 'finalized_at',
+    'present': 'presented_at',
+}
+FIELDS = ['valuation_base', 'gamma_status', 'setor_atuacao', *STAGE_TIMESTAMP_FIELDS.values()]
+
+
+def _copy_hot_fields(report):
+    # Cópia da lógica de ValuationReport.sync_hot_fields (o modelo histórico não tem o método)
+    result_data = report.result_data or {}
+    inputs_data = report.inputs_data or {}
+    try:
+        valuation_base = result_data.get('valuation_base')
+        report.valuation_base = float(valuation_base) if valuation_base is not None else None
+    except (ValueError, TypeError):
+        report.valuation_base = None
+    report.gamma_status = result_data.get('gamma_status') or None
+    report.setor_atuacao = str(inputs_data.get('setor_atuacao') or '')[:255]
+    stages = result_data.get('stages') or {}
+    for stage, field in STAGE_TIMESTAMP_FIELDS.items():
+        setattr(report, field, parse_datetime(stages[stage]) if stages.get(stage) else None)
+
+
+def backfill_hot_columns(apps, schema_editor):
+    """Preenche as novas colunas em lotes por faixa de id, sem carregar a tabela inteira."""
+    ValuationReport = apps.get_model('reports', 'ValuationReport')
+    last_id = 0
+    while True:
+        batch = list(
+            ValuationReport.objects.filter(id__gt=last_id)
+            .only('id', 'result_data', 'inputs_data')
+            .order_by('id')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for report in batch:
+            _copy_hot_fields(report)
+        ValuationReport.objects.bulk_update(batch, FIELDS)
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+    # Cada lote é gravado na sua própria transação, para não segurar locks na tabela toda
+    atomic = False
+
+    dependencies = [
+        ('reports', '0005_valuationreport_hot_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_hot_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+def mark_existing_reports_v1(apps, schema_editor):
+    # Tudo que já foi calculado usou as tabelas fixas no código, que viraram a v1
+    ValuationReport = apps.get_model('reports', 'ValuationReport')
+    ValuationReport.objects.filter(calculated_at__isnull=False).update(scoring_version=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0006_backfill_hot_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='valuationreport',
+            name='scoring_version',
+            field=models.PositiveIntegerField(blank=True, db_index=True, help_text='Versão da ScoringTable usada no cálculo', null=True),
+        ),
+        migrations.RunPython(mark_existing_reports_v1, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0007_valuationreport_scoring_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SectorBenchmark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sector', models.CharField(max_length=50, unique=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('valuation_mean', models.FloatField(blank=True, null=True)),
+                ('valuation_p50', models.FloatField(blank=True, null=True)),
+                ('stats', models.JSONField(default=dict, help_text='Métrica -> contagem, média, desvio, mín/máx e percentis')),
+                ('sketches', models.JSONField(default=dict, help_text='Métrica -> histograma logarítmico para percentis')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['sector'],
+            },
+        ),
+    ]
@@ -1,6 +1,50 @@
 # apps/reports/models.py
+import hashlib
+import json
+
 from django.db import models
 from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+# Campos do result_data['stages'] (checkpoints do pipeline) -> colunas de timestamp
+STAGE_TIMESTAMP_FIELDS = {
+    'calculate': 'calculated_at',
+    'analyse': 'analysed_at',
+    'finalize': 'finalized_at',
+    'present': 'presented_at',
+}
+
+# Colunas derivadas dos JSONs, recalculadas em save() (ver sync_hot_fields)
+RESULT_HOT_FIELDS = ['valuation_base', 'gamma_status', *STAGE_TIMESTAMP_FIELDS.values()]
+INPUTS_HOT_FIELDS = ['setor_atuacao', 'inputs_hash']
+
+
+def inputs_fingerprint(inputs_data) -> str:
+    """Hash estável dos inputs (ordem das chaves não importa), para achar envios idênticos."""
+    raw = json.dumps(inputs_data or {}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+class ValuationBatch(models.Model):
+    """
+    Um envio em lote (CSV/JSON com várias empresas), feito pela API ou pelo admin.
+    Os reports do lote apontam para ele; o progresso é contado a partir deles.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='valuation_batches'
+    )
+    source_name = models.CharField(max_length=255, blank=True, help_text="Nome do arquivo enviado")
+    total = models.PositiveIntegerField(default=0)
+    bypass_cache = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Lote #{self.pk} ({self.total} empresas)"
+
 
 class ValuationReport(models.Model):
     """Armazena o resultado de um cálculo de valuation."""
@@ -23,6 +67,14 @@ class ValuationReport(models.Model):
         on_delete=models.CASCADE,
         related_name='reports'
     )
+    # Lote de origem, quando enviado junto com outras empresas (CSV/JSON)
+    batch = models.ForeignKey(
+        ValuationBatch,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='reports'
+    )
     # Inputs que vieram do chatbot
     inputs_data = models.JSONField(help_text="JSON com as perguntas e respostas do chat")
     
@@ -42,8 +94,114 @@ class ValuationReport(models.Model):
         default=StatusChoices.PENDING
     )
     
+    class GammaStatusChoices(models.TextChoices):
+        PENDING = 'pending', 'Pendente'
+        COMPLETED = 'completed', 'Concluída'
+        FAILED = 'failed', 'Falha'
+
+    # --- Cópias indexadas de campos do JSON (mantidas por sync_hot_fields) ---
+    # Permitem ordenar/filtrar no admin e checar status sem extrair o JSON de cada linha.
+    valuation_base = models.FloatField(null=True, blank=True, db_index=True)
+    gamma_status = models.CharField(
+        max_length=20,
+        choices=GammaStatusChoices.choices,
+        null=True,
+        blank=True,
+        db_index=True
+    )
+    setor_atuacao = models.CharField(max_length=255, blank=True, default='', db_index=True)
+    scoring_version = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text="Versão da ScoringTable usada no cálculo"
+    )
+    # Deduplicação de envios (ver chatbot.views.calculate_valuation_view)
+    inputs_hash = models.CharField(max_length=64, blank=True, default='')
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True)
+    calculated_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    analysed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    finalized_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    presented_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Histórico paginado por cursor: WHERE user = ? ORDER BY created_at DESC, id DESC
+            models.Index(fields=['user', '-created_at', '-id'], name='report_user_created_idx'),
+            # Mesmo envio repetido: WHERE user = ? AND inputs_hash = ? AND created_at >= ?
+            models.Index(fields=['user', 'inputs_hash', '-created_at'], name='report_user_inputs_idx'),
+        ]
+        constraints = [
+            # Um report por chave de idempotência do cliente (cliques duplos, reenvios)
+            models.UniqueConstraint(
+                fields=['user', 'idempotency_key'],
+                condition=models.Q(idempotency_key__isnull=False),
+                name='report_user_idempotency_key',
+            ),
+        ]
+
+    def sync_hot_fields(self, sources=('result_data', 'inputs_data')):
+        """
+        Copia para as colunas os campos derivados dos JSONs indicados em 'sources'
+        (valuation_base, gamma_status e checkpoints do result_data; setor_atuacao
+        e o hash dos inputs do inputs_data). Retorna os nomes das colunas atualizadas.
+        """
+        updated = []
+        if 'result_data' in sources:
+            result_data = self.result_data or {}
+            valuation_base = result_data.get('valuation_base')
+            try:
+                self.valuation_base = float(valuation_base) if valuation_base is not None else None
+            except (ValueError, TypeError):
+                self.valuation_base = None
+            self.gamma_status = result_data.get('gamma_status') or None
+
+            stages = result_data.get('stages') or {}
+            for stage, field in STAGE_TIMESTAMP_FIELDS.items():
+                setattr(self, field, parse_datetime(stages[stage]) if stages.get(stage) else None)
+            updated += RESULT_HOT_FIELDS
+
+        if 'inputs_data' in sources:
+            self.setor_atuacao = str((self.inputs_data or {}).get('setor_atuacao') or '')[:255]
+            self.inputs_hash = inputs_fingerprint(self.inputs_data)
+            updated += INPUTS_HOT_FIELDS
+        return updated
+
+    def save(self, *args, **kwargs):
+        # Toda gravação dos JSONs (inclusive save(update_fields=['result_data']) das
+        # tarefas) leva junto as colunas derivadas, então elas nunca ficam defasadas.
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self.sync_hot_fields()
+        else:
+            sources = {'result_data', 'inputs_data'} & set(update_fields)
+            if sources:
+                kwargs['update_fields'] = set(update_fields) | set(self.sync_hot_fields(sources))
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Relatório de {self.user.razao_social} em {self.created_at.strftime('%d/%m/%Y')}"
+
+class SectorBenchmark(models.Model):
+    """
+    Estatísticas agregadas dos relatórios concluídos de um grupo de setor
+    (chave de chatbot.scenarios.sector_key). Mantida incrementalmente na etapa
+    'finalize' (reports.benchmarks) e recalculável com 'rebuild_sector_benchmarks'.
+    """
+    sector = models.CharField(max_length=50, unique=True)
+    count = models.PositiveIntegerField(default=0)
+    # Cópias para listar/ordenar no admin; o detalhe completo fica em 'stats'
+    valuation_mean = models.FloatField(null=True, blank=True)
+    valuation_p50 = models.FloatField(null=True, blank=True)
+    stats = models.JSONField(default=dict, help_text="Métrica -> contagem, média, desvio, mín/máx e percentis")
+    sketches = models.JSONField(default=dict, help_text="Métrica -> histograma logarítmico para percentis")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['sector']
+
     def __str__(self):
-        return f"Relatório de {self.user.razao_social} em {self.created_at.strftime('%d/%m/%Y')}"
\ No newline at end of file
+        return f"Benchmark {self.sector} ({self.count} relatórios)"
@@ -0,0 +1,66 @@
+# reports/pagination.py
+"""
+Paginação por cursor (keyset) do histórico de relatórios.
+
+Em vez de OFFSET, cada página começa logo depois do último (created_at, id)
+da página anterior. Com o índice (user, -created_at, -id) o banco lê só as
+linhas da página, então o custo não cresce com o tamanho do histórico.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+from .models import ValuationReport
+
+HISTORY_PAGE_SIZE = 25
+
+# Colunas que as listas realmente exibem; os JSONs (inputs/result) ficam de fora
+LIST_COLUMNS = ('id', 'status', 'created_at')
+
+
+def encode_cursor(report) -> str:
+    raw = f"{report.created_at.isoformat()}|{report.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    """Retorna (created_at, id) ou None se o cursor for inválido."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, report_id = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.fromisoformat(created_at), int(report_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def recent_reports(user):
+    """Relatórios do usuário, do mais novo ao mais antigo, só com as colunas de lista."""
+    return (
+        ValuationReport.objects.filter(user=user)
+        .only(*LIST_COLUMNS)
+        .order_by('-created_at', '-id')
+    )
+
+
+def get_history_page(user, cursor=None, page_size=HISTORY_PAGE_SIZE):
+    """
+    Retorna (relatórios, próximo_cursor). 'próximo_cursor' é None na última página.
+    Um cursor inválido volta para a primeira página.
+    """
+    queryset = recent_reports(user)
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        created_at, report_id = position
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=report_id)
+        )
+
+    # Busca um a mais só para saber se existe próxima página
+    reports = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(reports) > page_size:
+        reports = reports[:page_size]
+        next_cursor = encode_cursor(reports[-1])
+    return reports, next_cursor
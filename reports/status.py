@@ -0,0 +1,166 @@
+# reports/status.py
+"""
+Publicação das mudanças de status dos relatórios.
+
+As tarefas Celery chamam publish_report_status()/publish_report_partial() a
+cada transição (publish_reports_status() após mudanças de status em massa); o evento vai para um canal Redis pub/sub por usuário e é
+repassado ao navegador pelo endpoint SSE (reports.views.report_status_stream).
+
+publish_report_status() também grava um registro pequeno no Redis
+(report_status:<pk>) com o payload e um número de versão; a API de polling
+responde a partir dele, com ETag, sem consultar o banco.
+"""
+import json
+import logging
+
+from django.urls import reverse
+
+from valuation.redis_client import get_redis
+from .models import ValuationReport
+
+logger = logging.getLogger(__name__)
+
+
+STATUS_RECORD_TTL_SECONDS = 24 * 3600
+
+
+def user_channel(user_id):
+    return f'report_status:user:{user_id}'
+
+
+def status_record_key(report_id):
+    return f'report_status:{report_id}'
+
+
+def status_payload(report_id, status, gamma_status, gamma_url):
+    """Mesmo formato da API de polling (check_report_status_api)."""
+    if status == ValuationReport.StatusChoices.SUCCESS:
+        return {
+            "report_id": report_id,
+            "status": "SUCCESS",
+            "detail_url": reverse('reports:report_detail', kwargs={'pk': report_id}),
+            "gamma_status": gamma_status,
+            "gamma_url": gamma_url,
+        }
+    if status == ValuationReport.StatusChoices.FAILED:
+        return {"report_id": report_id, "status": "FAILED", "gamma_status": gamma_status}
+    # A tarefa principal ainda está PENDING ou PROCESSING
+    return {"report_id": report_id, "status": "PROCESSING", "gamma_status": "pending"}
+
+
+def build_status_payload(report):
+    return status_payload(
+        report.pk,
+        report.status,
+        report.gamma_status,
+        report.gamma_presentation_url,
+    )
+
+
+def build_partial_payload(report):
+    """Resultados parciais do pipeline (mesmo formato de report_partial_api)."""
+    result_data = report.result_data or {}
+    return {
+        "report_id": report.pk,
+        "status": report.status,
+        "valuation_base": result_data.get('valuation_base'),
+        "indicadores": result_data.get('indicadores'),
+        "cenarios": result_data.get('cenarios'),
+        "pontos_fortes": result_data.get('pontos_fortes', []),
+        "pontos_atencao": result_data.get('pontos_atencao', []),
+        "recomendacao_investidor": result_data.get('recomendacao_investidor'),
+    }
+
+
+def store_status_record(report, payload=None):
+    """
+    Grava o registro de status do report no Redis e incrementa sua versão.
+    Retorna (payload, versão); versão None se o Redis estiver indisponível.
+    """
+    payload = payload or build_status_payload(report)
+    try:
+        key = status_record_key(report.pk)
+        pipe = get_redis().pipeline()
+        pipe.hset(key, mapping={"user_id": report.user_id, "payload": json.dumps(payload, ensure_ascii=False)})
+        pipe.hincrby(key, "version", 1)
+        pipe.expire(key, STATUS_RECORD_TTL_SECONDS)
+        version = pipe.execute()[1]
+        return payload, version
+    except Exception as e:
+        logger.warning(f"Não foi possível gravar o status do Report {report.pk} no Redis: {e}")
+        return payload, None
+
+
+def get_status_record(report_id):
+    """Retorna (user_id, payload, versão) do registro no Redis, ou None se não existir."""
+    try:
+        record = get_redis().hgetall(status_record_key(report_id))
+    except Exception as e:
+        logger.warning(f"Não foi possível ler o status do Report {report_id} no Redis: {e}")
+        return None
+    if not record or "payload" not in record:
+        return None
+    return int(record["user_id"]), json.loads(record["payload"]), int(record.get("version", 0))
+
+
+def get_status_payloads(user, report_ids):
+    """
+    Status de vários relatórios do usuário de uma vez: primeiro dos registros
+    no Redis (um único round-trip em pipeline) e, para os que faltarem, UMA
+    consulta ao banco filtrando por user e id__in, só com as colunas de status.
+    """
+    payloads = {}
+    missing = list(report_ids)
+
+    try:
+        pipe = get_redis().pipeline()
+        for report_id in report_ids:
+            pipe.hgetall(status_record_key(report_id))
+        missing = []
+        for report_id, record in zip(report_ids, pipe.execute()):
+            if record and "payload" in record and int(record["user_id"]) == user.pk:
+                payloads[report_id] = json.loads(record["payload"])
+            else:
+                missing.append(report_id)
+    except Exception as e:
+        logger.warning(f"Não foi possível ler status em lote no Redis: {e}")
+
+    if missing:
+        rows = ValuationReport.objects.filter(user=user, id__in=missing).values_list(
+            'id', 'status', 'gamma_status', 'gamma_presentation_url'
+        )
+        for report_id, status, gamma_status, gamma_url in rows:
+            payloads[report_id] = status_payload(report_id, status, gamma_status, gamma_url)
+
+    return payloads
+
+
+def _publish(report, event, payload):
+    try:
+        message = json.dumps({"event": event, "data": payload}, ensure_ascii=False)
+        get_redis().publish(user_channel(report.user_id), message)
+    except Exception as e:
+        # Falha de publicação nunca interrompe o pipeline; o polling cobre o buraco
+        logger.warning(f"Não foi possível publicar evento '{event}' do Report {report.pk}: {e}")
+
+
+def publish_report_status(report):
+    """Atualiza o registro de status (nova versão) e notifica os streams SSE."""
+    payload, _ = store_status_record(report)
+    _publish(report, 'status', payload)
+
+
+def publish_reports_status(report_ids):
+    """
+    Republica o status de vários reports após um .update() em massa (que não
+    passa pelas tarefas): uma consulta só com as colunas do payload.
+    """
+    reports = ValuationReport.objects.filter(id__in=list(report_ids)).only(
+        'id', 'user_id', 'status', 'gamma_status', 'gamma_presentation_url'
+    )
+    for report in reports:
+        publish_report_status(report)
+
+
+def publish_report_partial(report):
+    _publish(report, 'partial', build_partial_payload(report))
@@ -1,3 +1,327 @@
-from django.test import TestCase
+import importlib
+import json
+import math
+import random
+import statistics
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from chatbot import scoring
+from chatbot.tasks import process_valuation_request
+from valuation.testing import FakeRedisMixin, make_report, make_user
+from .benchmarks import (
+    MIN_SECTOR_COUNT, SKETCH_ACCURACY, MetricAggregate, QuantileSketch, add_report_to_benchmark, sector_position,
+)
+from .models import SectorBenchmark, ValuationReport, inputs_fingerprint
+from .pagination import get_history_page
+from .status import get_status_record, publish_report_status
+
+
+# --- status servido do registro no Redis, com ETag/304 ---
+
+class ReportStatusETagTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.client.force_login(self.user)
+
+    def status_url(self, report):
+        return reverse('reports:api_check_report_status', kwargs={'pk': report.pk})
+
+    def test_unchanged_status_returns_304(self):
+        report = make_report(self.user, status=ValuationReport.StatusChoices.PROCESSING)
+        first = self.client.get(self.status_url(report))
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()['status'], 'PROCESSING')
+
+        second = self.client.get(self.status_url(report), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_transition_changes_etag_and_payload(self):
+        report = make_report(self.user, status=ValuationReport.StatusChoices.PROCESSING)
+        first = self.client.get(self.status_url(report))
+
+        report.status = ValuationReport.StatusChoices.SUCCESS
+        report.save(update_fields=['status'])
+        publish_report_status(report)
+
+        second = self.client.get(self.status_url(report), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(second.json()['status'], 'SUCCESS')
+
+    def test_record_of_another_user_is_not_served(self):
+        other_report = make_report(make_user(cnpj='99888777000166'), status=ValuationReport.StatusChoices.SUCCESS)
+        publish_report_status(other_report)
+        response = self.client.get(self.status_url(other_report))
+        self.assertEqual(response.status_code, 404)
+
+    def test_without_redis_falls_back_to_database_without_etag(self):
+        report = make_report(self.user, status=ValuationReport.StatusChoices.SUCCESS)
+        with mock.patch('reports.status.get_redis', side_effect=ConnectionError("fora")):
+            response = self.client.get(self.status_url(report))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'SUCCESS')
+        self.assertNotIn('ETag', response)
+
+    def test_reprocessing_a_failed_report_republishes_its_status(self):
+        report = make_report(self.user, status=ValuationReport.StatusChoices.FAILED)
+        publish_report_status(report)
+
+        with mock.patch('chatbot.tasks.build_valuation_pipeline'):
+            process_valuation_request(report.id)
+
+        _, payload, version = get_status_record(report.id)
+        self.assertEqual(payload['status'], 'PROCESSING')
+        self.assertEqual(version, 2)
+
+
+class ReportAdminStatusTests(FakeRedisMixin, TestCase):
+
+    def test_status_edited_in_the_admin_is_republished(self):
+        self.client.force_login(make_user(is_staff=True, is_superuser=True))
+        report = make_report(make_user(cnpj='99888777000166'))
+        publish_report_status(report)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('admin:reports_valuationreport_change', args=[report.id]),
+                {'status': ValuationReport.StatusChoices.FAILED, 'gamma_presentation_url': ''},
+            )
+        self.assertEqual(response.status_code, 302)
+        _, payload, version = get_status_record(report.id)
+        self.assertEqual(payload['status'], 'FAILED')
+        self.assertEqual(version, 2)
+
+
+# --- histórico paginado por cursor (keyset) ---
+
+class HistoryPaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user()
+        self.reports = [make_report(self.user, status=ValuationReport.StatusChoices.SUCCESS) for _ in range(5)]
+        make_report(make_user(cnpj='99888777000166'), status=ValuationReport.StatusChoices.SUCCESS)
+
+    def walk(self, page_size):
+        seen, cursor = [], None
+        while True:
+            page, cursor = get_history_page(self.user, cursor, page_size=page_size)
+            seen.append([report.id for report in page])
+            if cursor is None:
+                return seen
+
+    def test_pages_cover_every_report_once_newest_first(self):
+        pages = self.walk(page_size=2)
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        ids = [report_id for page in pages for report_id in page]
+        self.assertEqual(ids, sorted((report.id for report in self.reports), reverse=True))
+
+    def test_ties_on_created_at_are_broken_by_id(self):
+        ValuationReport.objects.filter(user=self.user).update(created_at=timezone.now())
+        ids = [report_id for page in self.walk(page_size=2) for report_id in page]
+        self.assertEqual(ids, sorted((report.id for report in self.reports), reverse=True))
+
+    def test_invalid_cursor_returns_first_page(self):
+        first, _ = get_history_page(self.user, page_size=2)
+        page, _ = get_history_page(self.user, 'não-é-um-cursor', page_size=2)
+        self.assertEqual(page, first)
+
+    def test_list_loads_only_list_columns(self):
+        page, _ = get_history_page(self.user, page_size=2)
+        self.assertEqual(page[0].get_deferred_fields() & {'inputs_data', 'result_data'}, {'inputs_data', 'result_data'})
+
+
+# --- API "e se" ---
+
+class WhatIfApiTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        scoring.reset_scoring_cache()
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.report = ValuationReport.objects.create(
+            user=self.user,
+            status=ValuationReport.StatusChoices.SUCCESS,
+            inputs_data={'faturamento_mensal': 10_000, 'gastos_variaveis': 4_000, 'pmf': 'MÉDIO'},
+            result_data={},
+        )
+        self.url = reverse('reports:api_report_what_if', kwargs={'pk': self.report.pk})
+
+    def test_returns_sensitivity_with_labels_and_timing(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['criterios']['pmf']['atual'], 'MÉDIO')
+        self.assertIn('label', body['criterios']['pmf'])
+        self.assertIn('what-if;dur=', response['Server-Timing'])
+
+    def test_query_string_overrides_inputs(self):
+        base = self.client.get(self.url).json()['valuation_base']
+        doubled = self.client.get(self.url, {'faturamento_mensal': 20_000}).json()['valuation_base']
+        self.assertAlmostEqual(doubled, base * 2)
+
+    def test_rejects_invalid_values(self):
+        for params in ({'faturamento_mensal': 'abc'}, {'faturamento_mensal': -1}, {'pmf': 'TALVEZ'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+    def test_other_users_report_is_not_found(self):
+        self.client.force_login(make_user(cnpj='99888777000166'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+# --- benchmark setorial incremental ---
+
+class QuantileSketchTests(SimpleTestCase):
+
+    def test_quantiles_within_relative_accuracy(self):
+        rng = random.Random(20)
+        values = [rng.lognormvariate(12, 1.5) for _ in range(5000)]
+        sketch = QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        ordered = sorted(values)
+        for q in (0.1, 0.5, 0.9):
+            exact = ordered[int(q * (len(ordered) - 1))]
+            self.assertAlmostEqual(sketch.quantile(q), exact, delta=exact * 2 * SKETCH_ACCURACY)
+
+    def test_negative_zero_and_positive_values_keep_order(self):
+        sketch = QuantileSketch()
+        for value in (-100.0, -1.0, 0.0, 0.0, 1.0, 100.0):
+            sketch.add(value)
+        self.assertLess(sketch.quantile(0), -90)
+        self.assertEqual(sketch.quantile(0.5), 0.0)
+        self.assertGreater(sketch.quantile(1), 90)
+        self.assertAlmostEqual(sketch.rank(0.0), 0.5)
+
+    def test_non_finite_values_are_ignored(self):
+        sketch = QuantileSketch()
+        for value in (1.0, math.nan, math.inf, -math.inf):
+            sketch.add(value)
+        self.assertEqual(sketch.count, 1)
+        self.assertIsNone(sketch.rank(math.nan))
+
+    def test_roundtrips_through_json(self):
+        sketch = QuantileSketch()
+        for value in (-3.0, 0.0, 5.0, 50.0):
+            sketch.add(value)
+        restored = QuantileSketch(json.loads(json.dumps(sketch.to_json())))
+        self.assertEqual(restored.to_json(), sketch.to_json())
+        self.assertEqual(restored.quantile(0.75), sketch.quantile(0.75))
+
+
+class MetricAggregateTests(SimpleTestCase):
+
+    def test_welford_matches_statistics(self):
+        rng = random.Random(21)
+        values = [rng.uniform(-1, 1) for _ in range(500)]
+        aggregate = MetricAggregate()
+        for value in values:
+            aggregate.add(value)
+        stats = aggregate.stats()
+        self.assertEqual(stats['count'], len(values))
+        self.assertAlmostEqual(stats['mean'], statistics.mean(values))
+        self.assertAlmostEqual(stats['std'], statistics.stdev(values))
+        self.assertEqual((stats['min'], stats['max']), (min(values), max(values)))
+
+    def test_continues_from_stored_stats(self):
+        first = MetricAggregate()
+        for value in (1.0, 2.0, 3.0):
+            first.add(value)
+        resumed = MetricAggregate(first.stats(), first.sketch.to_json())
+        resumed.add(10.0)
+        self.assertAlmostEqual(resumed.stats()['std'], statistics.stdev([1.0, 2.0, 3.0, 10.0]))
+
+    def test_none_and_non_finite_are_skipped(self):
+        aggregate = MetricAggregate()
+        for value in (None, math.nan, math.inf, 4.0):
+            aggregate.add(value)
+        self.assertEqual(aggregate.count, 1)
+        self.assertEqual(aggregate.mean, 4.0)
+
+
+class SectorBenchmarkTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user()
+
+    def add_reports(self, valuations, setor='Software'):
+        reports = []
+        for valuation in valuations:
+            report = make_report(self.user, indicadores={'margem_contribuicao_perc': 0.3, 'taxa_conversao': None})
+            report.inputs_data = {'setor_atuacao': setor}
+            report.result_data['valuation_base'] = valuation
+            report.save()
+            add_report_to_benchmark(report)
+            reports.append(report)
+        return reports
+
+    def test_creates_the_row_and_counts_each_report(self):
+        self.add_reports([1000.0, 2000.0, 3000.0])
+        benchmark = SectorBenchmark.objects.get(sector='tecnologia')
+        self.assertEqual(benchmark.count, 3)
+        self.assertAlmostEqual(benchmark.valuation_mean, 2000.0)
+        self.assertEqual(benchmark.stats['taxa_conversao']['count'], 0)
+        self.add_reports([500.0], setor='Varejo')
+        self.assertEqual(SectorBenchmark.objects.count(), 2)
+
+    def test_sector_position_needs_enough_peers(self):
+        reports = self.add_reports([1000.0] * (MIN_SECTOR_COUNT - 1))
+        self.assertIsNone(sector_position(reports[0]))
+
+    def test_sector_position_ranks_the_report(self):
+        reports = self.add_reports([1000.0 * (i + 1) for i in range(10)])
+        position = sector_position(reports[-1])
+        self.assertEqual(position['setor'], 'tecnologia')
+        self.assertEqual(position['total'], 10)
+        self.assertEqual(position['percentis']['valuation_base'], 95)
+        self.assertEqual(position['percentis']['margem_contribuicao_perc'], 50)
+        self.assertIsNone(position['percentis']['taxa_conversao'])
+
+
+# --- colunas derivadas dos JSONs ---
+
+class HotFieldsTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user()
+
+    def test_save_copies_json_fields_to_columns(self):
+        report = make_report(self.user, gamma_status='pending', stages={'finalize': '2025-03-01T12:00:00+00:00'})
+        self.assertEqual(report.valuation_base, 5000.0)
+        self.assertEqual(report.setor_atuacao, 'Tecnologia')
+        self.assertEqual(report.inputs_hash, inputs_fingerprint({'setor_atuacao': 'Tecnologia'}))
+        self.assertEqual(report.finalized_at.isoformat(), '2025-03-01T12:00:00+00:00')
+        self.assertIsNone(report.calculated_at)
+
+        report.result_data.update(valuation_base='n/a', gamma_status='completed')
+        report.save(update_fields=['result_data'])
+        stored = ValuationReport.objects.get(id=report.id)
+        self.assertIsNone(stored.valuation_base)
+        self.assertEqual(stored.gamma_status, 'completed')
+        self.assertTrue(ValuationReport.objects.filter(gamma_status='completed').exists())
+
+    def test_backfill_migration_fills_existing_rows(self):
+        reports = [make_report(self.user, gamma_status='pending', stages={'calculate': '2025-01-01T00:00:00+00:00'}) for _ in range(3)]
+        ValuationReport.objects.update(valuation_base=None, gamma_status=None, setor_atuacao='', calculated_at=None)
+
+        migration = importlib.import_module('reports.migrations.0006_backfill_hot_columns')
+        state = MigrationLoader(connection).project_state(('reports', '0005_valuationreport_hot_columns'))
+        with mock.patch.object(migration, 'BATCH_SIZE', 2):
+            migration.backfill_hot_columns(state.apps, None)
+
+        for report in reports:
+            stored = ValuationReport.objects.get(id=report.id)
+            self.assertEqual(
+                (stored.valuation_base, stored.gamma_status, stored.setor_atuacao, stored.calculated_at),
+                (5000.0, 'pending', 'Tecnologia', report.calculated_at),
+            )
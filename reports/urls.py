@@ -7,8 +7,19 @@ app_name = 'reports'
 urlpatterns = [
     path('history/', views.report_history_view, name='report_history'),
     path('detail/<int:pk>/', views.report_detail_view, name='report_detail'),
+    # Envio em lote: progresso (página e JSON)
+    path('batch/<int:pk>/', views.batch_detail_view, name='batch_detail'),
+    path('api/batch/<int:pk>/', views.batch_progress_api, name='api_batch_progress'),
     
     # --- NOVA ROTA DE API PARA POLLING ---
     # Esta URL será chamada pelo JavaScript para verificar o status
     path('api/check_status/<int:pk>/', views.check_report_status_api, name='api_check_report_status'),
+    # Status de vários relatórios em uma só requisição (?ids=1,2,3)
+    path('api/check_status/batch/', views.check_reports_status_batch_api, name='api_check_reports_status_batch'),
+    # Resultados parciais (enquanto o pipeline ainda está rodando)
+    path('api/partial/<int:pk>/', views.report_partial_api, name='api_report_partial'),
+    # Simulação "e se" (sensibilidade por critério e por input financeiro), sem IA
+    path('api/what_if/<int:pk>/', views.report_what_if_api, name='api_report_what_if'),
+    # Stream SSE (ASGI) com as mudanças de status publicadas pelas tarefas
+    path('api/status_stream/', views.report_status_stream, name='api_report_status_stream'),
 ]
\ No newline at end of file
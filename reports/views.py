@@ -1,21 +1,42 @@
 # reports/views.py
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from .models import ValuationReport
-from django.http import JsonResponse # <-- ADICIONADO
-from django.urls import reverse # <-- ADICIONADO
+from .models import ValuationBatch, ValuationReport
+from django.http import HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+import json
 import logging # <-- ADICIONADO
+import time
+
+from chatbot.batch import batch_progress
+from chatbot.engine import FINANCIAL_FIELDS, what_if
+from chatbot.insights import criterio_label
+from chatbot.scoring import get_active_tables, get_tables
+from valuation.redis_client import get_async_redis
+from .benchmarks import sector_position
+from .pagination import get_history_page
+from .status import (
+    build_partial_payload,
+    get_status_payloads,
+    get_status_record,
+    store_status_record,
+    user_channel,
+)
 
 logger = logging.getLogger(__name__) # <-- ADICIONADO
 
 @login_required
 def report_history_view(request):
     """
-    Exibe a lista de relatórios (histórico) do usuário.
+    Exibe a lista de relatórios (histórico) do usuário, paginada por cursor
+    (?cursor=...) e carregando só as colunas que a tabela mostra.
     """
-    reports = ValuationReport.objects.filter(user=request.user).order_by('-created_at')
+    cursor = request.GET.get('cursor')
+    reports, next_cursor = get_history_page(request.user, cursor)
     context = {
-        'reports': reports
+        'reports': reports,
+        'next_cursor': next_cursor,
+        'is_first_page': not cursor,
     }
     return render(request, 'reports/report_history.html', context)
 
@@ -27,11 +48,40 @@ def report_detail_view(request, pk):
     """
     report = get_object_or_404(ValuationReport, pk=pk, user=request.user)
     context = {
-        'report': report
+        'report': report,
+        # Posição no setor: uma leitura da linha agregada do SectorBenchmark
+        'sector_position': sector_position(report) if report.status == ValuationReport.StatusChoices.SUCCESS else None,
     }
     return render(request, 'reports/report_detail.html', context)
 
 
+# --- LOTES (envio de várias empresas de uma vez) ---
+
+def _get_batch(request, pk):
+    # A equipe vê qualquer lote; os demais usuários, só os próprios
+    batches = ValuationBatch.objects.all() if request.user.is_staff else ValuationBatch.objects.filter(user=request.user)
+    return get_object_or_404(batches, pk=pk)
+
+
+@login_required
+def batch_detail_view(request, pk):
+    """Progresso de um lote: contagem por status e uma linha por empresa."""
+    batch = _get_batch(request, pk)
+    reports = batch.reports.only('id', 'user_id', 'status', 'setor_atuacao', 'valuation_base').order_by('id')
+    context = {
+        'batch': batch,
+        'progress': batch_progress(batch),
+        'reports': reports,
+    }
+    return render(request, 'reports/batch_detail.html', context)
+
+
+@login_required
+def batch_progress_api(request, pk):
+    """Progresso do lote em JSON (uma consulta agregada)."""
+    return JsonResponse(batch_progress(_get_batch(request, pk)))
+
+
 # --- NOVA VIEW DE API PARA POLLING ---
 
 @login_required
@@ -39,31 +89,170 @@ def check_report_status_api(request, pk):
     """
     Uma API interna para o JavaScript verificar o status de um relatório,
     incluindo o status da geração Gamma.
+
+    Responde a partir do registro que as tarefas gravam no Redis a cada
+    transição; o banco só é consultado quando o registro não existe.
+    A versão do registro vira o ETag: sem mudança, a resposta é 304.
     """
     try:
-        report = ValuationReport.objects.get(pk=pk, user=request.user)
-        
-        main_status = report.status
-        gamma_status = report.result_data.get('gamma_status')
-        gamma_url = report.gamma_presentation_url
-        
-        # O status principal (IA) foi concluído
-        if main_status == ValuationReport.StatusChoices.SUCCESS:
-            return JsonResponse({
-                "status": "SUCCESS",
-                "detail_url": reverse('reports:report_detail', kwargs={'pk': report.pk}),
-                # Informações do Gamma
-                "gamma_status": gamma_status,
-                "gamma_url": gamma_url
-            })
-        elif main_status == ValuationReport.StatusChoices.FAILED:
-             return JsonResponse({"status": "FAILED", "gamma_status": gamma_status})
+        record = get_status_record(pk)
+        if record and record[0] == request.user.pk:
+            _, payload, version = record
+        else:
+            report = ValuationReport.objects.only(
+                'id', 'user_id', 'status', 'gamma_status', 'gamma_presentation_url'
+            ).get(pk=pk, user=request.user)
+            payload, version = store_status_record(report)
+
+        if version is None:
+            return JsonResponse(payload)
+
+        etag = f'"{pk}-{version}"'
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
         else:
-            # A tarefa principal ainda está PENDING ou PROCESSING
-            return JsonResponse({"status": "PROCESSING", "gamma_status": "pending"})
-            
+            response = JsonResponse(payload)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
     except ValuationReport.DoesNotExist:
         return JsonResponse({"status": "NOT_FOUND"}, status=404)
     except Exception as e:
         logger.error(f"Erro em check_report_status_api: {e}")
-        return JsonResponse({"status": "ERROR"}, status=500)
\ No newline at end of file
+        return JsonResponse({"status": "ERROR"}, status=500)
+
+
+MAX_BATCH_STATUS_IDS = 100
+
+
+def _parse_report_ids(raw_ids):
+    """Converte '1,2,3' em [1, 2, 3]; levanta ValueError se inválido."""
+    report_ids = [int(i) for i in raw_ids.split(',') if i.strip()]
+    return list(dict.fromkeys(report_ids))
+
+
+@login_required
+def check_reports_status_batch_api(request):
+    """
+    Status de vários relatórios em uma única requisição ('?ids=1,2,3'),
+    para a página de histórico consultar todos os pendentes de uma vez.
+    """
+    try:
+        report_ids = _parse_report_ids(request.GET.get('ids', ''))
+    except ValueError:
+        return JsonResponse({"message": "Parâmetro 'ids' inválido."}, status=400)
+    if len(report_ids) > MAX_BATCH_STATUS_IDS:
+        return JsonResponse({"message": f"Máximo de {MAX_BATCH_STATUS_IDS} relatórios por consulta."}, status=400)
+
+    payloads = get_status_payloads(request.user, report_ids) if report_ids else {}
+    return JsonResponse({"reports": {str(report_id): payload for report_id, payload in payloads.items()}})
+
+
+@login_required
+def report_partial_api(request, pk):
+    """
+    Retorna os resultados parciais de um relatório em processamento
+    (cada etapa do pipeline e cada campo da IA são gravados assim que ficam
+    prontos), para a página de detalhe exibi-los antes da conclusão.
+    """
+    try:
+        report = ValuationReport.objects.only('status', 'result_data').get(pk=pk, user=request.user)
+    except ValuationReport.DoesNotExist:
+        return JsonResponse({"status": "NOT_FOUND"}, status=404)
+
+    return JsonResponse(build_partial_payload(report))
+
+
+@login_required
+def report_what_if_api(request, pk):
+    """
+    Simulação "e se" de um relatório: quanto o valuation_base muda para cada
+    resposta possível de cada critério e para faixas de cada input financeiro.
+
+    Somente leitura e síncrona: um único cálculo vetorizado (chatbot.engine),
+    sem Celery, sem IA e sem contar uso. Parâmetros na query string (ex:
+    '?pmf=ALTO&faturamento_mensal=80000') substituem os inputs do relatório,
+    para a interface montar sliders ao vivo.
+    """
+    started = time.perf_counter()
+    try:
+        report = ValuationReport.objects.only('id', 'user_id', 'inputs_data', 'scoring_version').get(pk=pk, user=request.user)
+    except ValuationReport.DoesNotExist:
+        return JsonResponse({"status": "NOT_FOUND"}, status=404)
+
+    # Mesmas tabelas que precificaram o relatório, para o delta ser comparável
+    try:
+        tables = get_tables(report.scoring_version) if report.scoring_version else get_active_tables()
+    except ValueError:
+        tables = get_active_tables()
+
+    inputs = dict(report.inputs_data or {})
+    for key, value in request.GET.items():
+        if key in FINANCIAL_FIELDS:
+            try:
+                inputs[key] = float(value)
+            except ValueError:
+                return JsonResponse({"message": f"Valor inválido para {key}."}, status=400)
+            if inputs[key] < 0:
+                return JsonResponse({"message": f"{key} não pode ser negativo."}, status=400)
+        elif key in tables.weights_map:
+            if value not in tables.score_map:
+                return JsonResponse({"message": f"Resposta inválida para {key}."}, status=400)
+            inputs[key] = value
+
+    result = what_if(inputs, tables)
+    for crit_id, item in result["criterios"].items():
+        item["label"] = criterio_label(crit_id)
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    response = JsonResponse({"report_id": report.id, "scoring_version": tables.version, **result})
+    response['Server-Timing'] = f'what-if;dur={elapsed_ms:.1f}'
+    return response
+
+
+# --- STREAM SSE DE STATUS (servido via ASGI) ---
+
+SSE_KEEPALIVE_SECONDS = 15
+
+
+@login_required
+async def report_status_stream(request):
+    """
+    Server-Sent Events com as mudanças de status (e resultados parciais) dos
+    relatórios do usuário, publicadas pelas tarefas Celery via Redis pub/sub.
+    Uma aba aberta mantém só uma conexão ociosa, sem polling.
+
+    '?ids=1,2,3' envia logo ao conectar o status atual desses relatórios,
+    cobrindo mudanças ocorridas entre o render da página e a inscrição.
+    """
+    user = await request.auser()
+    try:
+        report_ids = _parse_report_ids(request.GET.get('ids', ''))[:MAX_BATCH_STATUS_IDS]
+    except ValueError:
+        return JsonResponse({"message": "Parâmetro 'ids' inválido."}, status=400)
+
+    async def event_stream():
+        pubsub = get_async_redis().pubsub()
+        await pubsub.subscribe(user_channel(user.pk))
+        try:
+            yield "retry: 5000\n\n"
+            if report_ids:
+                snapshot = await sync_to_async(get_status_payloads)(user, report_ids)
+                for payload in snapshot.values():
+                    yield f"event: status\ndata: {json.dumps(payload)}\n\n"
+
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=SSE_KEEPALIVE_SECONDS)
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                event = json.loads(message['data'])
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # Evita buffer em proxies (nginx/Render)
+    return response
\ No newline at end of file
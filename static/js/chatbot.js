@@ -9,6 +9,17 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // --- Estado do Chat (NOVAS PERGUNTAS) ---
     let currentQuestionIndex = 0;
+    // Chave de idempotência da simulação atual: a mesma em cliques repetidos e
+    // em "Tentar Calcular Novamente", nova só ao iniciar outra simulação
+    let submissionKey = null;
+    const MAX_IN_PROGRESS_RETRIES = 5;
+
+    function newSubmissionKey() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    }
     const qualitativeAnswers = ["BAIXO", "NÃO CONSIGO AVALIAR", "MÉDIO", "ALTO", "ELEVADO"];
 
     const questions = [
@@ -70,6 +81,31 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // Função para limpar botões de resposta anteriores
+    function formatBRL(value) {
+        return Number(value).toLocaleString('pt-BR', { style: 'currency', currency: 'BRL' });
+    }
+
+    // Resumo com os números que a API já devolve calculados (planilha)
+    function buildResultSummary(body) {
+        if (body.valuation_base === undefined) {
+            return '';
+        }
+        const ind = body.indicadores;
+        const fortes = (body.pontos_fortes || []).map(p => `<li>${p.criterio} (${p.valor})</li>`).join('');
+        return `
+            <div class="card border-0 bg-light mt-2">
+                <div class="card-body small">
+                    <div class="text-muted">Valuation (cenário realista)</div>
+                    <div class="fs-4 fw-bold text-primary mb-2">${formatBRL(body.valuation_base)}</div>
+                    <div>Faturamento anual: <strong>${formatBRL(ind.faturamento_anual)}</strong></div>
+                    <div>Margem de contribuição: <strong>${(ind.margem_contribuicao_perc * 100).toFixed(1)}%</strong></div>
+                    <div>Ticket médio: <strong>${formatBRL(ind.ticket_medio)}</strong></div>
+                    <div>Ponto de equilíbrio: <strong>${formatBRL(ind.ponto_equilibrio)}</strong></div>
+                    ${fortes ? `<div class="mt-2">Pontos fortes:</div><ul class="mb-0">${fortes}</ul>` : ''}
+                </div>
+            </div>`;
+    }
+
     function clearResponseButtons() {
         const existingButtons = chatWindow.querySelectorAll('.response-buttons');
         existingButtons.forEach(btnGroup => btnGroup.remove());
@@ -189,19 +225,37 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // --- Lógica da API (COM A MUDANÇA) ---
     calculateBtn.addEventListener('click', () => {
+        if (calculateBtn.disabled) {
+            return;
+        }
+        if (!submissionKey) {
+            submissionKey = newSubmissionKey();
+        }
         calculateBtn.disabled = true;
         calculateBtn.innerHTML = `<span class="spinner-border spinner-border-sm" role="status" aria-hidden="true"></span> Processando...`;
         apiFeedback.innerHTML = '<div class="alert alert-info small">Iniciando análise... Isso pode levar algum tempo.</div>';
 
-        fetch('/chatbot/api/calculate/', {
+        // 409 com retry_after: envio idêntico ainda sendo registrado. Reenvia com a
+        // mesma Idempotency-Key, que devolve o relatório assim que ele existir.
+        const postCalculation = (attempt = 0) => fetch('/chatbot/api/calculate/', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Idempotency-Key': submissionKey,
                 // 'X-CSRFToken': getCookie('csrftoken')
             },
             body: JSON.stringify({ inputs: chatInputs })
         })
         .then(response => response.json().then(data => ({ status: response.status, body: data })))
+        .then(result => {
+            if (result.status === 409 && result.body.retry_after && attempt < MAX_IN_PROGRESS_RETRIES) {
+                return new Promise(resolve => setTimeout(resolve, result.body.retry_after * 1000))
+                    .then(() => postCalculation(attempt + 1));
+            }
+            return result;
+        });
+
+        postCalculation()
         .then(({ status, body }) => {
             if (status === 200) {
                 apiFeedback.innerHTML = `
@@ -211,14 +265,30 @@ document.addEventListener('DOMContentLoaded', () => {
                     </div>`;
                 
                 // --- MUDANÇA AQUI ---
-                // Não reiniciamos as perguntas. Mostramos os botões.
+                // Não reiniciamos as perguntas. Mostramos os números e os botões.
                 chatWindow.innerHTML = ''; // Limpa as perguntas
                 addChatMessage("Sua análise foi iniciada! Você pode acompanhar o progresso no seu histórico ou iniciar uma nova simulação.");
+
+                const summary = buildResultSummary(body);
+                if (summary) {
+                    const summaryEl = document.createElement('div');
+                    summaryEl.innerHTML = summary;
+                    chatWindow.appendChild(summaryEl);
+                }
                 
                 // Cria o grupo de botões
                 const buttonGroup = document.createElement('div');
                 buttonGroup.className = 'response-buttons d-flex flex-wrap justify-content-center p-2';
 
+                // Botão 0: Acompanhar o relatório (a análise da IA chega ao vivo na página)
+                if (body.detail_url) {
+                    const detailBtn = document.createElement('a');
+                    detailBtn.href = body.detail_url;
+                    detailBtn.className = 'btn btn-success m-1';
+                    detailBtn.innerHTML = '<i class="bi bi-graph-up-arrow me-2"></i> Ver Relatório';
+                    buttonGroup.appendChild(detailBtn);
+                }
+
                 // Botão 1: Ir para o Histórico
                 const historyBtn = document.createElement('a');
                 historyBtn.href = '/reports/history/'; // URL Hardcoded
@@ -234,6 +304,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     // Reseta tudo para começar de novo
                     Object.keys(chatInputs).forEach(key => { delete chatInputs[key]; });
                     currentQuestionIndex = 0;
+                    submissionKey = null;
                     chatWindow.innerHTML = '';
                     apiFeedback.innerHTML = ''; // Limpa o alerta de sucesso
                     calculateBtn.disabled = true;
@@ -3,7 +3,8 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from .forms import CustomUserCreationForm
-from .models import CustomUser
+from django.utils import timezone
+from .models import CustomUser, OutboxEmail
 
 class CustomUserAdmin(UserAdmin):
     # Usa o nosso formulário customizado para a página "Adicionar utilizador"
@@ -54,3 +55,34 @@ class CustomUserAdmin(UserAdmin):
 
 # Registra o modelo CustomUser com a configuração CustomUserAdmin
 admin.site.register(CustomUser, CustomUserAdmin)
+
+
+
+# --- Caixa de saída de emails (somente leitura + reenvio) ---
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'subject', 'to', 'status', 'attempts', 'created_at', 'sent_at', 'delivery_time')
+    list_filter = ('status', 'kind', 'created_at')
+    search_fields = ('subject', 'to')
+    ordering = ('-created_at',)
+    readonly_fields = (
+        'kind', 'subject', 'to', 'from_email', 'body', 'html_body', 'status', 'attempts',
+        'last_error', 'available_at', 'claimed_at', 'created_at', 'sent_at'
+    )
+    actions = ['requeue']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description="Tempo até envio")
+    def delivery_time(self, obj):
+        if obj.sent_at:
+            return f"{(obj.sent_at - obj.created_at).total_seconds():.1f}s"
+        return "-"
+
+    @admin.action(description="Reenviar (volta para a fila)")
+    def requeue(self, request, queryset):
+        updated = queryset.exclude(status=OutboxEmail.StatusChoices.SENDING).update(
+            status=OutboxEmail.StatusChoices.PENDING, attempts=0, available_at=timezone.now(), last_error=''
+        )
+        self.message_user(request, f"{updated} emails voltaram para a fila.")
@@ -1,6 +1,8 @@
 # apps/users/forms.py
 from django import forms
-from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
+from django.contrib.auth.forms import UserCreationForm, AuthenticationForm, PasswordResetForm
+from django.template import loader
+from .outbox import queue_email
 from .models import CustomUser
 import re
 
@@ -63,4 +65,19 @@ class UserProfileUpdateForm(forms.ModelForm):
         )
         
         # Reordena os campos
-        self.order_fields(['cnpj', 'razao_social', 'email', 'ddd', 'telefone'])
\ No newline at end of file
+        self.order_fields(['cnpj', 'razao_social', 'email', 'ddd', 'telefone'])
+
+
+class CustomPasswordResetForm(PasswordResetForm):
+    """
+    Igual ao do Django, mas o email vai para a caixa de saída (users.outbox)
+    em vez de ser enviado por SMTP dentro da requisição.
+    """
+    def send_mail(self, subject_template_name, email_template_name, context,
+                  from_email, to_email, html_email_template_name=None):
+        subject = loader.render_to_string(subject_template_name, context)
+        # O assunto não pode ter quebras de linha
+        subject = ''.join(subject.splitlines())
+        body = loader.render_to_string(email_template_name, context)
+        html_body = loader.render_to_string(html_email_template_name, context) if html_email_template_name else ''
+        queue_email(subject, body, to_email, html_body=html_body, from_email=from_email, kind='password_reset', send_now=True)
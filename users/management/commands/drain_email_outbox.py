@@ -0,0 +1,22 @@
+# users/management/commands/drain_email_outbox.py
+from django.core.management.base import BaseCommand
+
+from users.outbox import drain_outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Envia agora os emails pendentes da caixa de saída (o mesmo que a tarefa "
+        "periódica drain_email_outbox). Útil para testar com EMAIL_BACKEND locmem/console "
+        "ou um SMTP local (EMAIL_HOST=localhost EMAIL_PORT=1025 EMAIL_USE_TLS=False)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help="Emails por lote (padrão: EMAIL_OUTBOX_BATCH_SIZE).")
+        parser.add_argument('--max-batches', type=int, help="Máximo de lotes nesta execução (padrão: EMAIL_OUTBOX_MAX_BATCHES).")
+
+    def handle(self, *args, **options):
+        summary = drain_outbox(batch_size=options['batch_size'], max_batches=options['max_batches'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{summary['sent']} enviados, {summary['retried']} reagendados, {summary['failed']} com falha definitiva."
+        ))
@@ -3,6 +3,7 @@ import re
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 
 # --- Validador de CNPJ (Simples) ---
 # Em produção, use uma biblioteca como "validate-docbr"
@@ -117,4 +118,44 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     REQUIRED_FIELDS = ['email', 'razao_social']
 
     def __str__(self):
-        return f"{self.razao_social} ({self.cnpj})"
\ No newline at end of file
+        return f"{self.razao_social} ({self.cnpj})"
+
+# --- Caixa de saída de emails ---
+class OutboxEmail(models.Model):
+    """
+    Email aguardando envio. As tarefas e views só gravam aqui; a tarefa
+    periódica 'users.tasks.drain_email_outbox' envia em lotes por uma única
+    conexão SMTP, registrando o resultado e reagendando falhas.
+    """
+    class StatusChoices(models.TextChoices):
+        PENDING = 'PENDING', 'Pendente'
+        SENDING = 'SENDING', 'Enviando'
+        SENT = 'SENT', 'Enviado'
+        FAILED = 'FAILED', 'Falha'
+
+    kind = models.CharField(max_length=50, blank=True, help_text="Tipo do email (ex: 'gamma_report'), para métricas e filtros")
+    subject = models.CharField(max_length=255)
+    body = models.TextField(help_text="Corpo em texto puro")
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.JSONField(help_text="Lista de destinatários")
+
+    status = models.CharField(max_length=20, choices=StatusChoices.choices, default=StatusChoices.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # Próxima tentativa (backoff após falha) e quando um drenador pegou a mensagem
+    available_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Drenagem: WHERE status = 'PENDING' AND available_at <= now ORDER BY id
+            models.Index(fields=['status', 'available_at'], name='outbox_status_available_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind or 'email'} para {', '.join(self.to)} ({self.get_status_display()})"
@@ -0,0 +1,209 @@
+# users/outbox.py
+"""
+Caixa de saída de emails (users.models.OutboxEmail).
+
+Quem precisa mandar um email chama queue_email(), que só grava uma linha.
+drain_outbox() — rodada pela tarefa periódica 'users.tasks.drain_email_outbox'
+e pelo comando 'drain_email_outbox' — pega lotes de pendentes e envia todos
+por uma única conexão do EMAIL_BACKEND: um handshake TLS por drenagem em vez
+de um por email. Cada mensagem tem status próprio; falhas voltam para a fila
+com backoff exponencial até EMAIL_OUTBOX_MAX_ATTEMPTS.
+
+Emails transacionais (ativação, redefinição de senha) usam send_now=True:
+após o commit, uma drenagem é disparada no Celery na hora, sem esperar o beat;
+a view só paga o INSERT. Com EMAIL_OUTBOX_SEND_INLINE=True (testes) a
+drenagem roda no próprio processo.
+
+Funciona com qualquer backend do Django: em teste, EMAIL_BACKEND=locmem
+(mensagens em django.core.mail.outbox) ou um SMTP local via EMAIL_HOST/EMAIL_PORT.
+
+Métricas: cada drenagem registra no log o tempo médio/máximo na fila
+(criação -> início do envio) e de envio (send_messages) por mensagem.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+# Mensagem em SENDING há mais que isso: o drenador morreu no meio, volta para a fila
+CLAIM_TIMEOUT = timedelta(minutes=10)
+MAX_RETRY_DELAY_SECONDS = 3600
+STATUS_FIELDS = ['status', 'attempts', 'last_error', 'available_at', 'claimed_at', 'sent_at']
+
+
+def queue_email(subject, body, to, html_body='', from_email=None, kind='', send_now=False):
+    """
+    Grava um email na caixa de saída. 'to' é um endereço ou uma lista.
+    send_now=True dispara a drenagem logo após o commit (emails que o usuário está esperando).
+    """
+    email = OutboxEmail.objects.create(
+        kind=kind,
+        subject=subject,
+        body=body,
+        html_body=html_body or '',
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL or '',
+        to=[to] if isinstance(to, str) else list(to),
+    )
+    logger.info(f"Email '{kind or subject}' para {email.to} enfileirado na caixa de saída (#{email.id})")
+    if send_now:
+        transaction.on_commit(dispatch_drain)
+    return email
+
+
+def dispatch_drain():
+    """Pede uma drenagem agora: no Celery ou, com EMAIL_OUTBOX_SEND_INLINE, neste processo."""
+    if settings.EMAIL_OUTBOX_SEND_INLINE:
+        drain_outbox()
+        return
+    try:
+        from .tasks import drain_email_outbox
+        drain_email_outbox.delay()
+    except Exception as e:
+        # Sem broker o email continua na fila e sai na próxima drenagem periódica
+        logger.warning(f"Não foi possível disparar a drenagem da caixa de saída: {e}")
+
+
+def _claim_batch(batch_size):
+    """Marca até batch_size pendentes como SENDING; drenadores concorrentes pulam as linhas travadas."""
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxEmail.StatusChoices.PENDING, available_at__lte=now)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if ids:
+            OutboxEmail.objects.filter(id__in=ids).update(status=OutboxEmail.StatusChoices.SENDING, claimed_at=now)
+    return list(OutboxEmail.objects.filter(id__in=ids).order_by('id')) if ids else []
+
+
+def _build_message(email, connection):
+    msg = EmailMultiAlternatives(
+        email.subject, email.body, email.from_email or settings.DEFAULT_FROM_EMAIL, email.to, connection=connection
+    )
+    if email.html_body:
+        msg.attach_alternative(email.html_body, "text/html")
+    return msg
+
+
+def _mark_sent(email):
+    email.status = OutboxEmail.StatusChoices.SENT
+    email.attempts += 1
+    email.last_error = ''
+    email.sent_at = timezone.now()
+    email.claimed_at = None
+
+
+def _mark_failed(email, error, summary):
+    """Reagenda com backoff exponencial; desiste após EMAIL_OUTBOX_MAX_ATTEMPTS."""
+    email.attempts += 1
+    email.last_error = str(error)[:2000]
+    email.claimed_at = None
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboxEmail.StatusChoices.FAILED
+        summary["failed"] += 1
+        logger.error(f"Email #{email.id} para {email.to} falhou {email.attempts} vezes. Desistindo: {error}")
+        return
+    delay = min(settings.EMAIL_OUTBOX_RETRY_SECONDS * 2 ** (email.attempts - 1), MAX_RETRY_DELAY_SECONDS)
+    email.status = OutboxEmail.StatusChoices.PENDING
+    email.available_at = timezone.now() + timedelta(seconds=delay)
+    summary["retried"] += 1
+    logger.warning(f"Falha ao enviar email #{email.id} (tentativa {email.attempts}). Nova tentativa em {delay}s: {error}")
+
+
+def _record_timing(summary, name, seconds):
+    summary[f"{name}_count"] += 1
+    summary[f"{name}_seconds_total"] += seconds
+    summary[f"{name}_seconds_max"] = max(summary[f"{name}_seconds_max"], seconds)
+
+
+def _send_batch(emails, connection, summary):
+    """Envia o lote pela conexão aberta. Retorna False se a conexão caiu e não pôde ser reaberta."""
+    connection_ok = True
+    for email in emails:
+        if not connection_ok:
+            _mark_failed(email, "Conexão com o servidor de email indisponível", summary)
+            continue
+        _record_timing(summary, "queue", (timezone.now() - email.created_at).total_seconds())
+        started = time.monotonic()
+        try:
+            if connection.send_messages([_build_message(email, connection)]) != 1:
+                raise RuntimeError("O servidor não aceitou a mensagem")
+            _record_timing(summary, "send", time.monotonic() - started)
+            _mark_sent(email)
+            summary["sent"] += 1
+        except Exception as e:
+            _mark_failed(email, e, summary)
+            # O erro pode ter derrubado a sessão SMTP: reabre antes da próxima mensagem
+            try:
+                connection.close()
+                connection.open()
+            except Exception as e_conn:
+                logger.error(f"Não foi possível reabrir a conexão de email: {e_conn}")
+                connection_ok = False
+
+    OutboxEmail.objects.bulk_update(emails, STATUS_FIELDS)
+    return connection_ok
+
+
+def drain_outbox(batch_size=None, max_batches=None):
+    """
+    Envia os emails pendentes em lotes de batch_size, no máximo max_batches
+    lotes por chamada, todos pela mesma conexão. Retorna um resumo com as contagens.
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    max_batches = max_batches or settings.EMAIL_OUTBOX_MAX_BATCHES
+    summary = {
+        "sent": 0, "retried": 0, "failed": 0,
+        "queue_count": 0, "queue_seconds_total": 0.0, "queue_seconds_max": 0.0,
+        "send_count": 0, "send_seconds_total": 0.0, "send_seconds_max": 0.0,
+    }
+    started = time.monotonic()
+
+    stale = OutboxEmail.objects.filter(
+        status=OutboxEmail.StatusChoices.SENDING, claimed_at__lt=timezone.now() - CLAIM_TIMEOUT
+    ).update(status=OutboxEmail.StatusChoices.PENDING, claimed_at=None)
+    if stale:
+        logger.warning(f"{stale} emails presos em SENDING voltaram para a fila.")
+
+    connection = None
+    try:
+        for _ in range(max_batches):
+            emails = _claim_batch(batch_size)
+            if not emails:
+                break
+            if connection is None:
+                connection = get_connection()
+                try:
+                    connection.open()
+                except Exception as e:
+                    logger.error(f"Não foi possível abrir a conexão de email: {e}")
+                    for email in emails:
+                        _mark_failed(email, e, summary)
+                    OutboxEmail.objects.bulk_update(emails, STATUS_FIELDS)
+                    connection = None
+                    break
+            if not _send_batch(emails, connection, summary):
+                break
+    finally:
+        if connection is not None:
+            connection.close()
+
+    if summary["sent"] + summary["retried"] + summary["failed"]:
+        logger.info(
+            f"Caixa de saída drenada em {time.monotonic() - started:.2f}s: "
+            f"{summary['sent']} enviados, {summary['retried']} reagendados, {summary['failed']} com falha definitiva. "
+            f"Fila: média {summary['queue_seconds_total'] / max(summary['queue_count'], 1):.2f}s, máx {summary['queue_seconds_max']:.2f}s. "
+            f"Envio: média {summary['send_seconds_total'] / max(summary['send_count'], 1) * 1000:.0f}ms, "
+            f"máx {summary['send_seconds_max'] * 1000:.0f}ms."
+        )
+    return summary
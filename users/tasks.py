@@ -0,0 +1,10 @@
+# users/tasks.py
+from celery import shared_task
+
+from .outbox import drain_outbox
+
+
+@shared_task
+def drain_email_outbox():
+    """Periódica (CELERY_BEAT_SCHEDULE): envia os emails pendentes da caixa de saída."""
+    return drain_outbox()
@@ -1,3 +1,139 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from valuation.testing import make_user
+from . import outbox, views
+from .models import OutboxEmail
+from .outbox import drain_outbox, queue_email
+from .tasks import drain_email_outbox
+
+
+class FailingEmailBackend(EmailBackend):
+    """Backend locmem que recusa qualquer mensagem endereçada a 'falha@...'."""
+
+    def send_messages(self, messages):
+        if any(address.startswith('falha@') for message in messages for address in message.to):
+            raise ConnectionError("SMTP recusou")
+        return super().send_messages(messages)
+
+
+# --- caixa de saída de emails com conexão única ---
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    EMAIL_OUTBOX_SEND_INLINE=False,
+    EMAIL_OUTBOX_MAX_ATTEMPTS=3,
+    EMAIL_OUTBOX_RETRY_SECONDS=60,
+)
+class OutboxTests(TestCase):
+
+    def test_queue_only_stores_the_email(self):
+        email = queue_email('Assunto', 'Corpo', 'a@example.com', html_body='<p>Corpo</p>', kind='teste')
+        self.assertEqual(email.to, ['a@example.com'])
+        self.assertEqual(email.status, OutboxEmail.StatusChoices.PENDING)
+        self.assertEqual(mail.outbox, [])
+
+    def test_drain_sends_every_pending_email_over_one_connection(self):
+        for i in range(5):
+            queue_email(f'Assunto {i}', 'Corpo', [f'{i}@example.com'], html_body='<p>Corpo</p>')
+        with mock.patch.object(outbox, 'get_connection', wraps=outbox.get_connection) as get_connection:
+            summary = drain_outbox(batch_size=2)
+
+        get_connection.assert_called_once()
+        self.assertEqual(summary['sent'], 5)
+        self.assertEqual([m.subject for m in mail.outbox], [f'Assunto {i}' for i in range(5)])
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        self.assertFalse(OutboxEmail.objects.exclude(status=OutboxEmail.StatusChoices.SENT).exists())
+        self.assertEqual(drain_outbox()['sent'], 0)
+
+    def test_max_batches_limits_one_drain(self):
+        for i in range(5):
+            queue_email('Assunto', 'Corpo', f'{i}@example.com')
+        self.assertEqual(drain_outbox(batch_size=2, max_batches=1)['sent'], 2)
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.StatusChoices.PENDING).count(), 3)
+
+    @override_settings(EMAIL_BACKEND='users.tests.FailingEmailBackend')
+    def test_failure_is_retried_with_backoff_without_blocking_the_batch(self):
+        failing = queue_email('Falha', 'Corpo', 'falha@example.com')
+        queue_email('Ok', 'Corpo', 'ok@example.com')
+
+        summary = drain_outbox()
+        self.assertEqual((summary['sent'], summary['retried']), (1, 1))
+        self.assertEqual([m.subject for m in mail.outbox], ['Ok'])
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, OutboxEmail.StatusChoices.PENDING)
+        self.assertEqual(failing.attempts, 1)
+        self.assertIn('SMTP recusou', failing.last_error)
+        self.assertGreater(failing.available_at, timezone.now() + timedelta(seconds=50))
+        # Ainda no backoff: a próxima drenagem não pega a mensagem
+        self.assertEqual(drain_outbox()['retried'], 0)
+
+    @override_settings(EMAIL_BACKEND='users.tests.FailingEmailBackend')
+    def test_gives_up_after_max_attempts(self):
+        failing = queue_email('Falha', 'Corpo', 'falha@example.com')
+        for _ in range(3):
+            OutboxEmail.objects.filter(id=failing.id).update(available_at=timezone.now())
+            drain_outbox()
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, OutboxEmail.StatusChoices.FAILED)
+        self.assertEqual(failing.attempts, 3)
+
+    def test_stale_sending_email_goes_back_to_the_queue(self):
+        email = queue_email('Assunto', 'Corpo', 'a@example.com')
+        OutboxEmail.objects.filter(id=email.id).update(
+            status=OutboxEmail.StatusChoices.SENDING, claimed_at=timezone.now() - outbox.CLAIM_TIMEOUT * 2
+        )
+        self.assertEqual(drain_outbox()['sent'], 1)
+
+    @override_settings(EMAIL_OUTBOX_SEND_INLINE=True)
+    def test_send_now_drains_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_email('Ativação', 'Corpo', 'a@example.com', send_now=True)
+            self.assertEqual(mail.outbox, [])
+        self.assertEqual([m.subject for m in mail.outbox], ['Ativação'])
+
+
+# --- emails transacionais pela caixa de saída ---
+
+# O cadastro público está desativado em users/urls.py; o link de ativação só existe nesta URLconf de teste
+urlpatterns = [
+    path('users/', include(([path('confirm/<uidb64>/<token>/', views.activate, name='activate')], 'users'))),
+]
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_OUTBOX_SEND_INLINE=False)
+class TransactionalEmailTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user()
+
+    def test_password_reset_queues_instead_of_sending(self):
+        with mock.patch.object(drain_email_outbox, 'delay') as drain:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('users:password_reset'), {'email': self.user.email})
+
+        self.assertRedirects(response, reverse('users:password_reset_done'), fetch_redirect_response=False)
+        self.assertEqual(mail.outbox, [])
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.kind, email.to, email.status), ('password_reset', [self.user.email], 'PENDING'))
+        self.assertNotIn('\n', email.subject)
+        drain.assert_called_once_with()
+
+    @override_settings(ROOT_URLCONF='users.tests')
+    def test_activation_email_is_queued_with_the_activation_link(self):
+        request = RequestFactory().get('/')
+        with mock.patch.object(drain_email_outbox, 'delay') as drain:
+            with self.captureOnCommitCallbacks(execute=True):
+                views.send_activation_email(request, self.user)
+
+        self.assertEqual(mail.outbox, [])
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.kind, email.to), ('account_activation', [self.user.email]))
+        self.assertIn('/users/confirm/', email.body)
+        self.assertTrue(email.html_body)
+        drain.assert_called_once_with()
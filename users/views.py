@@ -8,7 +8,6 @@ from django.contrib.auth.decorators import login_required
 from django.views.generic import TemplateView
 
 # Importações para envio de email e tokens
-from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
 from django.contrib.sites.shortcuts import get_current_site
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
@@ -20,9 +19,11 @@ import logging # Adicionado logging
 from .forms import (
     CustomUserCreationForm,
     CustomAuthenticationForm,
+    CustomPasswordResetForm,
     UserProfileUpdateForm
 )
 from .models import CustomUser
+from .outbox import queue_email
 from .tokens import account_activation_token
 
 # Configura o logger
@@ -53,14 +54,13 @@ def send_activation_email(request, user):
     from_email = settings.DEFAULT_FROM_EMAIL
     to_email = user.email
 
+    # Só grava na caixa de saída: o envio SMTP acontece no worker (users.outbox),
+    # então um servidor de email lento não segura a requisição
     try:
-        msg = EmailMultiAlternatives(subject, plain_message, from_email, [to_email])
-        msg.attach_alternative(html_message, "text/html")
-        msg.send()
-        logger.info(f"E-mail de ativação enviado para {to_email}")
+        queue_email(subject, plain_message, to_email, html_body=html_message, from_email=from_email,
+                    kind='account_activation', send_now=True)
     except Exception as e:
-        logger.error(f"Erro ao enviar e-mail de ativação para {to_email}: {e}")
-        # Considerar como lidar com falha no envio (ex: logar erro crítico)
+        logger.error(f"Erro ao enfileirar e-mail de ativação para {to_email}: {e}")
 
 
 # --- RegisterView (VERSÃO CORRETA COM ATIVAÇÃO POR EMAIL) ---
@@ -134,8 +134,10 @@ class CustomLoginView(auth_views.LoginView):
         return super().form_valid(form)
 
 
-# --- Views de Recuperação de Senha (Sem mudanças, apenas checando imports) ---
+# --- Views de Recuperação de Senha ---
 class CustomPasswordResetView(auth_views.PasswordResetView):
+    # O formulário enfileira o email na caixa de saída em vez de enviá-lo na requisição
+    form_class = CustomPasswordResetForm
     template_name = 'users/password_reset_form.html'
     email_template_name = 'users/password_reset_email.html'
     subject_template_name = 'users/password_reset_subject.txt'
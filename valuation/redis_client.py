@@ -0,0 +1,47 @@
+# valuation/redis_client.py
+import redis
+import redis.asyncio
+from django.conf import settings
+
+_client = None
+
+
+def get_redis():
+    """
+    Cliente Redis compartilhado pelo processo (o pool de conexões interno
+    do redis-py é reutilizado entre chamadas).
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _client
+
+
+_cache_client = None
+
+
+def get_cache_redis():
+    """
+    Cliente do Redis do cache de análises (GEMINI_CACHE_REDIS_URL). Quando a
+    URL é a mesma do REDIS_URL, reaproveita o cliente compartilhado.
+    """
+    global _cache_client
+    if settings.GEMINI_CACHE_REDIS_URL == settings.REDIS_URL:
+        return get_redis()
+    if _cache_client is None:
+        _cache_client = redis.Redis.from_url(settings.GEMINI_CACHE_REDIS_URL, decode_responses=True)
+    return _cache_client
+
+
+_async_client = None
+
+
+def get_async_redis():
+    """
+    Cliente Redis assíncrono (redis.asyncio) para as views ASGI, como o
+    stream SSE de status. Um por processo, ligado ao event loop do servidor.
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = redis.asyncio.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _async_client
@@ -12,6 +12,10 @@ load_dotenv(BASE_DIR / '.env')
 
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 GAMMA_API_KEY = os.environ.get('GAMMA_API_KEY')
+GAMMA_API_BASE_URL = os.environ.get('GAMMA_API_BASE_URL', 'https://public-api.gamma.app/v0.2').rstrip('/')
+# 'task': cada geração é acompanhada por tarefas Celery curtas (poll_gamma_generation)
+# 'service': um único processo assíncrono (manage.py run_gamma_poller) acompanha todas
+GAMMA_POLL_MODE = os.environ.get('GAMMA_POLL_MODE', 'task')
 SECRET_KEY = os.environ.get('SECRET_KEY')
 DEBUG = os.environ.get('DEBUG', 'False') == 'True'
 CSRF_TRUSTED_ORIGINS = os.environ.get('DJANGO_CSRF_TRUSTED_ORIGINS', 'http://localhost:8000').split(',')
@@ -117,10 +121,103 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'America/Sao_Paulo'
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
-EMAIL_HOST = 'smtp.gmail.com'
-EMAIL_PORT = 587
-EMAIL_USE_TLS = True
+# Redis de uso geral (caches, contadores). Por padrão o mesmo do broker.
+REDIS_URL = os.environ.get('REDIS_URL', CELERY_BROKER_URL)
+# Cache de análises do Gemini: de preferência um Redis próprio com política de
+# despejo (allkeys-lru). Sem ele, usa o REDIS_URL, que roda com 'noeviction'.
+GEMINI_CACHE_REDIS_URL = os.environ.get('GEMINI_CACHE_REDIS_URL', REDIS_URL)
+GEMINI_CACHE_TTL_SECONDS = int(os.environ.get('GEMINI_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+# Lê a resposta da IA em streaming e grava cada campo no report assim que fica pronto
+GEMINI_STREAMING = os.environ.get('GEMINI_STREAMING', 'True') == 'True'
+
+# Tabelas de pontuação (chatbot/scoring.py): intervalo entre checagens do carimbo de
+# versão no Redis e, com o Redis fora, entre recargas direto do banco.
+SCORING_STAMP_CHECK_SECONDS = float(os.environ.get('SCORING_STAMP_CHECK_SECONDS', 5))
+SCORING_DB_FALLBACK_SECONDS = float(os.environ.get('SCORING_DB_FALLBACK_SECONDS', 60))
+
+# Token bucket compartilhado (chatbot/rate_limit.py): 'rate' em tokens por segundo,
+# 'capacity' é o tamanho máximo de rajada. Um balde por provedor e por API key.
+RATE_LIMITS = {
+    'gemini': {
+        'rate': float(os.environ.get('GEMINI_REQUESTS_PER_MINUTE', 10)) / 60,
+        'capacity': int(os.environ.get('GEMINI_BURST', 5)),
+    },
+    'gamma': {
+        'rate': float(os.environ.get('GAMMA_REQUESTS_PER_MINUTE', 30)) / 60,
+        'capacity': int(os.environ.get('GAMMA_BURST', 10)),
+    },
+}
+# Quantas vezes uma tarefa pode ser re-agendada por falta de token antes de desistir
+RATE_LIMIT_MAX_DEFERRALS = int(os.environ.get('RATE_LIMIT_MAX_DEFERRALS', 50))
+
+# Filas do pipeline de valuation: cálculos baratos de CPU na 'fast' e chamadas
+# de I/O (Gemini, Gamma, SMTP) na 'io'. O worker padrão consome as duas
+# (ver Dockerfile.worker); em produção podem ser workers separados.
+CELERY_TASK_ROUTES = {
+    'chatbot.tasks.process_valuation_request': {'queue': 'fast'},
+    'chatbot.tasks.calculate_valuation': {'queue': 'fast'},
+    'chatbot.tasks.finalize_valuation': {'queue': 'fast'},
+    'chatbot.tasks.analyse_valuation': {'queue': 'io'},
+    'chatbot.tasks.present_valuation': {'queue': 'io'},
+    'chatbot.tasks.generate_gamma_presentation': {'queue': 'io'},
+    'chatbot.tasks.poll_gamma_generation': {'queue': 'io'},
+    'chatbot.tasks.send_gamma_report_email': {'queue': 'io'},
+    'users.tasks.drain_email_outbox': {'queue': 'io'},
+    'chatbot.tasks.reconcile_usage_quotas': {'queue': 'fast'},
+    'chatbot.tasks.start_valuation_batch': {'queue': 'fast'},
+    'chatbot.tasks.dispatch_valuation_batch': {'queue': 'fast'},
+}
+
+# Envio em lote (chatbot/batch.py): limites do arquivo e quantos reports do mesmo
+# lote podem estar em PROCESSING ao mesmo tempo (o despacho roda a cada DISPATCH_SECONDS)
+VALUATION_BATCH_MAX_ROWS = int(os.environ.get('VALUATION_BATCH_MAX_ROWS', 500))
+VALUATION_BATCH_MAX_BYTES = int(os.environ.get('VALUATION_BATCH_MAX_BYTES', 5 * 1024 * 1024))
+VALUATION_BATCH_MAX_IN_FLIGHT = int(os.environ.get('VALUATION_BATCH_MAX_IN_FLIGHT', 10))
+VALUATION_BATCH_DISPATCH_SECONDS = int(os.environ.get('VALUATION_BATCH_DISPATCH_SECONDS', 15))
+
+# Cota de simulações (chatbot/quota.py): uma reserva sem confirmação expira após
+# RESERVATION_TTL; o espelho dos usos no Redis é recriado do banco após KEY_TTL,
+# e a reconciliação periódica roda a cada RECONCILE_SECONDS.
+QUOTA_RESERVATION_TTL_SECONDS = int(os.environ.get('QUOTA_RESERVATION_TTL_SECONDS', 6 * 3600))
+QUOTA_KEY_TTL_SECONDS = int(os.environ.get('QUOTA_KEY_TTL_SECONDS', 24 * 3600))
+QUOTA_RECONCILE_SECONDS = float(os.environ.get('QUOTA_RECONCILE_SECONDS', 600))
+
+# Envio com inputs idênticos ao de um report criado há menos que isso (mesmo usuário)
+# devolve o report existente em vez de abrir outro pipeline (chatbot/dedup.py)
+DUPLICATE_SUBMISSION_WINDOW_SECONDS = int(os.environ.get('DUPLICATE_SUBMISSION_WINDOW_SECONDS', 600))
+
+# Caixa de saída de emails (users/outbox.py): a cada EMAIL_OUTBOX_DRAIN_SECONDS o beat
+# dispara a drenagem, que envia até MAX_BATCHES lotes de BATCH_SIZE por uma só conexão.
+# Falhas são reenviadas após RETRY_SECONDS, dobrando a cada tentativa, até MAX_ATTEMPTS.
+EMAIL_OUTBOX_DRAIN_SECONDS = float(os.environ.get('EMAIL_OUTBOX_DRAIN_SECONDS', 10))
+EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', 50))
+EMAIL_OUTBOX_MAX_BATCHES = int(os.environ.get('EMAIL_OUTBOX_MAX_BATCHES', 20))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 5))
+EMAIL_OUTBOX_RETRY_SECONDS = int(os.environ.get('EMAIL_OUTBOX_RETRY_SECONDS', 60))
+# Testes/desenvolvimento sem worker: emails transacionais são enviados no próprio processo
+EMAIL_OUTBOX_SEND_INLINE = os.environ.get('EMAIL_OUTBOX_SEND_INLINE', 'False') == 'True'
+
+# O beat roda embutido no worker (flag -B, ver Dockerfile.worker): só um worker deve usá-la
+CELERY_BEAT_SCHEDULE = {
+    'drain-email-outbox': {
+        'task': 'users.tasks.drain_email_outbox',
+        'schedule': EMAIL_OUTBOX_DRAIN_SECONDS,
+        # Com o worker parado, disparos atrasados expiram em vez de se acumular
+        'options': {'expires': EMAIL_OUTBOX_DRAIN_SECONDS},
+    },
+    'reconcile-usage-quotas': {
+        'task': 'chatbot.tasks.reconcile_usage_quotas',
+        'schedule': QUOTA_RECONCILE_SECONDS,
+        'options': {'expires': QUOTA_RECONCILE_SECONDS},
+    },
+}
+
+# Sobrescrevíveis para teste: EMAIL_BACKEND=django.core.mail.backends.locmem.EmailBackend
+# ou um SMTP local (EMAIL_HOST=localhost EMAIL_PORT=1025 EMAIL_USE_TLS=False)
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'True') == 'True'
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', EMAIL_HOST_USER)
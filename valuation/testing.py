@@ -0,0 +1,49 @@
+# valuation/testing.py
+"""Fixtures compartilhadas pelos tests.py dos apps."""
+from unittest import mock
+
+import fakeredis
+from django.contrib.auth import get_user_model
+
+from reports.models import ValuationReport
+
+
+class FakeRedisMixin:
+    """
+    Troca o Redis compartilhado (valuation.redis_client) por um fakeredis com Lua
+    e descarta os scripts já registrados no cliente anterior.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        for target, value in (
+            ('valuation.redis_client._client', self.redis),
+            ('valuation.redis_client._cache_client', self.redis),
+            ('chatbot.rate_limit._script', None),
+            ('chatbot.quota._scripts', {}),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+def make_user(cnpj='11222333000181', **extra):
+    extra.setdefault('is_active', True)
+    return get_user_model().objects.create_user(
+        cnpj=cnpj, email=f'{cnpj}@example.com', razao_social=f'Empresa {cnpj}', password='senha-forte-123', **extra
+    )
+
+
+def make_report(user, status=ValuationReport.StatusChoices.PROCESSING, **result_data):
+    return ValuationReport.objects.create(
+        user=user,
+        status=status,
+        inputs_data={'setor_atuacao': 'Tecnologia'},
+        result_data={
+            'indicadores': {'faturamento_anual': 1000.0},
+            'valores_criterios': [],
+            'valuation_base': 5000.0,
+            **result_data,
+        },
+    )